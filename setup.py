@@ -37,7 +37,9 @@ setup(
         "somaticseq/somatic_vcf2tsv.py",
         "somaticseq/somatic_xgboost.py",
         "somaticseq/somatic_tsv2vcf.py",
+        "somaticseq/sequence_context_track.py",
         "somaticseq/genomic_file_parsers/concat.py",
+        "somaticseq/genomic_file_parsers/known_sites_index.py",
         "somaticseq/utilities/linguistic_sequence_complexity.py",
         "somaticseq/utilities/lociCounterWithLabels.py",
         "somaticseq/utilities/paired_end_bam2fastq.py",
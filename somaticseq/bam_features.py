@@ -1,19 +1,36 @@
-from collections import defaultdict
+import hashlib
+import heapq
+from bisect import bisect_left
+from collections.abc import Collection, Iterable, Sequence
 
+import numpy as np
 import pysam
-import scipy.stats as stats
 from pydantic import BaseModel
 
+from somaticseq.defaults import BAM_BLOCK_MAX_GAP
 from somaticseq.genomic_file_parsers.read_info_extractor import (
-    CIGAR_SOFT_CLIP,
     AlignmentType,
+    ParsedRead,
+    ReadCache,
+    SequencingCall,
     alignment_in_read_for_coordinate,
     dedup_test,
-    mean,
 )
+from somaticseq.statistical_tests import fisher_exact_pvalue, mannwhitneyu_pvalue
 
 nan = float("nan")
 
+# Output column of every statistical test of BamFeatures in vcf2tsv, after
+# nBAM_ or tBAM_
+BAM_TEST_COLUMNS = {
+    "p_mannwhitneyu_mq": "p_MannWhitneyU_MQ",
+    "p_mannwhitneyu_bq": "p_MannWhitneyU_BQ",
+    "p_mannwhitneyu_endpos": "p_MannWhitneyU_EndPos",
+    "concordance_fet": "Concordance_FET",
+    "strandbias_fet": "StrandBias_FET",
+    "clipping_fet": "Clipping_FET",
+}
+
 
 class BamFeatures(BaseModel):
     dp: int = 0
@@ -52,6 +69,8 @@ class BamFeatures(BaseModel):
     alt_indel_2bp: int = 0
     alt_indel_1bp: int = 0
     indel_length: int = 0
+    # Whether the features other than dp are from a sample of the reads
+    downsampled: bool = False
 
     @classmethod
     def from_alignment_file(
@@ -62,308 +81,611 @@ class BamFeatures(BaseModel):
         first_alt: str,
         min_mq: int = 1,
         min_bq: int = 10,
+        read_cache: ReadCache | None = None,
     ) -> BaseModel:  # typing.Self in python>=3.11
-        indel_length = len(first_alt) - len(ref_base)
-
-        reads = bam_fh.fetch(my_coordinate[0], my_coordinate[1] - 1, my_coordinate[1])
-        ref_read_mq = []
-        alt_read_mq = []
-        ref_read_bq = []
-        alt_read_bq = []
-        ref_edit_distance = []
-        alt_edit_distance = []
-        ref_pos_from_end = []
-        alt_pos_from_end = []
-        ref_flanking_indel = []
-        alt_flanking_indel = []
-        ref_concordant_reads = 0
-        alt_concordant_reads = 0
-        ref_discordant_reads = 0
-        alt_discordant_reads = 0
-        ref_for = 0
-        ref_rev = 0
-        alt_for = 0
-        alt_rev = 0
-        dp = 0
-        ref_SC_reads = 0
-        alt_SC_reads = 0
-        ref_notSC_reads = 0
-        alt_notSC_reads = 0
-        mq0_reads = 0
-        noise_read_count = 0
-        poor_read_count = 0
-        qname_collector: dict[str, list[int]] = defaultdict(list)
+        return cls.from_alignment_file_for_sites(
+            bam_fh=bam_fh,
+            contig=my_coordinate[0],
+            sites=[(my_coordinate[1], ref_base, first_alt)],
+            min_mq=min_mq,
+            min_bq=min_bq,
+            read_cache=read_cache,
+        )[0]
+
+    @classmethod
+    def from_alignment_file_for_alleles(
+        cls,
+        bam_fh: pysam.AlignmentFile,
+        my_coordinate: tuple[str, int, int],
+        ref_base: str,
+        alt_alleles: Sequence[str],
+        min_mq: int = 1,
+        min_bq: int = 10,
+        read_cache: ReadCache | None = None,
+    ) -> list[BaseModel]:
+        """
+        Extract BamFeatures for every ALT allele of a multi-allelic site. Each
+        read is classified once at the coordinate and tallied against all the
+        alleles.
+
+        Args:
+            bam_fh: pysam.AlignmentFile
+            my_coordinate: (contig, 1-based position, 1-based position)
+            ref_base: reference base(s) of the site
+            alt_alleles: list of ALT alleles at the site
+            min_mq: minimum mapping quality
+            min_bq: minimum base quality
+            read_cache: ReadCache of bam_fh shared across calls
+
+        Returns:
+            list of BamFeatures in the same order as alt_alleles
+        """
+        return cls.from_alignment_file_for_sites(
+            bam_fh=bam_fh,
+            contig=my_coordinate[0],
+            sites=[(my_coordinate[1], ref_base, alt) for alt in alt_alleles],
+            min_mq=min_mq,
+            min_bq=min_bq,
+            read_cache=read_cache,
+        )
+
+    @classmethod
+    def from_alignment_file_for_sites(
+        cls,
+        bam_fh: pysam.AlignmentFile,
+        contig: str,
+        sites: Sequence[tuple[int, str, str]],
+        min_mq: int = 1,
+        min_bq: int = 10,
+        read_cache: ReadCache | None = None,
+        skipped_tests: Collection[str] = (),
+        reads: Iterable[pysam.AlignedSegment] | None = None,
+        max_reads: int | None = None,
+        downsample_seed: int = 0,
+    ) -> list[BaseModel]:
+        """
+        Extract BamFeatures for many candidate sites on the same contig while
+        sweeping the alignment file only once. Every read is routed to all the
+        sites it covers, so a read spanning a cluster of candidates is only
+        decoded once, and only classified once at a multi-allelic coordinate.
+
+        Args:
+            bam_fh: pysam.AlignmentFile
+            contig: contig of all the sites
+            sites: list of (1-based position, ref_base, first_alt)
+            min_mq: minimum mapping quality
+            min_bq: minimum base quality
+            read_cache: ReadCache of bam_fh shared across calls, so the reads
+                of neighbouring blocks are only parsed once. Only the reads
+                that start before the first site, or that reach
+                BAM_BLOCK_MAX_GAP past the last site (i.e., into the next
+                block), are looked up in and put into it.
+            skipped_tests: statistical tests of BlockTally.STATISTICAL_TESTS
+                that are not computed and left as nan
+            reads: the reads of fetch_reads_for_sites(bam_fh, contig, sites),
+                if already fetched, e.g., ahead of time in another thread
+            max_reads: if a site is covered by more reads, its features are
+                computed from max_reads reads sampled by DepthReservoir,
+                except for dp, which is still the number of all the reads
+            downsample_seed: seed of DepthReservoir
+
+        Returns:
+            list of BamFeatures in the same order as the input sites
+        """
+        if not sites:
+            return []
+
+        # Distinct 0-based coordinates in sorted order, each with the indices of
+        # all the sites at that coordinate, so the read is only classified once
+        # per coordinate however many ALT alleles are there.
+        site_order = sorted(range(len(sites)), key=lambda i: sites[i][0])
+        coordinates: list[int] = []
+        sites_at_coordinate: list[list[int]] = []
+        for i in site_order:
+            if not coordinates or coordinates[-1] != sites[i][0] - 1:
+                coordinates.append(sites[i][0] - 1)
+                sites_at_coordinate.append([])
+            sites_at_coordinate[-1].append(i)
+
+        block_tally = BlockTally(
+            [(ref_base, first_alt) for _, ref_base, first_alt in sites],
+            min_mq,
+            min_bq,
+            skipped_tests=skipped_tests,
+        )
+        # Reads that may be shared with the previous or the next block
+        lookup_before = cache_after = None
+        if read_cache is not None:
+            read_cache.evict_before(bam_fh.get_tid(contig), coordinates[0])
+            if read_cache:
+                lookup_before = coordinates[0]
+            cache_after = coordinates[-1] + 1 + BAM_BLOCK_MAX_GAP
+
+        def parse_read(read: pysam.AlignedSegment, read_end: int) -> ParsedRead:
+            if read_cache is not None and (
+                (lookup_before is not None and read.reference_start < lookup_before)
+                or read_end > cache_after
+            ):
+                return read_cache.parse(read)
+            return ParsedRead(read)
+
+        def tally_read(
+            coordinate_i: int, read: pysam.AlignedSegment, parsed_read: ParsedRead
+        ) -> None:
+            sequencing_call = alignment_in_read_for_coordinate(
+                read, coordinates[coordinate_i], parsed_read=parsed_read
+            )
+            for site_i in sites_at_coordinate[coordinate_i]:
+                block_tally.add_read(site_i, read, sequencing_call, parsed_read)
+
+        # With a depth cap, the reads are only parsed and tallied once the
+        # sample of every coordinate is known
+        reservoirs = (
+            [DepthReservoir(max_reads, downsample_seed) for _ in coordinates]
+            if max_reads
+            else None
+        )
+        if reads is None:
+            reads = bam_fh.fetch(contig, coordinates[0], coordinates[-1] + 1)
         for read in reads:
             if not read.is_unmapped and dedup_test(read):
-                assert read.query_name is not None  # type checking
-                assert read.cigartuples is not None  # type checking
-                assert read.query_qualities is not None  # type checking
-                dp += 1
-                sequencing_call = alignment_in_read_for_coordinate(
-                    read, my_coordinate[1] - 1
-                )
-                if (
-                    read.mapping_quality < min_mq
-                    and mean(read.query_qualities) < min_bq
-                ):
-                    poor_read_count += 1
-
-                if read.mapping_quality == 0:
-                    mq0_reads += 1
-
-                # Reference calls:
-                if (
-                    sequencing_call.call_type == AlignmentType.match
-                    and sequencing_call.base_call == ref_base[0]
-                ):
-                    assert sequencing_call.position_on_read is not None
-                    qname_collector[read.query_name].append(0)
-                    ref_read_mq.append(read.mapping_quality)
-                    ref_read_bq.append(
-                        read.query_qualities[sequencing_call.position_on_read]
-                    )
-                    try:
-                        ref_edit_distance.append(read.get_tag("NM"))
-                    except KeyError:
-                        pass
-
-                    # Concordance
-                    if (
-                        read.is_proper_pair
-                        and read.mapping_quality >= min_mq
-                        and read.query_qualities[sequencing_call.position_on_read]
-                        >= min_bq
-                    ):
-                        ref_concordant_reads += 1
-                    elif (
-                        (not read.is_proper_pair)
-                        and read.mapping_quality >= min_mq
-                        and read.query_qualities[sequencing_call.position_on_read]
-                        >= min_bq
-                    ):
-                        ref_discordant_reads += 1
-
-                    # Orientation
-                    if (
-                        (not read.is_reverse)
-                        and read.mapping_quality >= min_mq
-                        and read.query_qualities[sequencing_call.position_on_read]
-                        >= min_bq
-                    ):
-                        ref_for += 1
-                    elif (
-                        read.is_reverse
-                        and read.mapping_quality >= min_mq
-                        and read.query_qualities[sequencing_call.position_on_read]
-                        >= min_bq
-                    ):
-                        ref_rev += 1
-
-                    # Soft-clipped reads?
-                    if (
-                        read.cigartuples[0][0] == CIGAR_SOFT_CLIP
-                        or read.cigartuples[-1][0] == CIGAR_SOFT_CLIP
-                    ):
-                        ref_SC_reads += 1
-                    else:
-                        ref_notSC_reads += 1
-
-                    # Distance from the end of the read:
-                    ref_pos_from_end.append(
-                        min(
-                            sequencing_call.position_on_read,
-                            read.query_length - sequencing_call.position_on_read,
-                        )
-                    )
-                    # Flanking indels:
-                    ref_flanking_indel.append(sequencing_call.nearest_indel)
-
-                # Alternate calls: SNV, or Deletion, or Insertion where I do not
-                # check for matching indel length
-                elif (
-                    (
-                        indel_length == 0
-                        and sequencing_call.call_type == AlignmentType.match
-                        and sequencing_call.base_call == first_alt
-                    )
-                    or (
-                        indel_length < 0
-                        and sequencing_call.call_type == AlignmentType.deletion
-                        and indel_length == sequencing_call.indel_length
-                    )
-                    or (
-                        indel_length > 0
-                        and sequencing_call.call_type == AlignmentType.insertion
-                    )
-                ):
-                    assert sequencing_call.position_on_read is not None
-                    qname_collector[read.query_name].append(1)
-                    alt_read_mq.append(read.mapping_quality)
-                    alt_read_bq.append(
-                        read.query_qualities[sequencing_call.position_on_read]
+                # Same overlap definition as bam_fh.fetch(contig, pos-1, pos)
+                read_end = read.reference_end or read.reference_start + 1
+                first_site = bisect_left(coordinates, read.reference_start)
+                last_site = bisect_left(coordinates, read_end)
+                if first_site == last_site:
+                    continue
+                if reservoirs is not None:
+                    for coordinate_i in range(first_site, last_site):
+                        reservoirs[coordinate_i].add(read)
+                    continue
+                parsed_read = parse_read(read, read_end)
+                for coordinate_i in range(first_site, last_site):
+                    tally_read(coordinate_i, read, parsed_read)
+
+        # A read sampled at several coordinates is only parsed once
+        sampled_reads: dict[int, ParsedRead] = {}
+        for coordinate_i, reservoir in enumerate(reservoirs or ()):
+            for read in reservoir.sample():
+                parsed_read = sampled_reads.get(id(read))
+                if parsed_read is None:
+                    parsed_read = parse_read(
+                        read, read.reference_end or read.reference_start + 1
                     )
-                    try:
-                        alt_edit_distance.append(read.get_tag("NM"))
-                    except KeyError:
-                        pass
-                    # Concordance
-                    if (
-                        read.is_proper_pair
-                        and read.mapping_quality >= min_mq
-                        and read.query_qualities[sequencing_call.position_on_read]
-                        >= min_bq
-                    ):
-                        alt_concordant_reads += 1
-                    elif (
-                        (not read.is_proper_pair)
-                        and read.mapping_quality >= min_mq
-                        and read.query_qualities[sequencing_call.position_on_read]
-                        >= min_bq
-                    ):
-                        alt_discordant_reads += 1
-                    # Orientation
-                    if (
-                        (not read.is_reverse)
-                        and read.mapping_quality >= min_mq
-                        and read.query_qualities[sequencing_call.position_on_read]
-                        >= min_bq
-                    ):
-                        alt_for += 1
-                    elif (
-                        read.is_reverse
-                        and read.mapping_quality >= min_mq
-                        and read.query_qualities[sequencing_call.position_on_read]
-                        >= min_bq
-                    ):
-                        alt_rev += 1
-                    # Soft-clipped reads?
-                    if (
-                        read.cigartuples[0][0] == CIGAR_SOFT_CLIP
-                        or read.cigartuples[-1][0] == CIGAR_SOFT_CLIP
-                    ):
-                        alt_SC_reads += 1
-                    else:
-                        alt_notSC_reads += 1
-
-                    # Distance from the end of the read:
-                    if sequencing_call.position_on_read is not None:
-                        alt_pos_from_end.append(
-                            min(
-                                sequencing_call.position_on_read,
-                                read.query_length - sequencing_call.position_on_read,
-                            )
-                        )
-                    # Flanking indels:
-                    alt_flanking_indel.append(sequencing_call.nearest_indel)
-
-                # Inconsistent read or 2nd alternate calls:
-                else:
-                    qname_collector[read.query_name].append(2)
-                    noise_read_count += 1
-
-        # Done extracting info from tumor BAM. Now tally them:
-        ref_mq = mean(ref_read_mq)
-        alt_mq = mean(alt_read_mq)
-        try:
-            p_mannwhitneyu_mq = stats.mannwhitneyu(
-                alt_read_mq, ref_read_mq, use_continuity=True, alternative="less"
-            )[1]
-        except ValueError:
-            if len(alt_read_mq) > 0 and len(ref_read_mq) > 0:
-                p_mannwhitneyu_mq = 0.5
-            else:
-                p_mannwhitneyu_mq = nan
-
-        ref_bq = mean(ref_read_bq)
-        alt_bq = mean(alt_read_bq)
-        try:
-            p_mannwhitneyu_bq = stats.mannwhitneyu(
-                alt_read_bq, ref_read_bq, use_continuity=True, alternative="less"
-            )[1]
-        except ValueError:
-            if len(alt_read_bq) > 0 and len(ref_read_bq) > 0:
-                p_mannwhitneyu_bq = 0.5
-            else:
-                p_mannwhitneyu_bq = nan
-
-        ref_nm = mean(ref_edit_distance)
-        alt_nm = mean(alt_edit_distance)
-        nm_diff = alt_nm - ref_nm - abs(indel_length)
-        concordance_fet = stats.fisher_exact(
+                    sampled_reads[id(read)] = parsed_read
+                tally_read(coordinate_i, read, parsed_read)
+            for site_i in sites_at_coordinate[coordinate_i]:
+                block_tally.unsampled_reads[site_i] = reservoir.num_unsampled
+
+        return [cls(**features) for features in block_tally.features()]
+
+
+def fetch_reads_for_sites(
+    bam_fh: pysam.AlignmentFile,
+    contig: str,
+    sites: Sequence[tuple[int, str, str]],
+) -> list[pysam.AlignedSegment]:
+    """
+    All the reads that BamFeatures.from_alignment_file_for_sites would fetch
+    for the sites on the same contig (see its arguments).
+    """
+    if not sites:
+        return []
+    positions = [position for position, _, _ in sites]
+    return list(bam_fh.fetch(contig, min(positions) - 1, max(positions)))
+
+
+class DepthReservoir:
+    """
+    Reads covering a candidate site, sampled down to max_reads reads if there
+    are more. Every read's priority is a seeded hash of its name, and the reads
+    of the lowest priorities are kept. The sample is stratified by strand,
+    i.e., it has the same proportion of forward and reverse reads as all the
+    reads, so the strand bias test stays meaningful. The sample only depends on
+    the seed and the reads, not on their order.
+    """
+
+    def __init__(self, max_reads: int, seed: int = 0) -> None:
+        self.max_reads = max_reads
+        self.salt = (seed % 2**64).to_bytes(8, "little")
+        self.num_reads = [0, 0]
+        # Max-heaps (by negated priority) of the lowest-priority reads of the
+        # forward and the reverse strands
+        self.lowest: tuple[list, list] = ([], [])
+
+    def priority(self, read: pysam.AlignedSegment) -> int:
+        assert read.query_name is not None  # type checking
+        digest = hashlib.blake2b(
+            read.query_name.encode(), digest_size=8, salt=self.salt
+        ).digest()
+        return int.from_bytes(digest, "little")
+
+    def add(self, read: pysam.AlignedSegment) -> None:
+        strand = int(read.is_reverse)
+        self.num_reads[strand] += 1
+        entry = (-self.priority(read), self.num_reads[strand], read)
+        lowest = self.lowest[strand]
+        if len(lowest) < self.max_reads:
+            heapq.heappush(lowest, entry)
+        elif entry > lowest[0]:
+            heapq.heapreplace(lowest, entry)
+
+    @property
+    def depth(self) -> int:
+        return sum(self.num_reads)
+
+    @property
+    def num_unsampled(self) -> int:
+        return max(0, self.depth - self.max_reads)
+
+    def sample(self) -> list[pysam.AlignedSegment]:
+        """All the reads, or max_reads reads stratified by strand."""
+        if self.depth <= self.max_reads:
+            return [read for lowest in self.lowest for _, _, read in lowest]
+        forward_depth = round(self.max_reads * self.num_reads[0] / self.depth)
+        sample = []
+        for lowest, strand_depth in zip(
+            self.lowest, (forward_depth, self.max_reads - forward_depth)
+        ):
+            sample.extend(read for _, _, read in heapq.nlargest(strand_depth, lowest))
+        return sample
+
+
+# Classes of a read's call at a candidate site
+REF_CALL = 0
+ALT_CALL = 1
+NOISE_CALL = 2
+
+
+class BlockTally:
+    """
+    Per-read observations at a block of candidate sites, appended as rows into
+    preallocated NumPy arrays with a site index column, and summarized into
+    the values of BamFeatures for all the sites together in vectorized passes.
+    """
+
+    _columns = (
+        "site",
+        "call",
+        "qname",
+        "mq",
+        "bq",
+        "edit_distance",
+        "pos_from_end",
+        "flanking_indel",
+        "is_proper_pair",
+        "is_reverse",
+        "soft_clipped",
+        "poor_read",
+    )
+    # BamFeatures of the rank-sum and Fisher's exact tests, which may be skipped
+    STATISTICAL_TESTS = (
+        "p_mannwhitneyu_mq",
+        "p_mannwhitneyu_bq",
+        "p_mannwhitneyu_endpos",
+        "concordance_fet",
+        "strandbias_fet",
+        "clipping_fet",
+    )
+
+    def __init__(
+        self,
+        alleles: Sequence[tuple[str, str]],
+        min_mq: int = 1,
+        min_bq: int = 10,
+        capacity: int = 1024,
+        skipped_tests: Collection[str] = (),
+    ) -> None:
+        """
+        Args:
+            alleles: (ref_base, first_alt) of every site in the block
+            min_mq: minimum mapping quality
+            min_bq: minimum base quality
+            capacity: number of rows to preallocate, which is doubled whenever
+                the arrays are full
+            skipped_tests: STATISTICAL_TESTS not to compute, which are nan
+        """
+        unknown_tests = set(skipped_tests) - set(self.STATISTICAL_TESTS)
+        if unknown_tests:
+            raise ValueError(f"Unknown statistical tests: {sorted(unknown_tests)}")
+        self.skipped_tests = frozenset(skipped_tests)
+        self.alleles = list(alleles)
+        self.indel_lengths = [len(alt) - len(ref) for ref, alt in self.alleles]
+        self.min_mq = min_mq
+        self.min_bq = min_bq
+        self.num_rows = 0
+        self.qname_ids: dict[str, int] = {}
+        # Reads covering each site but not added, i.e., sampled out by
+        # DepthReservoir. They are only counted in dp.
+        self.unsampled_reads = np.zeros(len(self.alleles), dtype=np.int64)
+        self.site = np.empty(capacity, dtype=np.int32)
+        self.call = np.empty(capacity, dtype=np.int8)
+        self.qname = np.empty(capacity, dtype=np.int64)
+        self.mq = np.empty(capacity, dtype=np.int32)
+        self.bq = np.empty(capacity, dtype=np.int32)
+        self.edit_distance = np.empty(capacity, dtype=np.int32)
+        self.pos_from_end = np.empty(capacity, dtype=np.int32)
+        self.flanking_indel = np.empty(capacity, dtype=np.float64)
+        self.is_proper_pair = np.empty(capacity, dtype=np.bool_)
+        self.is_reverse = np.empty(capacity, dtype=np.bool_)
+        self.soft_clipped = np.empty(capacity, dtype=np.bool_)
+        self.poor_read = np.empty(capacity, dtype=np.bool_)
+
+    def _grow(self) -> None:
+        for column in self._columns:
+            array = getattr(self, column)
+            grown = np.empty(2 * len(array), dtype=array.dtype)
+            grown[: len(array)] = array
+            setattr(self, column, grown)
+
+    def add_read(
+        self,
+        site_i: int,
+        read: pysam.AlignedSegment,
+        sequencing_call: SequencingCall,
+        parsed_read: ParsedRead,
+    ) -> None:
+        """
+        Add a mapped (and deduplicated) read covering the site_i'th site, with
+        sequencing_call being its alignment at the site.
+        """
+        assert read.query_name is not None  # type checking
+        assert parsed_read.query_qualities is not None  # type checking
+        ref_base, first_alt = self.alleles[site_i]
+        indel_length = self.indel_lengths[site_i]
+
+        # Reference calls:
+        if (
+            sequencing_call.call_type == AlignmentType.match
+            and sequencing_call.base_call == ref_base[0]
+        ):
+            call = REF_CALL
+        # Alternate calls: SNV, or Deletion, or Insertion where I do not check
+        # for matching indel length
+        elif (
             (
-                (ref_concordant_reads, alt_concordant_reads),
-                (ref_discordant_reads, alt_discordant_reads),
+                indel_length == 0
+                and sequencing_call.call_type == AlignmentType.match
+                and sequencing_call.base_call == first_alt
+            )
+            or (
+                indel_length < 0
+                and sequencing_call.call_type == AlignmentType.deletion
+                and indel_length == sequencing_call.indel_length
+            )
+            or (
+                indel_length > 0
+                and sequencing_call.call_type == AlignmentType.insertion
             )
-        )[1]
-        strandbias_fet = stats.fisher_exact(((ref_for, alt_for), (ref_rev, alt_rev)))[1]
-        clipping_fet = stats.fisher_exact(
-            ((ref_notSC_reads, alt_notSC_reads), (ref_SC_reads, alt_SC_reads))
-        )[1]
-
-        try:
-            p_mannwhitneyu_endpos = stats.mannwhitneyu(
-                alt_pos_from_end,
-                ref_pos_from_end,
+        ):
+            call = ALT_CALL
+        # Inconsistent read or 2nd alternate calls:
+        else:
+            call = NOISE_CALL
+
+        row = self.num_rows
+        if row == len(self.site):
+            self._grow()
+        self.num_rows += 1
+
+        self.site[row] = site_i
+        self.call[row] = call
+        self.qname[row] = self.qname_ids.setdefault(
+            read.query_name, len(self.qname_ids)
+        )
+        self.mq[row] = read.mapping_quality
+        self.poor_read[row] = (
+            read.mapping_quality < self.min_mq
+            and parsed_read.mean_base_quality < self.min_bq
+        )
+        if call == NOISE_CALL:
+            return
+
+        assert sequencing_call.position_on_read is not None
+        self.bq[row] = parsed_read.query_qualities[sequencing_call.position_on_read]
+        self.edit_distance[row] = (
+            -1 if parsed_read.edit_distance is None else parsed_read.edit_distance
+        )
+        self.pos_from_end[row] = min(
+            sequencing_call.position_on_read,
+            parsed_read.query_length - sequencing_call.position_on_read,
+        )
+        self.flanking_indel[row] = (
+            nan
+            if sequencing_call.nearest_indel is None
+            else sequencing_call.nearest_indel
+        )
+        self.is_proper_pair[row] = read.is_proper_pair
+        self.is_reverse[row] = read.is_reverse
+        self.soft_clipped[row] = parsed_read.soft_clipped
+
+    def features(self) -> list[dict]:
+        """
+        Tally the collected observations into the keyword arguments of
+        BamFeatures for every site.
+        """
+        num_sites = len(self.alleles)
+        num_rows = self.num_rows
+        site = self.site[:num_rows]
+        call = self.call[:num_rows]
+        mq = self.mq[:num_rows]
+        bq = self.bq[:num_rows]
+        edit_distance = self.edit_distance[:num_rows]
+        pos_from_end = self.pos_from_end[:num_rows]
+        flanking_indel = self.flanking_indel[:num_rows]
+
+        is_ref = call == REF_CALL
+        is_alt = call == ALT_CALL
+        good_quality = (mq >= self.min_mq) & (bq >= self.min_bq)
+        good_proper = good_quality & self.is_proper_pair[:num_rows]
+        good_improper = good_quality & ~self.is_proper_pair[:num_rows]
+        good_forward = good_quality & ~self.is_reverse[:num_rows]
+        good_reverse = good_quality & self.is_reverse[:num_rows]
+        soft_clipped = self.soft_clipped[:num_rows]
+
+        def count(mask: np.ndarray) -> list[int]:
+            return np.bincount(site[mask], minlength=num_sites).tolist()
+
+        def average(mask: np.ndarray, values: np.ndarray) -> list[float]:
+            totals = np.bincount(site[mask], weights=values[mask], minlength=num_sites)
+            counts = np.bincount(site[mask], minlength=num_sites)
+            with np.errstate(invalid="ignore"):
+                return (totals / counts).tolist()
+
+        dp = (np.bincount(site, minlength=num_sites) + self.unsampled_reads).tolist()
+        mq0_reads = count(mq == 0)
+        noise_read_count = count(call == NOISE_CALL)
+        poor_read_count = count(self.poor_read[:num_rows])
+        ref_for = count(is_ref & good_forward)
+        ref_rev = count(is_ref & good_reverse)
+        alt_for = count(is_alt & good_forward)
+        alt_rev = count(is_alt & good_reverse)
+        ref_concordant_reads = count(is_ref & good_proper)
+        ref_discordant_reads = count(is_ref & good_improper)
+        alt_concordant_reads = count(is_alt & good_proper)
+        alt_discordant_reads = count(is_alt & good_improper)
+        ref_sc_reads = count(is_ref & soft_clipped)
+        ref_notsc_reads = count(is_ref & ~soft_clipped)
+        alt_sc_reads = count(is_alt & soft_clipped)
+        alt_notsc_reads = count(is_alt & ~soft_clipped)
+        ref_mq = average(is_ref, mq)
+        alt_mq = average(is_alt, mq)
+        ref_bq = average(is_ref, bq)
+        alt_bq = average(is_alt, bq)
+        ref_nm = average(is_ref & (edit_distance >= 0), edit_distance)
+        alt_nm = average(is_alt & (edit_distance >= 0), edit_distance)
+        indel_1bp = flanking_indel == 1
+        indel_2bp = indel_1bp | (flanking_indel == 2)
+        indel_3bp = indel_2bp | (flanking_indel == 3)
+        ref_indel_1bp = count(is_ref & indel_1bp)
+        ref_indel_2bp = count(is_ref & indel_2bp)
+        ref_indel_3bp = count(is_ref & indel_3bp)
+        alt_indel_1bp = count(is_alt & indel_1bp)
+        alt_indel_2bp = count(is_alt & indel_2bp)
+        alt_indel_3bp = count(is_alt & indel_3bp)
+
+        # A read pair is consistent if both mates are alternate calls, and
+        # inconsistent if only one of them is.
+        pair_keys, pair_index, pair_sizes = np.unique(
+            site.astype(np.int64) * len(self.qname_ids) + self.qname[:num_rows],
+            return_inverse=True,
+            return_counts=True,
+        )
+        pair_alt_calls = np.bincount(pair_index, weights=is_alt)
+        pair_site = pair_keys // max(len(self.qname_ids), 1)
+        consistent_mates = np.bincount(
+            pair_site[(pair_sizes == 2) & (pair_alt_calls == 2)], minlength=num_sites
+        ).tolist()
+        inconsistent_mates = np.bincount(
+            pair_site[(pair_sizes == 2) & (pair_alt_calls == 1)], minlength=num_sites
+        ).tolist()
+
+        def rank_sum_test(
+            test: str, values: np.ndarray, alt: np.ndarray, ref: np.ndarray
+        ) -> float:
+            if test in self.skipped_tests:
+                return nan
+            return mannwhitneyu_pvalue(
+                values[alt].tolist(),
+                values[ref].tolist(),
                 use_continuity=True,
                 alternative="less",
-            )[1]
-        except ValueError:
-            if len(alt_pos_from_end) > 0 and len(ref_pos_from_end) > 0:
-                p_mannwhitneyu_endpos = 0.5
-            else:
-                p_mannwhitneyu_endpos = nan
-
-        ref_indel_1bp = ref_flanking_indel.count(1)
-        ref_indel_2bp = ref_flanking_indel.count(2) + ref_indel_1bp
-        ref_indel_3bp = ref_flanking_indel.count(3) + ref_indel_2bp
-        alt_indel_1bp = alt_flanking_indel.count(1)
-        alt_indel_2bp = alt_flanking_indel.count(2) + alt_indel_1bp
-        alt_indel_3bp = alt_flanking_indel.count(3) + alt_indel_2bp
-        consistent_mates = 0
-        inconsistent_mates = 0
-        for rp in qname_collector:
-            # Both are alternative calls:
-            if qname_collector[rp] == [1, 1]:
-                consistent_mates += 1
-            # One is alternate call but the other one is not:
-            elif len(qname_collector[rp]) == 2 and 1 in qname_collector[rp]:
-                inconsistent_mates += 1
-
-        return cls(
-            dp=dp,
-            ref_call_forward=ref_for,
-            ref_call_reverse=ref_rev,
-            alt_call_forward=alt_for,
-            alt_call_reverse=alt_rev,
-            consistent_mates=consistent_mates,
-            inconsistent_mates=inconsistent_mates,
-            ref_mq=ref_mq,
-            alt_mq=alt_mq,
-            p_mannwhitneyu_mq=p_mannwhitneyu_mq,
-            ref_bq=ref_bq,
-            alt_bq=alt_bq,
-            p_mannwhitneyu_bq=p_mannwhitneyu_bq,
-            ref_edit_distance=ref_nm,
-            alt_edit_distance=alt_nm,
-            edit_distance_difference=nm_diff,
-            ref_concordant_reads=ref_concordant_reads,
-            ref_discordant_reads=ref_discordant_reads,
-            alt_concordant_reads=alt_concordant_reads,
-            alt_discordant_reads=alt_discordant_reads,
-            concordance_fet=concordance_fet,
-            strandbias_fet=strandbias_fet,
-            ref_soft_clipped_reads=ref_SC_reads,
-            alt_soft_clipped_reads=alt_SC_reads,
-            clipping_fet=clipping_fet,
-            p_mannwhitneyu_endpos=p_mannwhitneyu_endpos,
-            mq0_reads=mq0_reads,
-            noise_read_count=noise_read_count,
-            poor_read_count=poor_read_count,
-            ref_indel_3bp=ref_indel_3bp,
-            ref_indel_2bp=ref_indel_2bp,
-            ref_indel_1bp=ref_indel_1bp,
-            alt_indel_3bp=alt_indel_3bp,
-            alt_indel_2bp=alt_indel_2bp,
-            alt_indel_1bp=alt_indel_1bp,
-            indel_length=indel_length,
-        )
+            )
+
+        def exact_test(test: str, table: tuple[tuple[int, int], ...]) -> float:
+            if test in self.skipped_tests:
+                return nan
+            return fisher_exact_pvalue(table)
+
+        # Rows grouped by site for the rank-sum tests
+        site_order = np.argsort(site, kind="stable")
+        site_bounds = np.searchsorted(site[site_order], np.arange(num_sites + 1))
+        sorted_call = call[site_order]
+        sorted_mq = mq[site_order]
+        sorted_bq = bq[site_order]
+        sorted_pos_from_end = pos_from_end[site_order]
+
+        bam_features = []
+        for site_i in range(num_sites):
+            start, end = site_bounds[site_i], site_bounds[site_i + 1]
+            site_ref = sorted_call[start:end] == REF_CALL
+            site_alt = sorted_call[start:end] == ALT_CALL
+            site_mq = sorted_mq[start:end]
+            site_bq = sorted_bq[start:end]
+            site_pos_from_end = sorted_pos_from_end[start:end]
+
+            p_mannwhitneyu_mq = rank_sum_test(
+                "p_mannwhitneyu_mq", site_mq, site_alt, site_ref
+            )
+            p_mannwhitneyu_bq = rank_sum_test(
+                "p_mannwhitneyu_bq", site_bq, site_alt, site_ref
+            )
+            p_mannwhitneyu_endpos = rank_sum_test(
+                "p_mannwhitneyu_endpos", site_pos_from_end, site_alt, site_ref
+            )
+            concordance_fet = exact_test(
+                "concordance_fet",
+                (
+                    (ref_concordant_reads[site_i], alt_concordant_reads[site_i]),
+                    (ref_discordant_reads[site_i], alt_discordant_reads[site_i]),
+                ),
+            )
+            strandbias_fet = exact_test(
+                "strandbias_fet",
+                (
+                    (ref_for[site_i], alt_for[site_i]),
+                    (ref_rev[site_i], alt_rev[site_i]),
+                ),
+            )
+            clipping_fet = exact_test(
+                "clipping_fet",
+                (
+                    (ref_notsc_reads[site_i], alt_notsc_reads[site_i]),
+                    (ref_sc_reads[site_i], alt_sc_reads[site_i]),
+                ),
+            )
+            indel_length = self.indel_lengths[site_i]
+            bam_features.append(
+                {
+                    "dp": dp[site_i],
+                    "ref_call_forward": ref_for[site_i],
+                    "ref_call_reverse": ref_rev[site_i],
+                    "alt_call_forward": alt_for[site_i],
+                    "alt_call_reverse": alt_rev[site_i],
+                    "consistent_mates": consistent_mates[site_i],
+                    "inconsistent_mates": inconsistent_mates[site_i],
+                    "ref_mq": ref_mq[site_i],
+                    "alt_mq": alt_mq[site_i],
+                    "p_mannwhitneyu_mq": p_mannwhitneyu_mq,
+                    "ref_bq": ref_bq[site_i],
+                    "alt_bq": alt_bq[site_i],
+                    "p_mannwhitneyu_bq": p_mannwhitneyu_bq,
+                    "ref_edit_distance": ref_nm[site_i],
+                    "alt_edit_distance": alt_nm[site_i],
+                    "edit_distance_difference": alt_nm[site_i]
+                    - ref_nm[site_i]
+                    - abs(indel_length),
+                    "ref_concordant_reads": ref_concordant_reads[site_i],
+                    "ref_discordant_reads": ref_discordant_reads[site_i],
+                    "alt_concordant_reads": alt_concordant_reads[site_i],
+                    "alt_discordant_reads": alt_discordant_reads[site_i],
+                    "concordance_fet": concordance_fet,
+                    "strandbias_fet": strandbias_fet,
+                    "ref_soft_clipped_reads": ref_sc_reads[site_i],
+                    "alt_soft_clipped_reads": alt_sc_reads[site_i],
+                    "clipping_fet": clipping_fet,
+                    "p_mannwhitneyu_endpos": p_mannwhitneyu_endpos,
+                    "mq0_reads": mq0_reads[site_i],
+                    "noise_read_count": noise_read_count[site_i],
+                    "poor_read_count": poor_read_count[site_i],
+                    "ref_indel_3bp": ref_indel_3bp[site_i],
+                    "ref_indel_2bp": ref_indel_2bp[site_i],
+                    "ref_indel_1bp": ref_indel_1bp[site_i],
+                    "alt_indel_3bp": alt_indel_3bp[site_i],
+                    "alt_indel_2bp": alt_indel_2bp[site_i],
+                    "alt_indel_1bp": alt_indel_1bp[site_i],
+                    "indel_length": indel_length,
+                    "downsampled": bool(self.unsampled_reads[site_i]),
+                }
+            )
+        return bam_features
@@ -0,0 +1,166 @@
+"""
+Candidate sites of vcf2tsv, read from a VCF file, a BED file, a list of
+positions, or the .fai file (i.e., whole genome), one coordinate at a time.
+Several sets of candidate sites (e.g., the SNVs and the INDELs of the same
+samples) are merged in coordinate order, so all of their features are
+extracted in a single pass over the BAM, reference, and annotation files.
+"""
+
+import heapq
+from collections.abc import Iterator
+from copy import copy
+from dataclasses import dataclass, field
+from typing import Literal
+
+import somaticseq.genomic_file_parsers.genomic_file_handlers as genome
+from somaticseq.genomic_file_parsers.read_info_extractor import genomic_coordinates
+
+SitesFormat = Literal["vcf", "bed", "pos", "fai"]
+
+
+@dataclass
+class CandidateSites:
+    """
+    A set of candidate sites to be written into its own TSV file, along with
+    the VCF files to annotate them with.
+
+    Attributes:
+        sites_file: the VCF, BED, positions list, or .fai file of the sites
+        sites_format: "vcf", "bed", "pos", or "fai"
+        outfile: the output TSV file
+        caller_vcfs: VCF file of the callers, keyed by their names in the
+            CALLER_ANNOTATORS of vcf2tsv
+        truth: VCF of true hits
+        arbitrary_vcfs: arbitrary extra VCFs
+    """
+
+    sites_file: str
+    sites_format: SitesFormat
+    outfile: str
+    caller_vcfs: dict[str, str | None] = field(default_factory=dict)
+    truth: str | None = None
+    arbitrary_vcfs: list[str] = field(default_factory=list)
+
+
+def read_candidate_sites(
+    sites_file: str, sites_format: SitesFormat, chrom_seq: dict[str, int]
+) -> Iterator[tuple[tuple[str, int], list[genome.VCFVariantRecord] | None]]:
+    """
+    Coordinates of the candidate sites in the order they are in sites_file.
+    A VCF file must be sorted. For a VCF file, every coordinate comes with its
+    variants, one per ALT allele of all the lines at the coordinate. The
+    other formats only have coordinates, so their variants are None. Reading
+    stops at the first empty line.
+
+    Args:
+        sites_file: VCF, BED, positions list, or .fai file
+        sites_format: "vcf", "bed", "pos", or "fai"
+        chrom_seq: order of the contigs in the reference
+
+    Yields:
+        (contig, 1-based position), and the variants at the coordinate
+    """
+    with genome.open_textfile(sites_file) as my_sites:
+        my_lines = (line_i.rstrip() for line_i in my_sites)
+        my_lines = (
+            line_i
+            for line_i in my_lines
+            if not line_i.startswith("#") and not line_i.startswith("track=")
+        )
+        if sites_format == "vcf":
+            yield from _read_vcf_sites(my_lines, sites_file, chrom_seq)
+            return
+
+        for my_line in my_lines:
+            if not my_line:
+                return
+            item = my_line.split("\t")
+            if sites_format == "bed":
+                my_coordinates = genomic_coordinates(
+                    item[0], int(item[1]) + 1, int(item[2])
+                )
+            elif sites_format == "pos":
+                my_coordinates = genomic_coordinates(
+                    item[0], int(item[1]), int(item[1])
+                )
+            else:
+                my_coordinates = genomic_coordinates(item[0], 1, int(item[1]))
+            for my_coordinate in my_coordinates:
+                yield my_coordinate, None
+
+
+def _read_vcf_sites(
+    my_lines: Iterator[str], sites_file: str, chrom_seq: dict[str, int]
+) -> Iterator[tuple[tuple[str, int], list[genome.VCFVariantRecord]]]:
+    my_coordinate = None
+    variants_at_my_coordinate: list[genome.VCFVariantRecord] = []
+    coordinate_i = None
+    for my_line in my_lines:
+        if not my_line:
+            break
+
+        # Make sure the input VCF file is properly sorted
+        coordinate_j = genome.line_coordinate_key(my_line, chrom_seq)
+        if coordinate_i is not None and coordinate_j < coordinate_i:
+            raise Exception(f"{sites_file} does not seem to be properly sorted.")
+        coordinate_i = coordinate_j
+
+        my_vcf = genome.VCFVariantRecord.from_vcf_line(my_line)
+        if my_coordinate != (my_vcf.chromosome, my_vcf.position):
+            if my_coordinate is not None:
+                yield my_coordinate, variants_at_my_coordinate
+            my_coordinate = (my_vcf.chromosome, my_vcf.position)
+            variants_at_my_coordinate = []
+
+        # Every ALT allele of the same coordinate
+        for alt_i in my_vcf.altbase.split(","):
+            vcf_i = copy(my_vcf)
+            vcf_i.altbase = alt_i
+            variants_at_my_coordinate.append(vcf_i)
+
+    if my_coordinate is not None:
+        yield my_coordinate, variants_at_my_coordinate
+
+
+def merge_candidate_sites(
+    all_candidate_sites: list[CandidateSites], chrom_seq: dict[str, int]
+) -> Iterator[tuple[int, tuple[str, int], list[genome.VCFVariantRecord] | None]]:
+    """
+    Coordinates of all the sets of candidate sites merged in coordinate order.
+    Sets of the same coordinate come in the order of all_candidate_sites.
+
+    Yields:
+        index of the set in all_candidate_sites, (contig, 1-based position),
+        and the variants at the coordinate (see read_candidate_sites)
+    """
+    if len(all_candidate_sites) == 1:
+        for my_coordinate, variants in read_candidate_sites(
+            all_candidate_sites[0].sites_file,
+            all_candidate_sites[0].sites_format,
+            chrom_seq,
+        ):
+            yield 0, my_coordinate, variants
+        return
+
+    readers = [
+        _keyed_candidate_sites(ith_set, candidate_sites, chrom_seq)
+        for ith_set, candidate_sites in enumerate(all_candidate_sites)
+    ]
+    for _, ith_set, my_coordinate, variants in heapq.merge(
+        *readers, key=lambda site: site[0]
+    ):
+        yield ith_set, my_coordinate, variants
+
+
+def _keyed_candidate_sites(
+    ith_set: int, candidate_sites: CandidateSites, chrom_seq: dict[str, int]
+) -> Iterator[tuple[int, int, tuple[str, int], list[genome.VCFVariantRecord] | None]]:
+    for my_coordinate, variants in read_candidate_sites(
+        candidate_sites.sites_file, candidate_sites.sites_format, chrom_seq
+    ):
+        yield (
+            genome.coordinate_key(my_coordinate[0], my_coordinate[1], chrom_seq),
+            ith_set,
+            my_coordinate,
+            variants,
+        )
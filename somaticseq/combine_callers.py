@@ -228,19 +228,11 @@ def combineSingle(
         indel_intermediates.append(arb_vcf_out)
         intermediate_vcfs["Arbitrary"]["indel"].append(arb_vcf_out)
 
-    # Combine SNV/INDEL variant candidates
-    snv_combined = os.sep.join((outdir, "unsorted.CombineVariants.snv.vcf"))
-    indel_combined = os.sep.join((outdir, "unsorted.CombineVariants.indel.vcf"))
-    getUniqueVcfPositions.combine(snv_intermediates, snv_combined)
-    getUniqueVcfPositions.combine(indel_intermediates, indel_combined)
-    for file_i in snv_combined, indel_combined:
-        intermediate_files.add(file_i)
-
-    # Sort them:
+    # Combine SNV/INDEL variant candidates, sorted in the order of the contigs
     snv_combined_sorted = os.sep.join((outdir, "CombineVariants.snv.vcf"))
     indel_combined_sorted = os.sep.join((outdir, "CombineVariants.indel.vcf"))
-    vcfsorter(ref, snv_combined, snv_combined_sorted)
-    vcfsorter(ref, indel_combined, indel_combined_sorted)
+    getUniqueVcfPositions.combine(snv_intermediates, snv_combined_sorted, ref)
+    getUniqueVcfPositions.combine(indel_intermediates, indel_combined_sorted, ref)
 
     if not keep_intermediates:
         for file_i in intermediate_files:
@@ -594,20 +586,11 @@ def combine_multiple_paired_caller_vcfs(
         indel_intermediates.append(arb_vcf_out)
         intermediate_vcfs["Arbitrary"]["indel"].append(arb_vcf_out)
 
-    # Combine SNV/INDEL variant candidates
-    snv_combined = os.sep.join((outdir, "unsorted.CombineVariants.snv.vcf"))
-    indel_combined = os.sep.join((outdir, "unsorted.CombineVariants.indel.vcf"))
-    getUniqueVcfPositions.combine(snv_intermediates, snv_combined)
-    getUniqueVcfPositions.combine(indel_intermediates, indel_combined)
-
-    for file_i in snv_combined, indel_combined:
-        intermediate_files.add(file_i)
-
-    # Sort them:
+    # Combine SNV/INDEL variant candidates, sorted in the order of the contigs
     snv_combined_sorted = os.sep.join((outdir, "CombineVariants.snv.vcf"))
     indel_combined_sorted = os.sep.join((outdir, "CombineVariants.indel.vcf"))
-    vcfsorter(ref, snv_combined, snv_combined_sorted)
-    vcfsorter(ref, indel_combined, indel_combined_sorted)
+    getUniqueVcfPositions.combine(snv_intermediates, snv_combined_sorted, ref)
+    getUniqueVcfPositions.combine(indel_intermediates, indel_combined_sorted, ref)
 
     if not keep_intermediates:
         for file_i in intermediate_files:
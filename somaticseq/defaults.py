@@ -21,3 +21,27 @@ NORMAL_NAME: str = "NORMAL"
 ALGORITHM: Literal["xgboost", "ada"] = "xgboost"
 DEFAULT_XGB_BOOST_ROUNDS: int = 500
 DEFAULT_NUM_TREES_PREDICT: int = 100
+
+# Candidate sites within this distance of each other are grouped into a block,
+# for which each BAM file is swept only once.
+BAM_BLOCK_MAX_GAP: int = 300
+BAM_BLOCK_MAX_SITES: int = 1000
+
+# Parsed reads kept for neighbouring candidate sites
+READ_CACHE_MAX_READS: int = 50_000
+READ_CACHE_MAX_BYTES: int = 256 * 1024**2
+
+# Reference sequence is read in blocks of this size for nearby candidate sites.
+# Each block overlaps the next one by the margin, so any slice up to the
+# margin long is in a single block.
+REFERENCE_BLOCK_SIZE: int = 1_000_000
+REFERENCE_BLOCK_MARGIN: int = 1_000
+
+# Reads supporting an ALT allele for a position to be a candidate site when the
+# BAM pileup of the input regions is scanned
+PILEUP_SCAN_MIN_ALT_READS: int = 2
+
+# Blocks of candidate sites (with their reads, if fetched) that the reader and
+# BAM-fetch stages of vcf2tsv --prefetch may run ahead of the feature
+# computation
+PREFETCH_MAX_BLOCKS: int = 4
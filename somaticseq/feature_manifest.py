@@ -0,0 +1,66 @@
+"""
+The features that a downstream classifier actually consumes, so vcf2tsv can
+skip computing the other (optional) features of its output TSV. Those are
+written as nan, so the TSV has the same columns either way.
+"""
+
+import re
+from collections.abc import Iterable
+
+FEATURE_NAME = re.compile(r"[A-Za-z0-9_]+")
+
+
+def read_feature_manifest(manifest: str) -> set[str]:
+    """
+    Args:
+        manifest: either a text file with one feature name per line (lines
+            starting with # are ignored), or a trained SomaticSeq xgboost
+            classifier, whose feature names are used.
+
+    Returns:
+        set of feature names
+    """
+    try:
+        with open(manifest) as fn:
+            lines = [line_i.strip() for line_i in fn]
+        feature_names = [
+            line_i for line_i in lines if line_i and not line_i.startswith("#")
+        ]
+        if all(FEATURE_NAME.fullmatch(feature_i) for feature_i in feature_names):
+            return set(feature_names)
+    except UnicodeDecodeError:
+        pass
+
+    # Not a list of features, so it should be a classifier
+    import xgboost as xgb
+
+    xgb_model = xgb.Booster(model_file=manifest)
+    if not xgb_model.feature_names:
+        raise ValueError(f"{manifest} does not have the names of its features.")
+    return set(xgb_model.feature_names)
+
+
+def read_feature_manifests(manifests: str | Iterable[str]) -> set[str]:
+    """
+    The features of one or more manifests (see read_feature_manifest), e.g.,
+    of the SNV and the INDEL classifiers whose TSV files are extracted in a
+    single pass.
+    """
+    if isinstance(manifests, str):
+        manifests = [manifests]
+    feature_names = set()
+    for manifest_i in manifests:
+        feature_names.update(read_feature_manifest(manifest_i))
+    return feature_names
+
+
+def skipped_features(
+    optional_features: Iterable[str], manifest: set[str] | None = None
+) -> set[str]:
+    """
+    The optional features not in the manifest. None means all features are
+    consumed, so nothing is skipped.
+    """
+    if manifest is None:
+        return set()
+    return {feature_i for feature_i in optional_features if feature_i not in manifest}
@@ -0,0 +1,175 @@
+"""
+Estimate how many reads a BAM file has in every window of its contigs from its
+.bai or .csi index alone, i.e., without reading the BAM file itself.
+
+Every bin of the index lists the chunks of the BAM file that hold the reads of
+the bin, as virtual file offsets (i.e., the offset of a BGZF block in the
+compressed file << 16 | the offset in the uncompressed block). The compressed
+bytes of a bin's chunks are proportional to its reads, and are scaled to the
+number of mapped reads of the contig, which the index keeps in a pseudo-bin
+(i.e., samtools idxstats). The reads of a bin bigger than a window are spread
+evenly over the windows of the bin.
+"""
+
+import gzip
+import os
+import struct
+
+import numpy as np
+import pysam
+
+# Windows of the estimates, i.e., the smallest bins of a .bai index
+WINDOW_SIZE = 2**14
+
+# Bins of a .bai index, which is like a .csi index with these parameters
+BAI_MIN_SHIFT = 14
+BAI_DEPTH = 5
+
+# Typical compression ratio of BGZF blocks of a BAM file, to estimate the
+# compressed bytes of a chunk within a single block
+BGZF_COMPRESSION_RATIO = 3.0
+
+
+def find_bam_index(bam_file: str) -> str | None:
+    """
+    Path of the .bai or .csi index of a BAM file, or None if there is not one.
+    """
+    candidates = [bam_file + ".bai", bam_file + ".csi"]
+    if bam_file.endswith(".bam"):
+        candidates.insert(1, bam_file[: -len(".bam")] + ".bai")
+    for index_file in candidates:
+        if os.path.exists(index_file):
+            return index_file
+    return None
+
+
+def _compressed_position(virtual_offsets: np.ndarray) -> np.ndarray:
+    return (virtual_offsets >> 16) + (virtual_offsets & 0xFFFF) / BGZF_COMPRESSION_RATIO
+
+
+def _pseudo_bin(depth: int) -> int:
+    return ((1 << ((depth + 1) * 3)) - 1) // 7 + 1
+
+
+def read_index_bins(
+    index_file: str,
+) -> tuple[int, int, list[tuple[dict[int, float], int | None]]]:
+    """
+    Args:
+        index_file: .bai or .csi index
+
+    Returns:
+        min_shift and depth of the bins, and for every contig (in the order of
+        the BAM header), the compressed bytes of the reads of every bin, and
+        the number of mapped reads (None if the index does not have it)
+    """
+    if index_file.endswith(".csi"):
+        with gzip.open(index_file, "rb") as index_h:
+            data = index_h.read()
+        magic, min_shift, depth, l_aux = struct.unpack_from("<4siii", data, 0)
+        if magic != b"CSI\1":
+            raise ValueError(f"{index_file} is not a CSI index.")
+        offset = 16 + l_aux
+        is_csi = True
+    else:
+        with open(index_file, "rb") as index_h:
+            data = index_h.read()
+        if data[:4] != b"BAI\1":
+            raise ValueError(f"{index_file} is not a BAI index.")
+        min_shift, depth = BAI_MIN_SHIFT, BAI_DEPTH
+        offset = 4
+        is_csi = False
+
+    pseudo_bin = _pseudo_bin(depth)
+    (n_ref,) = struct.unpack_from("<i", data, offset)
+    offset += 4
+    contigs = []
+    for _ in range(n_ref):
+        (n_bin,) = struct.unpack_from("<i", data, offset)
+        offset += 4
+        bin_bytes = {}
+        num_mapped = None
+        for _ in range(n_bin):
+            if is_csi:
+                bin_i, _loffset, n_chunk = struct.unpack_from("<IQi", data, offset)
+                offset += 16
+            else:
+                bin_i, n_chunk = struct.unpack_from("<Ii", data, offset)
+                offset += 8
+            chunks = np.frombuffer(
+                data, dtype="<u8", count=2 * n_chunk, offset=offset
+            ).reshape(n_chunk, 2)
+            offset += 16 * n_chunk
+            if bin_i == pseudo_bin:
+                # (start, end) of the contig's reads, then (mapped, unmapped)
+                num_mapped = int(chunks[1, 0])
+                continue
+            bin_bytes[bin_i] = float(
+                np.sum(
+                    _compressed_position(chunks[:, 1])
+                    - _compressed_position(chunks[:, 0])
+                )
+            )
+        contigs.append((bin_bytes, num_mapped))
+
+        if not is_csi:
+            # The linear index
+            (n_intv,) = struct.unpack_from("<i", data, offset)
+            offset += 4 + 8 * n_intv
+
+    return min_shift, depth, contigs
+
+
+def reads_by_window(
+    bam_file: str, window_size: int = WINDOW_SIZE
+) -> dict[str, np.ndarray]:
+    """
+    Estimated number of reads of every window of every contig of a BAM file.
+    Without the number of mapped reads in the index, the estimates are in
+    compressed bytes instead, which are proportional to the number of reads.
+
+    Args:
+        bam_file: indexed BAM file
+        window_size: size of the windows
+
+    Returns:
+        for every contig, the estimate of each of its windows, i.e., of
+        [i * window_size, (i+1) * window_size)
+    """
+    index_file = find_bam_index(bam_file)
+    if index_file is None:
+        raise FileNotFoundError(f"{bam_file} is not indexed.")
+    with pysam.AlignmentFile(bam_file) as bam_h:
+        contig_lengths = list(zip(bam_h.references, bam_h.lengths))
+
+    min_shift, depth, contigs = read_index_bins(index_file)
+    windows_by_contig = {}
+    for (contig, length), (bin_bytes, num_mapped) in zip(contig_lengths, contigs):
+        num_windows = -(-length // window_size)
+        windows = np.zeros(num_windows, dtype=np.float64)
+        for bin_i, num_bytes in bin_bytes.items():
+            # Level and the first bin of the level
+            level = 0
+            while level < depth and bin_i >= ((1 << (3 * (level + 1))) - 1) // 7:
+                level += 1
+            first_bin = ((1 << (3 * level)) - 1) // 7
+            bin_size = 1 << (min_shift + 3 * (depth - level))
+            bin_start = (bin_i - first_bin) * bin_size
+            bin_end = min(bin_start + bin_size, length)
+            if bin_end <= bin_start:
+                continue
+            first_window = bin_start // window_size
+            last_window = (bin_end - 1) // window_size
+            # Bytes per base pair, onto the base pairs of each window in the bin
+            window_i = np.arange(first_window, last_window + 1)
+            window_starts = np.maximum(window_i * window_size, bin_start)
+            window_ends = np.minimum((window_i + 1) * window_size, bin_end)
+            windows[first_window : last_window + 1] += (
+                num_bytes * (window_ends - window_starts) / (bin_end - bin_start)
+            )
+        total_bytes = windows.sum()
+        if num_mapped is not None and total_bytes > 0:
+            windows *= num_mapped / total_bytes
+        windows_by_contig[contig] = windows
+
+    return windows_by_contig
@@ -1,13 +1,17 @@
 import gzip
+import heapq
 import io
 import math
+import os
 import re
-from collections.abc import Iterable
-from functools import cached_property
+from collections.abc import Hashable, Iterable
+from functools import cached_property, lru_cache
 from typing import Any, Literal
 
 from pydantic import BaseModel
-from pysam import AlignmentFile
+from pysam import AlignmentFile, FastaFile, TabixFile
+
+from somaticseq.defaults import REFERENCE_BLOCK_MARGIN, REFERENCE_BLOCK_SIZE
 
 # The regular expression pattern for "chrXX 1234567" in both VarScan2 Output and
 # VCF files:
@@ -31,6 +35,13 @@ CHROMOSOME_INDICES = {}
 for n, contig_i in enumerate(CHROMOSOMES):
     CHROMOSOME_INDICES[contig_i] = n
 
+# Bits for the position in a coordinate_key, and a key beyond any coordinate
+POSITION_BITS = 40
+END_OF_FILE_KEY = 1 << 64
+# An indexed VCF file is re-positioned rather than read through to catch up to
+# a site further away than this
+TABIX_SEEK_DISTANCE = 100_000
+
 
 nan = float("nan")
 inf = float("inf")
@@ -81,17 +92,138 @@ AA_1to3 = {
 }
 
 
-class VCFVariantRecord(BaseModel):
-    chromosome: str | None = None
-    position: int | None = None
-    identifier: str | None = None
-    refbase: str | None = None
-    altbase: str | None = None
-    qual: float | int | None = None
-    filters: str | None = None
-    info: str | None = None
-    field: str | None = None
-    samples: list[str] | None = None
+@lru_cache(maxsize=256)
+def _info_value_pattern(variable: str) -> re.Pattern:
+    return re.compile(rf"\b{variable}=([^;\s]+)([;\W]|$)")
+
+
+class VCFVariantRecord:
+    """
+    A VCF line split into its columns. Built for every line of every VCF, so
+    it is a plain __slots__ class without validation, and the INFO and sample
+    columns are only parsed into dictionaries the first time they are queried.
+    Reassigning info, field, or samples discards what was parsed from them.
+    """
+
+    __slots__ = (
+        "chromosome",
+        "position",
+        "identifier",
+        "refbase",
+        "altbase",
+        "qual",
+        "filters",
+        "_info",
+        "_field",
+        "_samples",
+        "_info_values",
+        "_info_flags",
+        "_sample_values",
+    )
+
+    def __init__(
+        self,
+        chromosome: str | None = None,
+        position: int | None = None,
+        identifier: str | None = None,
+        refbase: str | None = None,
+        altbase: str | None = None,
+        qual: float | int | None = None,
+        filters: str | None = None,
+        info: str | None = None,
+        field: str | None = None,
+        samples: list[str] | None = None,
+    ) -> None:
+        self.chromosome = chromosome
+        self.position = position
+        self.identifier = identifier
+        self.refbase = refbase
+        self.altbase = altbase
+        self.qual = qual
+        self.filters = filters
+        self._info = info
+        self._field = field
+        self._samples = samples
+        self._info_values: dict[str, str] | None = None
+        self._info_flags: set[str] | None = None
+        self._sample_values: list[dict[str, str] | None] | None = None
+
+    @property
+    def info(self) -> str | None:
+        return self._info
+
+    @info.setter
+    def info(self, info: str | None) -> None:
+        self._info = info
+        self._info_values = None
+        self._info_flags = None
+
+    @property
+    def field(self) -> str | None:
+        return self._field
+
+    @field.setter
+    def field(self, field: str | None) -> None:
+        self._field = field
+        self._sample_values = None
+
+    @property
+    def samples(self) -> list[str] | None:
+        return self._samples
+
+    @samples.setter
+    def samples(self, samples: list[str] | None) -> None:
+        self._samples = samples
+        self._sample_values = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(chromosome={self.chromosome!r}, "
+            f"position={self.position!r}, identifier={self.identifier!r}, "
+            f"refbase={self.refbase!r}, altbase={self.altbase!r}, "
+            f"qual={self.qual!r}, filters={self.filters!r}, info={self.info!r}, "
+            f"field={self.field!r}, samples={self.samples!r})"
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, VCFVariantRecord):
+            return NotImplemented
+        return (
+            self.chromosome,
+            self.position,
+            self.identifier,
+            self.refbase,
+            self.altbase,
+            self.qual,
+            self.filters,
+            self.info,
+            self.field,
+            self.samples,
+        ) == (
+            other.chromosome,
+            other.position,
+            other.identifier,
+            other.refbase,
+            other.altbase,
+            other.qual,
+            other.filters,
+            other.info,
+            other.field,
+            other.samples,
+        )
+
+    def _parse_info(self) -> None:
+        assert self._info is not None
+        info_values: dict[str, str] = {}
+        info_flags: set[str] = set()
+        for item in self._info.split(";"):
+            key, has_value, value = item.partition("=")
+            if not has_value:
+                info_flags.add(key)
+            elif value and " " not in value:
+                info_values.setdefault(key, value)
+        self._info_values = info_values
+        self._info_flags = info_flags
 
     def get_info_items(self) -> list[str]:
         assert self.info
@@ -100,41 +232,53 @@ class VCFVariantRecord(BaseModel):
     def get_info_value(self, variable: str) -> str | bool:
         if not self.info:
             raise ValueError("INFO field is empty.")
-        key_item: Any = re.search(rf"\b{variable}=([^;\s]+)([;\W]|$)", self.info)
+        if self._info_values is None:
+            self._parse_info()
+        assert self._info_values is not None and self._info_flags is not None
         # If key has a value attached to it, e.g., VAR=1,2,3, will return 1,2,3.
+        if variable in self._info_values:
+            return self._info_values[variable]
+        key_item: Any = _info_value_pattern(variable).search(self.info)
         if key_item:
             return key_item.groups()[0]
         # Perhaps it's simply a flag without "="
         else:
-            key_item = self.info.split(";")
-            return True if variable in key_item else False
+            return True if variable in self._info_flags else False
 
     def get_sample_variable(self) -> list[str]:
         assert self.field
         return self.field.split(":")
 
+    def _get_sample_values(self, idx: int) -> dict[str, str]:
+        assert self.field
+        assert self.samples
+        if self._sample_values is None:
+            self._sample_values = [None] * len(self.samples)
+        sample_values = self._sample_values[idx]
+        if sample_values is None:
+            sample_values = dict(
+                zip(self.field.split(":"), self.samples[idx].split(":"))
+            )
+            self._sample_values[idx] = sample_values
+        return sample_values
+
     def get_sample_item(
         self, idx: int = 0, out_type: Literal["dict", "list"] = "dict"
     ) -> dict[str, str] | tuple[list[str], list[str]]:
         """d to output a dictionary. l to output a tuple of lists"""
         assert self.samples
         if out_type.lower() == "dict":
-            return dict(zip(self.get_sample_variable(), self.samples[idx].split(":")))
+            return dict(self._get_sample_values(idx))
         elif out_type.lower() == "list":
             return (self.get_sample_variable(), self.samples[idx].split(":"))
         else:
             raise NotImplementedError("out_type either dict or list")
 
     def get_sample_value(self, variable: str, idx: int = 0) -> str | None:
-        assert self.field
-        assert self.samples
-        var2value = dict(zip(self.field.split(":"), self.samples[idx].split(":")))
-        if variable not in var2value:
-            return None
-        return var2value[variable]
+        return self._get_sample_values(idx).get(variable)
 
     @classmethod
-    def from_vcf_line(cls, vcf_line: str) -> BaseModel:  # typing.Self in python>=3.11
+    def from_vcf_line(cls, vcf_line: str) -> "VCFVariantRecord":
         vcf_line = vcf_line.rstrip("\n")
         if not vcf_line:
             return cls()
@@ -161,16 +305,16 @@ class VCFVariantRecord(BaseModel):
             field = None
             samples = None
         return cls(
-            chromosome=chromosome,
-            position=position,
-            identifier=identifier,
-            refbase=refbase,
-            altbase=altbase,
-            qual=qual,
-            filters=filters,
-            info=info,
-            field=field,
-            samples=samples,
+            chromosome,
+            position,
+            identifier,
+            refbase,
+            altbase,
+            qual,
+            filters,
+            info,
+            field,
+            samples,
         )
 
 
@@ -244,6 +388,94 @@ def open_bam_file(file_name: str) -> AlignmentFile | io.TextIOWrapper:
         return open(file_name)
 
 
+class BlockCachedFasta:
+    """
+    Drop-in replacement of pysam.FastaFile for reading the sequence around
+    sites in sorted order, e.g., the homopolymer and sequence complexity
+    windows of every candidate site. The reference is read in blocks of
+    block_size, and short slices are served from the cached block instead of
+    a separate faidx lookup each. Blocks behind the one being read are
+    discarded.
+    """
+
+    def __init__(
+        self,
+        fasta: str | FastaFile,
+        block_size: int = REFERENCE_BLOCK_SIZE,
+        block_margin: int = REFERENCE_BLOCK_MARGIN,
+    ) -> None:
+        """
+        Args:
+            fasta: fasta file with its .fai index, or the opened FastaFile
+            block_size: length of each block
+            block_margin: extra length at the end of each block, i.e., the
+                longest slice served from the blocks
+        """
+        self.fasta = fasta if isinstance(fasta, FastaFile) else FastaFile(fasta)
+        self.block_size = block_size
+        self.block_margin = block_margin
+        self.blocks: dict[tuple[str, int], str] = {}
+
+    def __enter__(self) -> "BlockCachedFasta":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    @property
+    def references(self) -> tuple[str, ...]:
+        return self.fasta.references
+
+    @property
+    def lengths(self) -> tuple[int, ...]:
+        return self.fasta.lengths
+
+    def get_reference_length(self, reference: str) -> int:
+        return self.fasta.get_reference_length(reference)
+
+    def _block(self, reference: str, block_i: int) -> str:
+        block = self.blocks.get((reference, block_i))
+        if block is None:
+            for contig, cached_block_i in list(self.blocks):
+                if contig != reference or cached_block_i < block_i - 1:
+                    del self.blocks[(contig, cached_block_i)]
+            block_start = block_i * self.block_size
+            block = self.fasta.fetch(
+                reference,
+                block_start,
+                block_start + self.block_size + self.block_margin,
+            )
+            self.blocks[(reference, block_i)] = block
+        return block
+
+    def fetch(
+        self,
+        reference: str | None = None,
+        start: int | None = None,
+        end: int | None = None,
+        region: str | None = None,
+    ) -> str:
+        """
+        Same as pysam.FastaFile.fetch, i.e., 0-based and half-open [start, end).
+        """
+        if (
+            region is not None
+            or start is None
+            or end is None
+            or not 0 <= start <= end
+            or end - start > self.block_margin
+            or reference not in self.fasta
+        ):
+            return self.fasta.fetch(reference, start, end, region=region)
+        block_i = start // self.block_size
+        offset = start - block_i * self.block_size
+        return self._block(reference, block_i)[offset : offset + end - start]
+
+    def close(self) -> None:
+        self.blocks = {}
+        self.fasta.close()
+
+
 def ascii2phred33(x: str) -> int:
     """Put in an ASCII string, return a Phred+33 score."""
     if len(x) != 1:
@@ -621,6 +853,309 @@ def find_vcf_at_coordinate(
     return latest_vcf_run[0], vcf_variants, latest_vcf_line
 
 
+def coordinate_key(
+    contig: str, position: str | int, chrom_seq: dict[str, int] = CHROMOSOME_INDICES
+) -> int:
+    """
+    Pack a coordinate into one integer, i.e., the contig's order in the
+    reference in the high bits and the position in the low bits, so that
+    coordinates of a sorted stream compare as plain integers.
+    """
+    return (chrom_seq[contig] << POSITION_BITS) | int(position)
+
+
+def line_coordinate_key(
+    line: str, chrom_seq: dict[str, int] = CHROMOSOME_INDICES
+) -> int:
+    """
+    coordinate_key of a "contig\tposition..." line (e.g., VCF), or
+    END_OF_FILE_KEY if it has no coordinate.
+    """
+    contig, _, rest = line.partition("\t")
+    position = rest.partition("\t")[0]
+    if contig and position.isdigit():
+        return coordinate_key(contig, position, chrom_seq)
+    # Anything else PATTERN_CHR_POSITION may still accept, e.g., "1000.5"
+    coordinate_match = PATTERN_CHR_POSITION.match(line)
+    if coordinate_match:
+        contig, position = coordinate_match.group().split("\t")
+        return coordinate_key(contig, position, chrom_seq)
+    return END_OF_FILE_KEY
+
+
+class SortedVcfStream:
+    """
+    A coordinate-sorted VCF file read forward alongside the sites being
+    evaluated. Each line's coordinate is parsed once into a coordinate_key, so
+    catching up to a site is a series of integer comparisons. Works the same
+    way as catchup_multilines and find_vcf_at_coordinate.
+    """
+
+    def __init__(
+        self,
+        file_handle: io.TextIOWrapper,
+        chrom_seq: dict[str, int] = CHROMOSOME_INDICES,
+        line: str | None = None,
+    ) -> None:
+        """
+        Args:
+            file_handle: opened VCF file
+            chrom_seq: contig order, e.g., from faiordict2contigorder
+            line: the first line after the header. If None, the header is
+                skipped here.
+        """
+        self.file_handle = file_handle
+        self.chrom_seq = chrom_seq
+        self.line = skip_vcf_header(file_handle) if line is None else line
+        self.key = line_coordinate_key(self.line, chrom_seq)
+
+    def next_line(self) -> str:
+        """
+        Read the next line, making sure it is not behind the current one.
+        """
+        line = self.file_handle.readline().rstrip()
+        key = line_coordinate_key(line, self.chrom_seq)
+        if key < self.key:
+            raise Exception(
+                "{} does not seem to be properly sorted: {} then {}.".format(
+                    self.file_handle.name,
+                    "\t".join(self.line.split("\t")[:2]),
+                    "\t".join(line.split("\t")[:2]),
+                )
+            )
+        self.line = line
+        self.key = key
+        return line
+
+    def lines_at(self, key: int) -> list[str]:
+        """
+        Read past every line behind the coordinate_key, and return the lines
+        at the coordinate_key (if any).
+        """
+        while self.key < key:
+            self.next_line()
+        lines = []
+        while self.key == key:
+            lines.append(self.line)
+            self.next_line()
+        return lines
+
+    def variants_at(
+        self, my_coordinate: tuple[str, int]
+    ) -> tuple[bool, dict[tuple, VCFVariantRecord]]:
+        """
+        Same as find_vcf_at_coordinate, returns whether there are variants at
+        my_coordinate, and those variants keyed by ((contig, position),
+        ref_base, alt_base) for every ALT base of every line.
+        """
+        lines = self.lines_at(
+            coordinate_key(my_coordinate[0], my_coordinate[1], self.chrom_seq)
+        )
+        vcf_variants = {}
+        for vcf_line_i in lines:
+            vcf_i = VCFVariantRecord.from_vcf_line(vcf_line_i)
+
+            # Some VCF files wrongly uses "/" to separate different ALT's
+            altbases = re.split(r"[,/]", vcf_i.altbase)
+            for alt_i in altbases:
+                vcf_variants[
+                    ((vcf_i.chromosome, vcf_i.position), vcf_i.refbase, alt_i)
+                ] = vcf_i
+            assert my_coordinate[1] == vcf_i.position
+
+        return bool(lines), vcf_variants
+
+    def close(self) -> None:
+        self.file_handle.close()
+
+
+class TabixVcfStream(SortedVcfStream):
+    """
+    A bgzipped and tabix-indexed (.tbi or .csi) VCF file read forward
+    alongside the sites being evaluated. Instead of reading through every line
+    behind a site, it jumps to a new contig or a distant site through the
+    index, so a run on a few regions of the genome (e.g., a shard of
+    somaticseq_parallel.py) only reads the records around those regions.
+    """
+
+    def __init__(
+        self,
+        vcf_file: str,
+        chrom_seq: dict[str, int] = CHROMOSOME_INDICES,
+        index_file: str | None = None,
+    ) -> None:
+        """
+        Args:
+            vcf_file: bgzipped VCF file
+            chrom_seq: contig order, e.g., from faiordict2contigorder
+            index_file: its .tbi or .csi index. If None, vcf_file.tbi or
+                vcf_file.csi.
+        """
+        if index_file is None:
+            index_file = find_tabix_index(vcf_file)
+        self.file_handle = TabixFile(vcf_file, index=index_file)
+        self.name = vcf_file
+        self.chrom_seq = chrom_seq
+        self.contigs = {index: contig for contig, index in chrom_seq.items()}
+        self.indexed_contigs = set(self.file_handle.contigs)
+        # Nothing has been read, so the stream has to be positioned first
+        self.records: Iterable[str] | None = None
+        self.line = ""
+        self.key = 0
+
+    def seek(self, key: int) -> None:
+        """
+        Position the stream at the first record overlapping the coordinate_key.
+        """
+        contig_index = key >> POSITION_BITS
+        contig = self.contigs[contig_index]
+        position = key & ((1 << POSITION_BITS) - 1)
+        if contig in self.indexed_contigs:
+            self.records = self.file_handle.fetch(contig, max(0, position - 1))
+        else:
+            self.records = iter(())
+        # Records overlapping the position may start anywhere on the contig
+        self.key = contig_index << POSITION_BITS
+        self.next_line()
+
+    def next_line(self) -> str:
+        """
+        Read the next record on the contig. At the end of the contig, the
+        stream stays at the start of the next contig until it is re-positioned.
+        """
+        line = next(self.records, None)
+        if line is None:
+            self.records = None
+            self.line = ""
+            self.key = ((self.key >> POSITION_BITS) + 1) << POSITION_BITS
+            return self.line
+        key = line_coordinate_key(line, self.chrom_seq)
+        if key < self.key:
+            raise Exception(
+                "{} does not seem to be properly sorted: {} then {}.".format(
+                    self.name,
+                    "\t".join(self.line.split("\t")[:2]),
+                    "\t".join(line.split("\t")[:2]),
+                )
+            )
+        self.line = line
+        self.key = key
+        return line
+
+    def lines_at(self, key: int) -> list[str]:
+        if self.records is None or key - self.key > TABIX_SEEK_DISTANCE:
+            self.seek(key)
+        lines = []
+        while self.records is not None and self.key <= key:
+            if self.key == key:
+                lines.append(self.line)
+            self.next_line()
+        return lines
+
+
+def find_tabix_index(vcf_file: str) -> str | None:
+    """
+    Path of the .tbi or .csi index of a bgzipped VCF file, or None if there is
+    not one.
+    """
+    if vcf_file.endswith(".gz"):
+        for index_suffix in (".tbi", ".csi"):
+            if os.path.exists(vcf_file + index_suffix):
+                return vcf_file + index_suffix
+    return None
+
+
+def open_vcf_stream(
+    vcf_file: str, chrom_seq: dict[str, int] = CHROMOSOME_INDICES
+) -> SortedVcfStream:
+    """
+    A TabixVcfStream if the VCF file is bgzipped and indexed, otherwise a
+    SortedVcfStream that reads it from the beginning.
+    """
+    index_file = find_tabix_index(vcf_file)
+    if index_file:
+        return TabixVcfStream(vcf_file, chrom_seq, index_file)
+    return SortedVcfStream(open_textfile(vcf_file), chrom_seq)
+
+
+class VcfStreamMerger:
+    """
+    k-way merge of any number of registered SortedVcfStreams (e.g., caller,
+    truth, dbSNP, and COSMIC VCFs) on a priority queue of their current
+    coordinate_key. Catching up to a site only touches the streams that have
+    reached it, instead of polling every stream for every site. Known sites
+    indexes (see known_sites_index.py) are looked up at every site instead.
+    """
+
+    def __init__(self, chrom_seq: dict[str, int] = CHROMOSOME_INDICES) -> None:
+        self.chrom_seq = chrom_seq
+        self.streams: dict[Hashable, SortedVcfStream] = {}
+        # (coordinate_key, order of registration, name) of unexhausted streams
+        self._queue: list[tuple[int, int, Hashable]] = []
+        # KnownSitesIndex's, looked up at every site
+        self.indexes: dict[Hashable, Any] = {}
+
+    def register(self, name: Hashable, vcf_file: str | SortedVcfStream) -> None:
+        """
+        Args:
+            name: the name under which records of this VCF file are returned
+            vcf_file: path of a sorted VCF file, which is randomly accessed
+                if it is bgzipped and indexed, path of a known sites index, or
+                an opened SortedVcfStream
+        """
+        # Imported here because known_sites_index is built on this module
+        from somaticseq.genomic_file_parsers.known_sites_index import (
+            KnownSitesIndex,
+            is_known_sites_index,
+        )
+
+        if name in self:
+            raise ValueError(f"{name} is already registered.")
+        if isinstance(vcf_file, str) and is_known_sites_index(vcf_file):
+            self.indexes[name] = KnownSitesIndex(vcf_file)
+            return
+        if isinstance(vcf_file, SortedVcfStream):
+            stream = vcf_file
+        else:
+            stream = open_vcf_stream(vcf_file, self.chrom_seq)
+        self.streams[name] = stream
+        if stream.key != END_OF_FILE_KEY:
+            heapq.heappush(self._queue, (stream.key, len(self.streams), name))
+
+    def __contains__(self, name: Hashable) -> bool:
+        return name in self.streams or name in self.indexes
+
+    def variants_at(
+        self, my_coordinate: tuple[str, int]
+    ) -> dict[Hashable, dict[tuple, VCFVariantRecord]]:
+        """
+        Records at my_coordinate (see SortedVcfStream.variants_at) of only the
+        registered streams that have any, keyed by their names.
+        """
+        key = coordinate_key(my_coordinate[0], my_coordinate[1], self.chrom_seq)
+        site_records = {}
+        queue = self._queue
+        while queue and queue[0][0] <= key:
+            _, order, name = heapq.heappop(queue)
+            stream = self.streams[name]
+            got_variants, variants = stream.variants_at(my_coordinate)
+            if got_variants:
+                site_records[name] = variants
+            if stream.key != END_OF_FILE_KEY:
+                heapq.heappush(queue, (stream.key, order, name))
+        for name, known_sites in self.indexes.items():
+            got_variants, variants = known_sites.variants_at(my_coordinate)
+            if got_variants:
+                site_records[name] = variants
+        return site_records
+
+    def close(self) -> None:
+        for stream in self.streams.values():
+            stream.close()
+        for known_sites in self.indexes.values():
+            known_sites.close()
+
+
 # Read the 2nd file (i.e., filehandle_j) one line down if it's behind the i_th coordinate:
 def catchup_one_line_at_a_time(coordinate_i, line_j, filehandle_j, CHROMOSOMES):
     """
@@ -0,0 +1,142 @@
+"""
+Genomic intervals (e.g., of a BED file) merged and kept in sorted arrays per
+contig, so whether a site or a VCF line overlaps them is a binary search. VCF
+lines are filtered by them as a stream of lines, in place of bedtools
+intersect, and sorted in the order of the contigs, in place of bedtools sort.
+"""
+
+import bisect
+import re
+from array import array
+from collections.abc import Iterable, Iterator
+
+NON_REGION_LINE = re.compile(r"track|browser|#")
+END_IN_INFO = re.compile(r"(?:^|;)END=([0-9]+)")
+
+
+def read_bed_intervals(bed_file: str) -> Iterator[tuple[str, int, int]]:
+    """
+    (contig, 0-based start, end) of the regions of a BED file, skipping its
+    track, browser, comment, and empty lines.
+    """
+    with open(bed_file) as bed:
+        for line_i in bed:
+            if NON_REGION_LINE.match(line_i) or not line_i.strip():
+                continue
+            items = line_i.rstrip("\r\n").split("\t")
+            yield items[0], int(items[1]), int(items[2])
+
+
+def vcf_line_span(vcf_line: str) -> tuple[str, int, int]:
+    """
+    Contig, 0-based start, and end of a VCF line, i.e., the span of its REF
+    allele, or up to its END for a symbolic ALT allele, as bedtools sees it.
+    """
+    items = vcf_line.split("\t", 8)
+    start = int(items[1]) - 1
+    end = start + len(items[3])
+    if items[4].startswith("<"):
+        end_match = END_IN_INFO.search(items[7])
+        if end_match:
+            end = max(end, int(end_match.group(1)))
+    return items[0], start, end
+
+
+class IntervalSet:
+    """
+    Intervals of 0-based [start, end), merged where they overlap or abut, in
+    sorted arrays of their starts and ends per contig.
+
+    Usage:
+        regions = IntervalSet.from_bed("regions.bed")
+        regions.overlaps("chr1", 999, 1002)
+        regions.contains("chr1", 1000)
+    """
+
+    def __init__(self, intervals: Iterable[tuple[str, int, int]] = ()) -> None:
+        intervals_by_contig: dict[str, list[tuple[int, int]]] = {}
+        for contig, start, end in intervals:
+            intervals_by_contig.setdefault(contig, []).append((start, end))
+
+        self.starts: dict[str, array] = {}
+        self.ends: dict[str, array] = {}
+        for contig, contig_intervals in intervals_by_contig.items():
+            contig_intervals.sort()
+            starts, ends = array("q"), array("q")
+            for start, end in contig_intervals:
+                if ends and start <= ends[-1]:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self.starts[contig] = starts
+            self.ends[contig] = ends
+
+    @classmethod
+    def from_bed(cls, bed_file: str) -> "IntervalSet":
+        return cls(read_bed_intervals(bed_file))
+
+    def overlaps(self, contig: str, start: int, end: int) -> bool:
+        """Whether [start, end) overlaps any of the intervals"""
+        if contig not in self.starts:
+            return False
+        # The last interval starting before the end
+        i = bisect.bisect_left(self.starts[contig], end) - 1
+        return i >= 0 and self.ends[contig][i] > start
+
+    def contains(self, contig: str, position: int) -> bool:
+        """Whether the 1-based position is in any of the intervals"""
+        return self.overlaps(contig, position - 1, position)
+
+
+def filter_vcf_lines(
+    vcf_lines: Iterable[str],
+    inclusion: IntervalSet | None = None,
+    exclusion: IntervalSet | None = None,
+) -> Iterator[str]:
+    """
+    The header lines, and the variant lines that overlap the inclusion
+    intervals (if any) and do not overlap the exclusion intervals (if any),
+    like bedtools intersect -header (-v) | uniq, i.e., a line that is the same
+    as the one before it is dropped.
+    """
+    previous_line = None
+    for line_i in vcf_lines:
+        if line_i == previous_line:
+            continue
+        if not line_i.startswith("#") and line_i.strip():
+            span = vcf_line_span(line_i)
+            if inclusion is not None and not inclusion.overlaps(*span):
+                continue
+            if exclusion is not None and exclusion.overlaps(*span):
+                continue
+        previous_line = line_i
+        yield line_i
+
+
+def sort_vcf_lines(
+    vcf_lines: Iterable[str], contig_order: dict[str, int]
+) -> Iterator[str]:
+    """
+    The header lines, and then the variant lines sorted by contig in the
+    contig_order, and by position, like bedtools sort -faidx -header. Lines of
+    the same coordinate are kept in the order they came in. Contigs that are
+    not in contig_order come after the others, in the order they came in.
+
+    The header lines are yielded as they come, but, as with bedtools sort, all
+    the variant lines are held in memory until the last one is read.
+    """
+    contig_order = dict(contig_order)
+    variant_lines = []
+    for line_i in vcf_lines:
+        if line_i.startswith("#"):
+            yield line_i
+        elif line_i.strip():
+            contig, position = line_i.split("\t", 2)[:2]
+            if contig not in contig_order:
+                contig_order[contig] = len(contig_order)
+            variant_lines.append((contig_order[contig], int(position), line_i))
+
+    variant_lines.sort(key=lambda variant_i: variant_i[:2])
+    for _, _, line_i in variant_lines:
+        yield line_i
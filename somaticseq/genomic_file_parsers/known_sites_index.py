@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Compile a known-variants VCF file (e.g., dbSNP or COSMIC) into a compact index
+file that vcf2tsv accepts in place of the VCF file. The index is memory-mapped
+read-only, so parallel processes share one copy of it in the page cache, and
+each site is looked up with a binary search on the sorted coordinates instead
+of reading the VCF file through to it.
+
+The index file is the MAGIC bytes, the length of the JSON header, the JSON
+header, and then the arrays described in the header (8-byte aligned):
+    keys: sorted packed coordinates, i.e., contig number << POSITION_BITS |
+        position, where the contigs are numbered in the order they appear
+    payload_offsets: where each record's payload starts (and ends)
+    payload: ID, REF, ALT, QUAL, FILTER, and INFO (only the INFO_KEYS) columns
+        of the records
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+from array import array
+from collections.abc import Iterator
+
+import numpy as np
+
+import somaticseq.genomic_file_parsers.genomic_file_handlers as genome
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+ch.setFormatter(formatter)
+logger = logging.getLogger(os.path.basename(__file__))
+logger.setLevel(logging.DEBUG)
+logger.addHandler(ch)
+
+MAGIC = b"SSQKNOWN"
+FORMAT_VERSION = 1
+# INFO fields used by annotate_caller.dbSNP and annotate_caller.COSMIC
+INFO_KEYS = ("COMMON", "CNT", "SNP")
+ALIGNMENT = 8
+COPY_BUFFER_SIZE = 2**24
+# Records held in memory at a time, i.e., written out at a time, and sorted at
+# a time into the runs of the external sort of an unsorted VCF file
+RECORDS_PER_CHUNK = 2**20
+# Records read at a time from each run when the runs are merged
+MERGE_BLOCK_SIZE = 2**12
+
+
+def run() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compile a dbSNP or COSMIC VCF file into an index file that can be used in its place for -dbsnp/-cosmic.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-vcf", "--vcf-file", type=str, help="known variants VCF", required=True
+    )
+    parser.add_argument(
+        "-out", "--output-file", type=str, help="output index file", required=True
+    )
+    parser.add_argument(
+        "-info",
+        "--info-keys",
+        type=str,
+        nargs="*",
+        help="INFO fields to keep",
+        default=INFO_KEYS,
+    )
+    args = parser.parse_args()
+    return args
+
+
+def _aligned(num_bytes: int) -> int:
+    return -(-num_bytes // ALIGNMENT) * ALIGNMENT
+
+
+def reduce_info(info: str, info_keys: tuple[str, ...] | list[str]) -> str:
+    """
+    Only the fields of the INFO column that are in info_keys, or "." if none.
+    """
+    kept_fields = [
+        info_field
+        for info_field in info.split(";")
+        if info_field.split("=", 1)[0] in info_keys
+    ]
+    return ";".join(kept_fields) if kept_fields else "."
+
+
+class _RecordWriter:
+    """
+    Write the keys, payload offsets, and payloads of records into three
+    temporary files, RECORDS_PER_CHUNK keys and offsets at a time.
+    """
+
+    def __init__(self, out_directory: str) -> None:
+        self.keys_file = tempfile.TemporaryFile(dir=out_directory)
+        self.offsets_file = tempfile.TemporaryFile(dir=out_directory)
+        self.payload_file = tempfile.TemporaryFile(dir=out_directory)
+        self.keys = array("Q")
+        self.payload_offsets = array("Q", [0])
+        self.num_records = 0
+        self.payload_length = 0
+
+    def write(self, key: int, payload: bytes) -> None:
+        self.payload_file.write(payload)
+        self.payload_length += len(payload)
+        self.keys.append(key)
+        self.payload_offsets.append(self.payload_length)
+        self.num_records += 1
+        if len(self.keys) >= RECORDS_PER_CHUNK:
+            self.flush()
+
+    def flush(self) -> None:
+        for values, out in (
+            (self.keys, self.keys_file),
+            (self.payload_offsets, self.offsets_file),
+        ):
+            out.write(np.frombuffer(values, dtype=np.uint64).astype("<u8").tobytes())
+            del values[:]
+        self.payload_file.flush()
+
+    def close(self) -> None:
+        for temp_file in (self.keys_file, self.offsets_file, self.payload_file):
+            temp_file.close()
+
+
+def _read_records(
+    records: _RecordWriter, start: int, end: int
+) -> tuple[np.ndarray, np.ndarray, bytes]:
+    """
+    Keys, payload offsets (from the first record's payload), and payloads of
+    the records [start, end) of a flushed _RecordWriter.
+    """
+    records.keys_file.seek(start * 8)
+    keys = np.frombuffer(records.keys_file.read((end - start) * 8), dtype="<u8")
+    records.offsets_file.seek(start * 8)
+    payload_offsets = np.frombuffer(
+        records.offsets_file.read((end - start + 1) * 8), dtype="<u8"
+    )
+    records.payload_file.seek(int(payload_offsets[0]))
+    payload = records.payload_file.read(int(payload_offsets[-1] - payload_offsets[0]))
+    return keys, payload_offsets - payload_offsets[0], payload
+
+
+def _run_records(run: _RecordWriter, run_i: int) -> Iterator[tuple]:
+    """(key, run_i, record_i, payload) of every record of a sorted run"""
+    for block_start in range(0, run.num_records, MERGE_BLOCK_SIZE):
+        block_end = min(block_start + MERGE_BLOCK_SIZE, run.num_records)
+        keys, payload_offsets, payload = _read_records(run, block_start, block_end)
+        payload_offsets = payload_offsets.tolist()
+        for i, key in enumerate(keys.tolist()):
+            yield (
+                key,
+                run_i,
+                block_start + i,
+                payload[payload_offsets[i] : payload_offsets[i + 1]],
+            )
+
+
+def _external_sort(records: _RecordWriter, out_directory: str) -> _RecordWriter:
+    """
+    Records sorted by key, stably, i.e., records of the same key stay in file
+    order. Every RECORDS_PER_CHUNK records are sorted in memory into a run, and
+    the runs are merged, so the records are only read and written in order.
+    """
+    runs = []
+    try:
+        for chunk_start in range(0, records.num_records, RECORDS_PER_CHUNK):
+            chunk_end = min(chunk_start + RECORDS_PER_CHUNK, records.num_records)
+            keys, payload_offsets, payload = _read_records(
+                records, chunk_start, chunk_end
+            )
+            run = _RecordWriter(out_directory)
+            runs.append(run)
+            payload_offsets = payload_offsets.tolist()
+            for record_i in np.argsort(keys, kind="stable").tolist():
+                run.write(
+                    int(keys[record_i]),
+                    payload[payload_offsets[record_i] : payload_offsets[record_i + 1]],
+                )
+            run.flush()
+
+        sorted_records = _RecordWriter(out_directory)
+        for key, _, _, payload in heapq.merge(
+            *[_run_records(run, run_i) for run_i, run in enumerate(runs)]
+        ):
+            sorted_records.write(key, payload)
+        sorted_records.flush()
+    finally:
+        for run in runs:
+            run.close()
+    return sorted_records
+
+
+def build_known_sites_index(
+    vcf_file: str,
+    index_file: str,
+    info_keys: tuple[str, ...] | list[str] = INFO_KEYS,
+) -> str:
+    """
+    Compile a VCF file into an index file. The records are written into
+    temporary files RECORDS_PER_CHUNK at a time, and those of an unsorted VCF
+    file are sorted externally, so the memory does not grow with the VCF file.
+
+    Args:
+        vcf_file: VCF file, which does not need to be sorted
+        index_file: output index file
+        info_keys: INFO fields to keep
+
+    Returns:
+        index_file
+    """
+    contigs: dict[str, int] = {}
+    out_directory = os.path.dirname(os.path.abspath(index_file))
+    records = _RecordWriter(out_directory)
+    try:
+        is_sorted = True
+        previous_key = 0
+        with genome.open_textfile(vcf_file) as vcf:
+            line_i = genome.skip_vcf_header(vcf)
+            while line_i:
+                item = line_i.split("\t")
+                contig = item[0]
+                if contig not in contigs:
+                    contigs[contig] = len(contigs)
+                key = contigs[contig] << genome.POSITION_BITS | int(item[1])
+                if key < previous_key:
+                    is_sorted = False
+                previous_key = key
+                payload = "\t".join(item[2:7] + [reduce_info(item[7], info_keys)])
+                records.write(key, payload.encode())
+                line_i = vcf.readline().rstrip()
+        records.flush()
+
+        if not is_sorted:
+            unsorted_records = records
+            records = _external_sort(unsorted_records, out_directory)
+            unsorted_records.close()
+
+        arrays = {}
+        data_length = 0
+        for name, dtype, length in (
+            ("keys", "<u8", records.num_records),
+            ("payload_offsets", "<u8", records.num_records + 1),
+            ("payload", "u1", records.payload_length),
+        ):
+            arrays[name] = {"offset": data_length, "dtype": dtype, "length": length}
+            data_length += _aligned(length * np.dtype(dtype).itemsize)
+        header = json.dumps(
+            {
+                "version": FORMAT_VERSION,
+                "source": os.path.basename(vcf_file),
+                "contigs": list(contigs),
+                "info_keys": list(info_keys),
+                "arrays": arrays,
+            }
+        ).encode()
+        data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+        with open(index_file, "wb") as index_out:
+            index_out.write(MAGIC)
+            index_out.write(len(header).to_bytes(8, "little"))
+            index_out.write(header)
+            for name, temp_file in (
+                ("keys", records.keys_file),
+                ("payload_offsets", records.offsets_file),
+                ("payload", records.payload_file),
+            ):
+                temp_file.seek(0)
+                index_out.seek(data_start + arrays[name]["offset"])
+                shutil.copyfileobj(temp_file, index_out, COPY_BUFFER_SIZE)
+            index_out.truncate(data_start + data_length)
+    finally:
+        records.close()
+
+    logger.info(
+        f"Indexed {records.num_records} records of {vcf_file} into {index_file}."
+    )
+    return index_file
+
+
+def is_known_sites_index(file_name: str) -> bool:
+    """
+    Whether the file is an index written by build_known_sites_index.
+    """
+    if not os.path.isfile(file_name):
+        return False
+    with open(file_name, "rb") as opened_file:
+        return opened_file.read(len(MAGIC)) == MAGIC
+
+
+class KnownSitesIndex:
+    """
+    Read-only, memory-mapped index of a known-variants VCF file, looked up
+    site by site in place of a SortedVcfStream.
+    """
+
+    def __init__(self, index_file: str) -> None:
+        with open(index_file, "rb") as index_in:
+            if index_in.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{index_file} is not a known sites index.")
+            header_length = int.from_bytes(index_in.read(8), "little")
+            header = json.loads(index_in.read(header_length))
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"{index_file} is version {header['version']} of the known sites "
+                f"index, not {FORMAT_VERSION}."
+            )
+        data_start = _aligned(len(MAGIC) + 8 + header_length)
+        arrays = {}
+        for name, array_i in header["arrays"].items():
+            if array_i["length"] == 0:
+                arrays[name] = np.zeros(0, dtype=array_i["dtype"])
+            else:
+                arrays[name] = np.memmap(
+                    index_file,
+                    dtype=array_i["dtype"],
+                    mode="r",
+                    offset=data_start + array_i["offset"],
+                    shape=(array_i["length"],),
+                )
+        self.index_file = index_file
+        self.contigs = {contig: i for i, contig in enumerate(header["contigs"])}
+        self.keys = arrays["keys"]
+        self.payload_offsets = arrays["payload_offsets"]
+        self.payload = arrays["payload"]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def variants_at(
+        self, my_coordinate: tuple[str, int]
+    ) -> tuple[bool, dict[tuple, genome.VCFVariantRecord]]:
+        """
+        Same as SortedVcfStream.variants_at, returns whether there are variants
+        at my_coordinate, and those variants keyed by ((contig, position),
+        ref_base, alt_base) for every ALT base of every record.
+        """
+        contig, position = my_coordinate
+        if contig not in self.contigs:
+            return False, {}
+        key = np.uint64(self.contigs[contig] << genome.POSITION_BITS | position)
+        start = int(np.searchsorted(self.keys, key, side="left"))
+        end = int(np.searchsorted(self.keys, key, side="right"))
+        vcf_variants = {}
+        for record_i in range(start, end):
+            payload = bytes(
+                self.payload[
+                    self.payload_offsets[record_i] : self.payload_offsets[record_i + 1]
+                ]
+            ).decode()
+            vcf_i = genome.VCFVariantRecord.from_vcf_line(
+                f"{contig}\t{position}\t{payload}"
+            )
+            # Some VCF files wrongly uses "/" to separate different ALT's
+            for alt_i in re.split(r"[,/]", vcf_i.altbase):
+                vcf_variants[((contig, position), vcf_i.refbase, alt_i)] = vcf_i
+        return end > start, vcf_variants
+
+    def close(self) -> None:
+        # The memory maps are closed once they are no longer referenced
+        self.keys = self.payload_offsets = self.payload = np.zeros(0, dtype="u1")
+
+
+if __name__ == "__main__":
+    args = run()
+    build_known_sites_index(args.vcf_file, args.output_file, args.info_keys)
@@ -1,10 +1,13 @@
 import enum
+from bisect import bisect_right
+from collections import OrderedDict
 from dataclasses import dataclass
 from typing import Literal
 
 import pysam
 
 import somaticseq.genomic_file_parsers.genomic_file_handlers as genome
+from somaticseq.defaults import READ_CACHE_MAX_BYTES, READ_CACHE_MAX_READS
 
 CIGAR_ALN_MATCH = 0
 CIGAR_INSERTION = 1
@@ -49,8 +52,147 @@ class SequencingCall:
         )
 
 
+# How each CIGAR operation shows up in read.get_aligned_pairs(): as
+# (query_position, reference_position), (query_position, None), or
+# (None, reference_position). Hard-clipping does not show up at all.
+ALIGNED_PAIR = 0
+QUERY_ONLY_PAIR = 1
+REFERENCE_ONLY_PAIR = 2
+CIGAR_PAIR_TYPE = {
+    CIGAR_ALN_MATCH: ALIGNED_PAIR,
+    CIGAR_SEQ_MATCH: ALIGNED_PAIR,
+    CIGAR_SEQ_MISMATCH: ALIGNED_PAIR,
+    CIGAR_INSERTION: QUERY_ONLY_PAIR,
+    CIGAR_SOFT_CLIP: QUERY_ONLY_PAIR,
+    CIGAR_PADDING: QUERY_ONLY_PAIR,
+    CIGAR_DELETION: REFERENCE_ONLY_PAIR,
+    CIGAR_SKIP: REFERENCE_ONLY_PAIR,
+}
+
+
+class CigarIndex:
+    """
+    Cumulative query/reference offsets of the CIGAR blocks of a read. Any item
+    of read.get_aligned_pairs() can be resolved from it with a binary search
+    over the CIGAR operations, without creating the per-base lists.
+    """
+
+    __slots__ = (
+        "pair_types",
+        "pair_starts",
+        "query_starts",
+        "reference_starts",
+        "lengths",
+        "num_pairs",
+        "reference_block_starts",
+        "reference_blocks",
+        "first_aligned_coordinate",
+        "last_aligned_coordinate",
+    )
+
+    def __init__(
+        self, cigartuples: list[tuple[int, int]], reference_start: int
+    ) -> None:
+        self.pair_types: list[int] = []  # ALIGNED_PAIR, QUERY_ONLY_PAIR, etc.
+        self.pair_starts: list[int] = []  # index of its 1st aligned pair
+        self.query_starts: list[int] = []
+        self.reference_starts: list[int] = []
+        self.lengths: list[int] = []
+        # Blocks that consume the reference, for coordinate lookup
+        self.reference_block_starts: list[int] = []
+        self.reference_blocks: list[int] = []
+        self.first_aligned_coordinate: int | None = None
+        self.last_aligned_coordinate: int | None = None
+
+        num_pairs = 0
+        query_pos = 0
+        reference_pos = reference_start
+        for operation, length in cigartuples:
+            pair_type = CIGAR_PAIR_TYPE.get(operation)
+            if pair_type is None or length == 0:
+                continue
+            if pair_type != QUERY_ONLY_PAIR:
+                self.reference_block_starts.append(reference_pos)
+                self.reference_blocks.append(len(self.lengths))
+            if pair_type == ALIGNED_PAIR:
+                if self.first_aligned_coordinate is None:
+                    self.first_aligned_coordinate = reference_pos
+                self.last_aligned_coordinate = reference_pos + length - 1
+            self.pair_types.append(pair_type)
+            self.pair_starts.append(num_pairs)
+            self.query_starts.append(query_pos)
+            self.reference_starts.append(reference_pos)
+            self.lengths.append(length)
+            num_pairs += length
+            if pair_type != REFERENCE_ONLY_PAIR:
+                query_pos += length
+            if pair_type != QUERY_ONLY_PAIR:
+                reference_pos += length
+        self.num_pairs = num_pairs
+
+    @classmethod
+    def from_read(cls, read: pysam.AlignedSegment):
+        assert read.cigartuples is not None  # type checking
+        return cls(read.cigartuples, read.reference_start)
+
+    def block_of_pair(self, pair_index: int) -> int:
+        return bisect_right(self.pair_starts, pair_index) - 1
+
+    def pair_index_of_coordinate(self, coordinate: int) -> int | None:
+        """
+        Index of the aligned pair whose reference position is the coordinate
+        """
+        block_i = bisect_right(self.reference_block_starts, coordinate) - 1
+        if block_i < 0:
+            return None
+        block = self.reference_blocks[block_i]
+        offset = coordinate - self.reference_starts[block]
+        if offset >= self.lengths[block]:
+            return None
+        return self.pair_starts[block] + offset
+
+    def aligned_pair(self, pair_index: int) -> tuple[int | None, int | None]:
+        """
+        Same as read.get_aligned_pairs()[pair_index]
+        """
+        block = self.block_of_pair(pair_index)
+        offset = pair_index - self.pair_starts[block]
+        pair_type = self.pair_types[block]
+        if pair_type == ALIGNED_PAIR:
+            return (
+                self.query_starts[block] + offset,
+                self.reference_starts[block] + offset,
+            )
+        if pair_type == QUERY_ONLY_PAIR:
+            return self.query_starts[block] + offset, None
+        return None, self.reference_starts[block] + offset
+
+    def is_indel_pair(self, pair_index: int) -> bool:
+        """
+        Whether the query or the reference position of the aligned pair is None
+        """
+        return self.pair_types[self.block_of_pair(pair_index)] != ALIGNED_PAIR
+
+    def run_length(self, pair_index: int) -> int:
+        """
+        Number of consecutive aligned pairs starting at pair_index that are of
+        the same type, e.g., the length of a deletion or an insertion.
+        """
+        block = self.block_of_pair(pair_index)
+        pair_type = self.pair_types[block]
+        length = self.pair_starts[block] + self.lengths[block] - pair_index
+        for next_block in range(block + 1, len(self.pair_types)):
+            if self.pair_types[next_block] != pair_type:
+                break
+            length += self.lengths[next_block]
+        return length
+
+
 def alignment_in_read_for_coordinate(
-    read: pysam.AlignedSegment, coordinate: int, win_size: int = 3
+    read: pysam.AlignedSegment,
+    coordinate: int,
+    win_size: int = 3,
+    parsed_read: "ParsedRead | None" = None,
 ) -> SequencingCall:
     """
     Given a coordinate, return the alignment on the read
@@ -60,14 +202,23 @@ def alignment_in_read_for_coordinate(
         coordinate: genomic coordinate
         win_size: window size within which we will record the nearest indel,
             beyond which we will record "inf"
+        parsed_read: ParsedRead of the read if it has already been parsed,
+            e.g., from a ReadCache
 
     Returns:
         SequencingCall
     """
+    if parsed_read is None:
+        cigar_index = CigarIndex.from_read(read)
+        query_sequence = read.query_sequence
+    else:
+        cigar_index = parsed_read.cigar_index
+        query_sequence = parsed_read.query_sequence
+
     # If the coordinate is beyond the read's first and last aligned coordinate
-    aligned_coordinates = read.get_reference_positions()
-    start, stop = aligned_coordinates[0], aligned_coordinates[-1]
-    if not (start <= coordinate <= stop):
+    start = cigar_index.first_aligned_coordinate
+    stop = cigar_index.last_aligned_coordinate
+    if start is None or stop is None or not (start <= coordinate <= stop):
         return SequencingCall(
             call_type=None,
             position_on_read=None,
@@ -76,13 +227,10 @@ def alignment_in_read_for_coordinate(
             nearest_indel=None,
         )
 
-    aligned_pairs = read.get_aligned_pairs()
-    for i, aligned_pair in enumerate(aligned_pairs):
-        # The aligned_pair where the aligned coordinate matches the input param
-        if aligned_pair[1] == coordinate:
-            ith_base = aligned_pair[0]
-            ith_aligned_pair = i
-            break
+    # The aligned_pair where the aligned coordinate matches the input param
+    ith_aligned_pair = cigar_index.pair_index_of_coordinate(coordinate)
+    assert ith_aligned_pair is not None
+    ith_base = cigar_index.aligned_pair(ith_aligned_pair)[0]
 
     # If the coordinate is deleted from the sequencing read (i.e., when the
     # deletion alignment in this read occurs before the coordinate and ends
@@ -97,8 +245,8 @@ def alignment_in_read_for_coordinate(
         )
 
     # If the target position is aligned:
-    assert read.query_sequence
-    base_at_coordinate = read.query_sequence[ith_base]
+    assert query_sequence
+    base_at_coordinate = query_sequence[ith_base]
 
     # Whether if it's an indel depends on what happens after this position: If
     # the match (i.e., ith_aligned_pair, ith_base) is the final aligned_pair,
@@ -106,7 +254,8 @@ def alignment_in_read_for_coordinate(
     # If ith_aligned_pair is the final aligned_pair, we cannot check if there is
     # indel afterwards. Call it match because it is much more likely than indel,
     # but assign "nan" to indel_length and None to nearest_indel.
-    if ith_aligned_pair == len(aligned_pairs) - 1:
+    num_aligned_pairs = cigar_index.num_pairs
+    if ith_aligned_pair == num_aligned_pairs - 1:
         return SequencingCall(
             call_type=AlignmentType.match,
             position_on_read=ith_base,
@@ -119,44 +268,28 @@ def alignment_in_read_for_coordinate(
     # aligned_pair to see if it's an indel, and calculate more metrics
     # associated with this alignment.
     indel_length = 0
+    next_base, next_coordinate = cigar_index.aligned_pair(ith_aligned_pair + 1)
     # If the next aligned_pair is the next sequenced base, then the alignment at
     # coordinate is a Match: either a reference base or a SNP/SNV. Both are "M"
     # in CIGAR.
-    if (
-        aligned_pairs[ith_aligned_pair + 1][0] == ith_base + 1
-        and aligned_pairs[ith_aligned_pair + 1][1] == coordinate + 1
-    ):
+    if next_base == ith_base + 1 and next_coordinate == coordinate + 1:
         vtype = AlignmentType.match  # Reference read for mismatch
 
     # If the next reference position has no read position to it, it is a
     # deletion in this read at this coordinate. Indel length is negative for
     # deletion.
-    elif (
-        aligned_pairs[ith_aligned_pair + 1][0] is None
-        and aligned_pairs[ith_aligned_pair + 1][1] == coordinate + 1
-    ):
+    elif next_base is None and next_coordinate == coordinate + 1:
         vtype = AlignmentType.deletion  # Deletion
-        for align_j in aligned_pairs[ith_aligned_pair + 1 : :]:
-            if align_j[0] is None:
-                indel_length -= 1
-            else:
-                break
+        indel_length = -cigar_index.run_length(ith_aligned_pair + 1)
 
     # If the read position cannot be aligned to the reference, it can be an
     # insertion. Insertions sometimes show up with soft-clipping at the end if
     # the inserted sequence is "too long" to align on a single read. In this
     # case, the inserted length derived here is a lower limit of the real
     # inserted length.
-    elif (
-        aligned_pairs[ith_aligned_pair + 1][0] == ith_base + 1
-        and aligned_pairs[ith_aligned_pair + 1][1] is None
-    ):
+    elif next_base == ith_base + 1 and next_coordinate is None:
         vtype = AlignmentType.insertion  # Insertion or soft-clipping
-        for align_j in aligned_pairs[ith_aligned_pair + 1 : :]:
-            if align_j[1] is None:
-                indel_length += 1
-            else:
-                break
+        indel_length = cigar_index.run_length(ith_aligned_pair + 1)
 
     # See if there is insertion/deletion within 3 bp of "ith_base" on the query.
     # ith_base is the i_th aligned base. A positive indel length here indicate
@@ -171,15 +304,15 @@ def alignment_in_read_for_coordinate(
     # there is no base in it that aligns to this coordinate. If those two
     # scenarios occur right after an aligned base, that base position is counted
     # as an indel.
-    for step_right_i in range(min(win_size, len(aligned_pairs) - right_side_start - 1)):
+    for step_right_i in range(min(win_size, num_aligned_pairs - right_side_start - 1)):
         j = right_side_start + step_right_i
-        if aligned_pairs[j + 1][1] is None or aligned_pairs[j + 1][0] is None:
+        if cigar_index.is_indel_pair(j + 1):
             right_indel_flanks = step_right_i + 1
             break
 
     for step_left_i in range(min(win_size, left_side_start)):
         j = left_side_start - step_left_i
-        if aligned_pairs[j][1] is None or aligned_pairs[j][0] is None:
+        if cigar_index.is_indel_pair(j):
             left_indel_flanks = step_left_i + 1
             break
 
@@ -194,6 +327,135 @@ def alignment_in_read_for_coordinate(
     )
 
 
+class ParsedRead:
+    """
+    The decoded parts of a read that are looked at repeatedly during feature
+    extraction, i.e., its CIGAR index, sequence, base qualities, and NM tag.
+    """
+
+    __slots__ = (
+        "reference_id",
+        "reference_end",
+        "cigar_index",
+        "query_sequence",
+        "query_qualities",
+        "query_length",
+        "edit_distance",
+        "soft_clipped",
+        "_mean_base_quality",
+    )
+
+    def __init__(self, read: pysam.AlignedSegment) -> None:
+        assert read.cigartuples is not None  # type checking
+        self.reference_id = read.reference_id
+        self.reference_end = read.reference_end or read.reference_start + 1
+        self.cigar_index = CigarIndex(read.cigartuples, read.reference_start)
+        self.query_sequence = read.query_sequence
+        self.query_qualities = read.query_qualities
+        self.query_length = read.query_length
+        self.edit_distance: int | None
+        try:
+            self.edit_distance = read.get_tag("NM")  # type: ignore
+        except KeyError:
+            self.edit_distance = None
+        self.soft_clipped = (
+            read.cigartuples[0][0] == CIGAR_SOFT_CLIP
+            or read.cigartuples[-1][0] == CIGAR_SOFT_CLIP
+        )
+        self._mean_base_quality: float | None = None
+
+    @property
+    def mean_base_quality(self) -> float:
+        if self._mean_base_quality is None:
+            self._mean_base_quality = mean(self.query_qualities)
+        return self._mean_base_quality
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Rough estimate of the memory taken by this object
+        """
+        return 256 + 2 * self.query_length + 32 * len(self.cigar_index.lengths)
+
+
+class ReadCache:
+    """
+    Bounded LRU cache of ParsedRead keyed by the identity of the alignment, so
+    reads fetched again for neighbouring candidate sites (e.g., MNVs, indel
+    clusters, multi-allelic sites) are not parsed again. Use one cache per
+    alignment file, and call evict_before as the sorted coordinates advance.
+    """
+
+    def __init__(
+        self,
+        max_reads: int = READ_CACHE_MAX_READS,
+        max_bytes: int = READ_CACHE_MAX_BYTES,
+    ) -> None:
+        self.max_reads = max_reads
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._reads: OrderedDict[tuple, ParsedRead] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._reads)
+
+    def parse(self, read: pysam.AlignedSegment) -> ParsedRead:
+        key = (read.query_name, read.flag, read.reference_id, read.reference_start)
+        parsed_read = self._reads.get(key)
+        if parsed_read is not None:
+            self.hits += 1
+            self._reads.move_to_end(key)
+            return parsed_read
+
+        self.misses += 1
+        parsed_read = ParsedRead(read)
+        self._reads[key] = parsed_read
+        self.nbytes += parsed_read.nbytes
+        while self._reads and (
+            len(self._reads) > self.max_reads or self.nbytes > self.max_bytes
+        ):
+            self._evict_oldest()
+        return parsed_read
+
+    def evict_before(self, reference_id: int, coordinate: int) -> None:
+        """
+        Evict the least recently used reads that end before the 0-based
+        coordinate, or that are on a different contig.
+        """
+        while self._reads:
+            oldest = next(iter(self._reads.values()))
+            if (
+                oldest.reference_id == reference_id
+                and oldest.reference_end > coordinate
+            ):
+                break
+            self._evict_oldest()
+
+    def clear(self) -> None:
+        self._reads.clear()
+        self.nbytes = 0
+
+    def _evict_oldest(self) -> None:
+        _, parsed_read = self._reads.popitem(last=False)
+        self.nbytes -= parsed_read.nbytes
+        self.evictions += 1
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else nan
+        return (
+            f"{self.__class__.__name__}("
+            f"hits={self.hits}, "
+            f"misses={self.misses}, "
+            f"hit_rate={hit_rate:.3f}, "
+            f"evictions={self.evictions}, "
+            f"cached_reads={len(self)})"
+        )
+
+
 # Dedup test for BAM file
 def dedup_test(read: pysam.AlignedSegment, remove_dup_or_not: bool = True) -> bool:
     """
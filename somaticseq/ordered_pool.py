@@ -0,0 +1,92 @@
+"""
+Run tasks in a pool of worker processes, each holding its own long-lived
+worker object (e.g., with opened BAM and reference files), and get their
+results back in the order the tasks were submitted.
+"""
+
+from collections import deque
+from collections.abc import Callable, Iterator
+from multiprocessing import Pool
+from typing import Any
+
+# The worker object of a worker process
+_worker: Callable | None = None
+
+
+def _init_worker(worker_class: type, worker_args: tuple) -> None:
+    global _worker
+    _worker = worker_class(*worker_args)
+
+
+def _run_worker(task: Any) -> Any:
+    assert _worker is not None
+    return _worker(task)
+
+
+class OrderedWorkerPool:
+    """
+    Every worker process creates worker_class(*worker_args) once, and calls it
+    on each of its tasks. With a single process, the worker runs in this
+    process instead, without a pool. At most max_pending tasks are submitted
+    but not yet returned, so tasks are not queued faster than the workers can
+    process them.
+
+    Usage:
+        with OrderedWorkerPool(worker_class, worker_args, processes) as pool:
+            for task in tasks:
+                for result in pool.submit(task):
+                    ...
+            for result in pool.results():
+                ...
+    """
+
+    def __init__(
+        self,
+        worker_class: type,
+        worker_args: tuple = (),
+        processes: int = 1,
+        max_pending: int | None = None,
+    ) -> None:
+        self.processes = max(1, processes)
+        self.max_pending = max_pending or 2 * self.processes
+        self.pending: deque = deque()
+        if self.processes == 1:
+            self.worker = worker_class(*worker_args)
+            self.pool = None
+        else:
+            self.worker = None
+            self.pool = Pool(
+                processes=self.processes,
+                initializer=_init_worker,
+                initargs=(worker_class, worker_args),
+            )
+
+    def submit(self, task: Any) -> Iterator[Any]:
+        """
+        Submit a task, and yield the results of the earlier tasks that need to
+        be returned to keep the number of pending tasks under max_pending.
+        """
+        if self.pool is None:
+            yield self.worker(task)
+            return
+        self.pending.append(self.pool.apply_async(_run_worker, (task,)))
+        while len(self.pending) >= self.max_pending:
+            yield self.pending.popleft().get()
+
+    def results(self) -> Iterator[Any]:
+        """Yield the results of all the pending tasks."""
+        while self.pending:
+            yield self.pending.popleft().get()
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        elif hasattr(self.worker, "close"):
+            self.worker.close()
+
+    def __enter__(self) -> "OrderedWorkerPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,160 @@
+"""
+Find the candidate sites of a BED file or the whole genome from the BAM
+pileup, i.e., only the positions where enough reads support a non-reference
+allele, so vcf2tsv does not have to evaluate every position of the regions.
+"""
+
+from collections import Counter
+from collections.abc import Iterable, Iterator
+
+import pysam
+
+import somaticseq.genomic_file_parsers.genomic_file_handlers as genome
+
+CANDIDATE_VCF_HEADER = (
+    "##fileformat=VCFv4.1\n"
+    '##INFO=<ID=ALT_READS,Number=1,Type=Integer,Description="Reads supporting the ALT allele in the pileup">\n'
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+)
+
+# Unmapped, secondary, QC-fail, duplicate, and supplementary reads, which are
+# not counted toward the ALT reads of a candidate
+PILEUP_FLAG_FILTER = (
+    pysam.FUNMAP | pysam.FSECONDARY | pysam.FQCFAIL | pysam.FDUP | pysam.FSUPPLEMENTARY
+)
+
+
+def read_regions(
+    is_bed: str | None = None, is_pos: str | None = None, fai_file: str | None = None
+) -> Iterator[tuple[str, int, int]]:
+    """
+    0-based, half-open (contig, start, end) regions of the sites that vcf2tsv
+    would have evaluated from a BED file, a list of positions, or the .fai
+    file (i.e., whole genome), in the same order.
+    """
+    sites_file = is_bed or is_pos or fai_file
+    with genome.open_textfile(sites_file) as sites:
+        for line_i in sites:
+            if line_i.startswith(("#", "track=")) or not line_i.strip():
+                continue
+            item = line_i.rstrip().split("\t")
+            if is_bed:
+                yield item[0], int(item[1]), int(item[2])
+            elif is_pos:
+                yield item[0], int(item[1]) - 1, int(item[1])
+            else:
+                yield item[0], 0, int(item[1])
+
+
+def pileup_candidates(
+    bam: pysam.AlignmentFile,
+    ref_fa: pysam.FastaFile | genome.BlockCachedFasta,
+    contig: str,
+    start: int,
+    end: int,
+    min_alt_reads: int,
+    min_mq: float,
+    min_bq: float,
+) -> Iterator[tuple[int, str, str, int]]:
+    """
+    Walk the pileup of a region once, and yield every non-reference allele
+    with at least min_alt_reads reads, not counting the reads of
+    PILEUP_FLAG_FILTER.
+
+    Args:
+        bam: opened BAM file
+        ref_fa: opened reference fasta file
+        contig: contig of the region
+        start: 0-based start of the region
+        end: 0-based, exclusive end of the region
+        min_alt_reads: minimum number of reads supporting an ALT allele
+        min_mq: minimum mapping quality of the reads
+        min_bq: minimum base quality of the bases
+
+    Yields:
+        (1-based position, REF, ALT, number of reads) in VCF representation,
+        the most supported alleles at a position first
+    """
+    for column in bam.pileup(
+        contig,
+        start,
+        end,
+        truncate=True,
+        stepper="all",
+        flag_filter=PILEUP_FLAG_FILTER,
+        ignore_orphans=False,
+        ignore_overlaps=False,
+        min_base_quality=min_bq,
+        min_mapping_quality=min_mq,
+    ):
+        # Reference matches, pileup bases of the matches or mismatches, and
+        # the indels after them, e.g., "A", "c", "A+2GT", "a-3nnn", or "*", or
+        # ">" and "<" of the reads that skip the position (e.g., a spliced read)
+        query_sequences = column.get_query_sequences(add_indels=True)
+        position = column.reference_pos
+        ref_base = ref_fa.fetch(contig, position, position + 1).upper()
+        if ref_base == "N":
+            continue
+        allele_counts = Counter()
+        for query_sequence in query_sequences:
+            query_sequence = query_sequence.upper()
+            if len(query_sequence) > 1:
+                indel_length = int(query_sequence[2:].rstrip("ACGTN"))
+                if query_sequence[1] == "+":
+                    allele = (ref_base, ref_base + query_sequence[-indel_length:])
+                else:
+                    allele = (
+                        ref_base
+                        + ref_fa.fetch(
+                            contig, position + 1, position + 1 + indel_length
+                        ).upper(),
+                        ref_base,
+                    )
+                allele_counts[allele] += 1
+            elif query_sequence not in (ref_base, "", "*", "N", ">", "<"):
+                allele_counts[(ref_base, query_sequence)] += 1
+
+        for (ref, alt), count in allele_counts.most_common():
+            if count < min_alt_reads:
+                break
+            yield position + 1, ref, alt, count
+
+
+def write_candidate_vcf(
+    bam_file: str,
+    ref_fa: str,
+    regions: Iterable[tuple[str, int, int]],
+    outfile: str,
+    min_alt_reads: int,
+    min_mq: float,
+    min_bq: float,
+) -> str:
+    """
+    Write the pileup_candidates of every region into a VCF file, to be used
+    as the input sites of vcf2tsv.
+
+    Returns:
+        outfile
+    """
+    with pysam.AlignmentFile(
+        bam_file, reference_filename=ref_fa
+    ) as bam, genome.BlockCachedFasta(ref_fa) as reference, open(
+        outfile, "w"
+    ) as vcf_out:
+        vcf_out.write(CANDIDATE_VCF_HEADER)
+        last_contig, last_position = None, 0
+        for contig, start, end in regions:
+            # Overlapping regions
+            if contig == last_contig:
+                start = max(start, last_position)
+                if start >= end:
+                    continue
+            for position, ref, alt, count in pileup_candidates(
+                bam, reference, contig, start, end, min_alt_reads, min_mq, min_bq
+            ):
+                vcf_out.write(
+                    f"{contig}\t{position}\t.\t{ref}\t{alt}\t.\t.\tALT_READS={count}\n"
+                )
+            if contig != last_contig or end > last_position:
+                last_contig, last_position = contig, end
+    return outfile
@@ -0,0 +1,70 @@
+"""
+Run a stage of a pipeline ahead of its consumer in a background thread,
+through a bounded queue, so the I/O of the stage (e.g., reading VCF files or
+decompressing BAM blocks) overlaps with the computation of the next stage.
+"""
+
+import queue
+import threading
+from collections.abc import Iterable, Iterator
+from typing import TypeVar
+
+from somaticseq.defaults import PREFETCH_MAX_BLOCKS
+
+T = TypeVar("T")
+
+# Seconds between checks of whether the consumer has stopped
+_POLL_INTERVAL = 0.1
+
+
+class _EndOfItems:
+    def __init__(self, error: BaseException | None = None) -> None:
+        self.error = error
+
+
+def prefetch(
+    items: Iterable[T], max_prefetch: int = PREFETCH_MAX_BLOCKS
+) -> Iterator[T]:
+    """
+    Same items in the same order, but iterated over in a background thread up
+    to max_prefetch items ahead of the consumer. An exception raised by items
+    is raised again in the consumer's thread. If the consumer stops early, the
+    background thread stops after its current item.
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=max(1, max_prefetch))
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as error:
+            put(_EndOfItems(error))
+        else:
+            put(_EndOfItems())
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if isinstance(item, _EndOfItems):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+        if hasattr(items, "close"):
+            items.close()
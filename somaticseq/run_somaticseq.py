@@ -12,6 +12,7 @@ import somaticseq.somatic_tsv2vcf as tsv2vcf
 import somaticseq.somatic_vcf2tsv as somatic_vcf2tsv
 import somaticseq.somatic_xgboost as somatic_xgboost
 from somaticseq._version import __version__
+from somaticseq.candidate_sites import CandidateSites
 from somaticseq.defaults import (
     ALGORITHM,
     CLASSIFIED_PREFIX,
@@ -119,6 +120,31 @@ def model_predictor(
         return output_file
 
 
+def classifier_feature_manifest(
+    classifier_snv: str | None,
+    classifier_indel: str | None,
+    algo: Literal["xgboost", "ada"] = ALGORITHM,
+    skip_unused_features: bool = False,
+) -> list[str] | None:
+    """
+    The feature manifests (see feature_manifest.py) of the features extracted
+    for prediction, i.e., the xgboost classifiers of both SNVs and INDELs, if
+    skip_unused_features. None (all features) otherwise, e.g., for training or
+    for the consensus mode of either variant type.
+    """
+    logger = logging.getLogger(classifier_feature_manifest.__name__)
+
+    if not skip_unused_features:
+        return None
+    if algo != "xgboost" or not (classifier_snv and classifier_indel):
+        logger.warning(
+            "Features are only skipped with xgboost classifiers of both SNVs "
+            "and INDELs, so all of them are computed."
+        )
+        return None
+    return [classifier_snv, classifier_indel]
+
+
 def run_paired_mode(
     outdir: str,
     ref: str,
@@ -170,6 +196,9 @@ def run_paired_mode(
     iterations: int | None = None,
     features_excluded: list[str] | None = None,
     hyperparameters: list[str] | None = None,
+    max_reads: int | None = None,
+    downsample_seed: int = 0,
+    skip_unused_features: bool = False,
 ) -> None:
     logger = logging.getLogger(run_paired_mode.__name__)
 
@@ -262,38 +291,70 @@ def run_paired_mode(
 
     ensemble_snv = os.sep.join((outdir, ensemble_outfile_prefix + SNV_TSV_SUFFIX))
     ensemble_indel = os.sep.join((outdir, ensemble_outfile_prefix + INDEL_TSV_SUFFIX))
-    # SNV
-    mutect_infile = (
+    # SNV and INDEL features are extracted together in a single pass
+    mutect_snv_infile = (
         intermediate_vcfs["MuTect2"]["snv"]
         if intermediate_vcfs["MuTect2"]["snv"]
         else mutect
     )
-    somatic_vcf2tsv.vcf2tsv(
-        is_vcf=out_snv,
+    mutect_indel_infile = (
+        intermediate_vcfs["MuTect2"]["indel"]
+        if intermediate_vcfs["MuTect2"]["indel"]
+        else indelocator
+    )
+    somatic_vcf2tsv.extract_features(
+        [
+            CandidateSites(
+                sites_file=out_snv,
+                sites_format="vcf",
+                outfile=ensemble_snv,
+                caller_vcfs=dict(
+                    mutect=mutect_snv_infile,
+                    varscan=varscan_snv,
+                    jsm=jsm,
+                    sniper=sniper,
+                    vardict=intermediate_vcfs["VarDict"]["snv"],
+                    muse=muse,
+                    lofreq=lofreq_snv,
+                    strelka=strelka_snv,
+                    tnscope=intermediate_vcfs["TNscope"]["snv"],
+                    platypus=intermediate_vcfs["Platypus"]["snv"],
+                ),
+                truth=truth_snv,
+                arbitrary_vcfs=intermediate_vcfs["Arbitrary"]["snv"],
+            ),
+            CandidateSites(
+                sites_file=out_indel,
+                sites_format="vcf",
+                outfile=ensemble_indel,
+                caller_vcfs=dict(
+                    mutect=mutect_indel_infile,
+                    varscan=varscan_indel,
+                    vardict=intermediate_vcfs["VarDict"]["indel"],
+                    lofreq=lofreq_indel,
+                    scalpel=scalpel,
+                    strelka=strelka_indel,
+                    tnscope=intermediate_vcfs["TNscope"]["indel"],
+                    platypus=intermediate_vcfs["Platypus"]["indel"],
+                ),
+                truth=truth_indel,
+                arbitrary_vcfs=intermediate_vcfs["Arbitrary"]["indel"],
+            ),
+        ],
         nbam_fn=nbam,
         tbam_fn=tbam,
-        truth=truth_snv,
+        ref_fa=ref,
         cosmic=cosmic,
         dbsnp=dbsnp,
-        mutect=mutect_infile,
-        varscan=varscan_snv,
-        jsm=jsm,
-        sniper=sniper,
-        vardict=intermediate_vcfs["VarDict"]["snv"],
-        muse=muse,
-        lofreq=lofreq_snv,
-        scalpel=None,
-        strelka=strelka_snv,
-        tnscope=intermediate_vcfs["TNscope"]["snv"],
-        platypus=intermediate_vcfs["Platypus"]["snv"],
-        arbitrary_vcfs=intermediate_vcfs["Arbitrary"]["snv"],
-        dedup=True,
         min_mq=min_mq,
         min_bq=min_bq,
         min_caller=min_caller,
-        ref_fa=ref,
         p_scale=None,
-        outfile=ensemble_snv,
+        max_reads=max_reads,
+        downsample_seed=downsample_seed,
+        feature_manifest=classifier_feature_manifest(
+            classifier_snv, classifier_indel, algo, skip_unused_features
+        ),
     )
 
     # Classify SNV calls
@@ -362,36 +423,6 @@ def run_paired_mode(
             tumor_sample_name=tumor_name,
             print_reject=True,
         )
-    # INDEL
-    mutect_infile = (
-        intermediate_vcfs["MuTect2"]["indel"]
-        if intermediate_vcfs["MuTect2"]["indel"]
-        else indelocator
-    )
-    somatic_vcf2tsv.vcf2tsv(
-        is_vcf=out_indel,
-        nbam_fn=nbam,
-        tbam_fn=tbam,
-        truth=truth_indel,
-        cosmic=cosmic,
-        dbsnp=dbsnp,
-        mutect=mutect_infile,
-        varscan=varscan_indel,
-        vardict=intermediate_vcfs["VarDict"]["indel"],
-        lofreq=lofreq_indel,
-        scalpel=scalpel,
-        strelka=strelka_indel,
-        tnscope=intermediate_vcfs["TNscope"]["indel"],
-        platypus=intermediate_vcfs["Platypus"]["indel"],
-        arbitrary_vcfs=intermediate_vcfs["Arbitrary"]["indel"],
-        dedup=True,
-        min_mq=min_mq,
-        min_bq=min_bq,
-        min_caller=min_caller,
-        ref_fa=ref,
-        p_scale=None,
-        outfile=ensemble_indel,
-    )
     # Classify INDEL calls
     if classifier_indel:
         consensus_indel_tsv = os.sep.join(
@@ -504,6 +535,9 @@ def run_single_mode(
     iterations: int | None = None,
     features_excluded: list[str] | None = None,
     hyperparameters: list[str] | None = None,
+    max_reads: int | None = None,
+    downsample_seed: int = 0,
+    skip_unused_features: bool = False,
 ):
     logger = logging.getLogger(run_single_mode.__name__)
 
@@ -571,33 +605,59 @@ def run_single_mode(
     ensemble_snv = os.sep.join((outdir, ensemble_outfile_prefix + SNV_TSV_SUFFIX))
     ensemble_indel = os.sep.join((outdir, ensemble_outfile_prefix + INDEL_TSV_SUFFIX))
 
-    # SNV
-    mutect_infile = (
+    # SNV and INDEL features are extracted together in a single pass
+    mutect_snv_infile = (
         intermediate_vcfs["MuTect2"]["snv"]
         if intermediate_vcfs["MuTect2"]["snv"]
         else mutect
     )
-    single_sample_vcf2tsv.vcf2tsv(
-        is_vcf=out_snv,
+    single_sample_vcf2tsv.extract_features(
+        [
+            CandidateSites(
+                sites_file=out_snv,
+                sites_format="vcf",
+                outfile=ensemble_snv,
+                caller_vcfs=dict(
+                    mutect=mutect_snv_infile,
+                    varscan=intermediate_vcfs["VarScan2"]["snv"],
+                    vardict=intermediate_vcfs["VarDict"]["snv"],
+                    lofreq=intermediate_vcfs["LoFreq"]["snv"],
+                    strelka=intermediate_vcfs["Strelka"]["snv"],
+                ),
+                truth=truth_snv,
+                arbitrary_vcfs=intermediate_vcfs["Arbitrary"]["snv"],
+            ),
+            CandidateSites(
+                sites_file=out_indel,
+                sites_format="vcf",
+                outfile=ensemble_indel,
+                caller_vcfs=dict(
+                    mutect=intermediate_vcfs["MuTect2"]["indel"],
+                    varscan=intermediate_vcfs["VarScan2"]["indel"],
+                    vardict=intermediate_vcfs["VarDict"]["indel"],
+                    lofreq=intermediate_vcfs["LoFreq"]["indel"],
+                    scalpel=scalpel,
+                    strelka=intermediate_vcfs["Strelka"]["indel"],
+                ),
+                truth=truth_indel,
+                arbitrary_vcfs=intermediate_vcfs["Arbitrary"]["indel"],
+            ),
+        ],
         bam_fn=bam,
-        truth=truth_snv,
+        ref_fa=ref,
         cosmic=cosmic,
         dbsnp=dbsnp,
-        mutect=mutect_infile,
-        varscan=intermediate_vcfs["VarScan2"]["snv"],
-        vardict=intermediate_vcfs["VarDict"]["snv"],
-        lofreq=intermediate_vcfs["LoFreq"]["snv"],
-        scalpel=None,
-        strelka=intermediate_vcfs["Strelka"]["snv"],
-        arbitrary_vcfs=intermediate_vcfs["Arbitrary"]["snv"],
-        dedup=True,
         min_mq=min_mq,
         min_bq=min_bq,
         min_caller=min_caller,
-        ref_fa=ref,
         p_scale=None,
-        outfile=ensemble_snv,
+        max_reads=max_reads,
+        downsample_seed=downsample_seed,
+        feature_manifest=classifier_feature_manifest(
+            classifier_snv, classifier_indel, algo, skip_unused_features
+        ),
     )
+
     # Classify SNV calls
     if classifier_snv:
         classified_snv_tsv = os.sep.join(
@@ -661,28 +721,6 @@ def run_single_mode(
             tumor_sample_name=sample_name,
             print_reject=True,
         )
-    # INDEL
-    single_sample_vcf2tsv.vcf2tsv(
-        is_vcf=out_indel,
-        bam_fn=bam,
-        truth=truth_indel,
-        cosmic=cosmic,
-        dbsnp=dbsnp,
-        mutect=intermediate_vcfs["MuTect2"]["indel"],
-        varscan=intermediate_vcfs["VarScan2"]["indel"],
-        vardict=intermediate_vcfs["VarDict"]["indel"],
-        lofreq=intermediate_vcfs["LoFreq"]["indel"],
-        scalpel=scalpel,
-        strelka=intermediate_vcfs["Strelka"]["indel"],
-        arbitrary_vcfs=intermediate_vcfs["Arbitrary"]["indel"],
-        dedup=True,
-        min_mq=min_mq,
-        min_bq=min_bq,
-        min_caller=min_caller,
-        ref_fa=ref,
-        p_scale=None,
-        outfile=ensemble_indel,
-    )
     # Classify INDEL calls
     if classifier_indel:
         consensus_indel_tsv = os.sep.join(
@@ -823,6 +861,25 @@ def run() -> argparse.Namespace:
         help="Minimum base quality below which is considered poor",
         default=MIN_BASE_QUALITY,
     )
+    parser.add_argument(
+        "-maxreads",
+        "--max-reads-per-site",
+        type=int,
+        help="Compute the BAM features of a site from this many of its reads, sampled by strand, if it has more. Its depth is still the number of all the reads.",
+    )
+    parser.add_argument(
+        "-dsseed",
+        "--downsample-seed",
+        type=int,
+        help="Seed of the sampling of reads with --max-reads-per-site",
+        default=0,
+    )
+    parser.add_argument(
+        "--skip-unused-features",
+        action="store_true",
+        help="With both xgboost classifiers, only compute the optional features they consume. The others are nan in the Ensemble TSV files.",
+        default=False,
+    )
     parser.add_argument(
         "-mincaller",
         "--minimum-num-callers",
@@ -834,9 +891,14 @@ def run() -> argparse.Namespace:
         "-dbsnp",
         "--dbsnp-vcf",
         type=str,
-        help="dbSNP VCF",
+        help="dbSNP VCF, or its known_sites_index.py index",
+    )
+    parser.add_argument(
+        "-cosmic",
+        "--cosmic-vcf",
+        type=str,
+        help="COSMIC VCF, or its known_sites_index.py index",
     )
-    parser.add_argument("-cosmic", "--cosmic-vcf", type=str, help="COSMIC VCF")
     parser.add_argument(
         "-include", "--inclusion-region", type=str, help="inclusion bed"
     )
@@ -846,6 +908,20 @@ def run() -> argparse.Namespace:
     parser.add_argument(
         "-nt", "--threads", type=int, help="number of threads", default=1
     )
+    parser.add_argument(
+        "-units",
+        "--work-units-per-thread",
+        type=int,
+        help="For somaticseq_parallel.py, split the regions into this many work units per thread, which are dispatched to whichever thread is idle, so a slow region does not hold up the other threads",
+        default=1,
+    )
+    parser.add_argument(
+        "-splitcov",
+        "--split-by-coverage",
+        action="store_true",
+        help="For somaticseq_parallel.py, split the regions for the threads by the coverage of the BAM files and the candidate variants of the callers, instead of into equal sizes",
+        default=False,
+    )
     parser.add_argument(
         "-train",
         "--somaticseq-train",
@@ -1159,6 +1235,9 @@ if __name__ == "__main__":
             features_excluded=args.features_excluded,
             hyperparameters=args.extra_hyperparameters,
             keep_intermediates=args.keep_intermediates,
+            max_reads=args.max_reads_per_site,
+            downsample_seed=args.downsample_seed,
+            skip_unused_features=args.skip_unused_features,
         )
     elif args.which == "single":
         run_single_mode(
@@ -1198,4 +1277,7 @@ if __name__ == "__main__":
             features_excluded=args.features_excluded,
             hyperparameters=args.extra_hyperparameters,
             keep_intermediates=args.keep_intermediates,
+            max_reads=args.max_reads_per_site,
+            downsample_seed=args.downsample_seed,
+            skip_unused_features=args.skip_unused_features,
         )
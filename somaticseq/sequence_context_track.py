@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Precompute the linguistic sequence complexity features of a reference, i.e.,
+Seq_Complexity_Span and Seq_Complexity_Adj of vcf2tsv, for every position of
+the genome or of the target regions. They only depend on the reference, so a
+reference (e.g., of a panel) that is used over and over again can be looked
+up from the track rather than computed for every candidate site of every
+sample.
+
+All three sequence windows of a candidate site (the one spanning it and the
+ones to its left and right) are CONTEXT_WINDOW_LENGTH long, so the track
+stores the number of distinct substrings of the window starting at every
+position of the genome or around the target regions. Each contig has one
+memory-mapped uint16 array of its windows, and the segments (i.e., ranges of
+window starts) of the array. Zero means the window was not computed (e.g., it
+has an N), and it is then computed on the fly, as is every window outside the
+segments.
+"""
+
+import argparse
+import bisect
+import json
+import logging
+import os
+
+import numpy as np
+import pysam
+
+import somaticseq.sequencing_features as sequencing_features
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+ch.setFormatter(formatter)
+logger = logging.getLogger(os.path.basename(__file__))
+logger.setLevel(logging.DEBUG)
+logger.addHandler(ch)
+
+TRACK_FORMAT_VERSION = 3
+TRACK_INDEX = "track.json"
+CONTEXT_WINDOW_LENGTH = 81
+MAX_SUBSTRING_LENGTH = 20
+
+# Windows counted at a time, which bounds the memory of building a track
+TRACK_CHUNK_SIZE = 2**14
+
+# 2-bit codes of the bases, and BASE_CODES[N] (or any other base) marks the
+# windows that are not counted
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for base_code, base in enumerate(b"ACGT"):
+    BASE_CODES[base] = base_code
+
+
+def run() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Precompute the sequence complexity of every position of a reference, to be looked up by vcf2tsv with -context.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-ref",
+        "--genome-reference",
+        type=str,
+        help="reference fasta file with its .fai index",
+        required=True,
+    )
+    parser.add_argument(
+        "-bed",
+        "--target-regions",
+        type=str,
+        help="only precompute the positions in these regions",
+    )
+    parser.add_argument(
+        "-outdir",
+        "--output-directory",
+        type=str,
+        help="output directory of the track",
+        required=True,
+    )
+    args = parser.parse_args()
+    return args
+
+
+def read_regions(
+    bed_file: str | None, contig_lengths: dict[str, int]
+) -> dict[str, list[tuple[int, int]]]:
+    """
+    0-based, half-open regions of each contig, i.e., the whole contigs if
+    bed_file is None.
+    """
+    if bed_file is None:
+        return {contig: [(0, length)] for contig, length in contig_lengths.items()}
+    regions: dict[str, list[tuple[int, int]]] = {}
+    with open(bed_file) as bed:
+        for line_i in bed:
+            if line_i.startswith(("#", "track", "browser")) or not line_i.strip():
+                continue
+            contig, start, end = line_i.rstrip().split("\t")[:3]
+            regions.setdefault(contig, []).append((int(start), int(end)))
+    return regions
+
+
+def distinct_substring_counts(
+    sequence: str, window_length: int, max_substring_length: int
+) -> np.ndarray:
+    """
+    Same as count_distinct_substrings(window, max_substring_length) of every
+    window of the sequence, i.e., of sequence[i : i + window_length] for i in
+    range(len(sequence) - window_length + 1), but 0 for the windows with a base
+    other than A, C, G, or T.
+
+    For every substring length k, the distinct k-mers of a window are those
+    whose previous occurrence is before the window. When the window moves by
+    a base, its first k-mer leaves, and the next occurrence of that k-mer (if
+    it is in the window) becomes distinct, and the k-mer that enters is
+    distinct if its previous occurrence is before the new window. The k-mers
+    are kept sorted by their rank and position, and every k refines the order
+    of the (k-1)-mers by their next base, which is mostly sorted already.
+    """
+    bases = BASE_CODES[np.frombuffer(sequence.upper().encode("ascii"), np.uint8)]
+    num_windows = len(bases) - window_length + 1
+    if num_windows <= 0:
+        return np.zeros(0, dtype=np.uint16)
+    uncounted = np.concatenate(([0], np.cumsum(bases == 4)))
+    uncounted = uncounted[window_length:] > uncounted[:num_windows]
+    bases[bases == 4] = 0
+
+    counts = np.zeros(num_windows, dtype=np.int64)
+    # Positions of the k-mers in sorted order, and the rank of every k-mer
+    order = np.arange(len(bases))
+    ranks = np.zeros(len(bases), dtype=np.int64)
+    window_starts = np.arange(num_windows - 1)
+    for k in range(1, min(max_substring_length, window_length) + 1):
+        num_kmers = len(bases) - k + 1
+        kmers = ranks[:num_kmers] * 4 + bases[k - 1 :]
+        order = order[order < num_kmers]
+        order = order[np.argsort(kmers[order], kind="stable")]
+        repeated = kmers[order[1:]] == kmers[order[:-1]]
+        ranks = np.empty(num_kmers, dtype=np.int64)
+        ranks[order] = np.concatenate(([0], np.cumsum(~repeated)))
+        kmers_per_window = window_length - k + 1
+
+        # Previous and next occurrences of every k-mer
+        previous = np.full(num_kmers, -1, dtype=np.int64)
+        previous[order[1:][repeated]] = order[:-1][repeated]
+        following = np.full(num_kmers, num_kmers, dtype=np.int64)
+        following[order[:-1][repeated]] = order[1:][repeated]
+
+        first_window = np.count_nonzero(previous[:kmers_per_window] < 0)
+        changes = (
+            (previous[window_starts + kmers_per_window] <= window_starts).astype(
+                np.int64
+            )
+            - 1
+            + (following[: num_windows - 1] < window_starts + kmers_per_window)
+        )
+        counts[0] += first_window
+        counts[1:] += first_window + np.cumsum(changes)
+
+    counts[uncounted] = 0
+    return counts.astype(np.uint16)
+
+
+def window_segments(
+    regions: list[tuple[int, int]], contig_length: int
+) -> list[tuple[int, int]]:
+    """
+    Sorted, merged [start, end) ranges of the starts of the windows to the
+    left and right of, and spanning, every site of the regions.
+    """
+    segments: list[tuple[int, int]] = []
+    for region_start, region_end in sorted(regions):
+        start = max(0, region_start - CONTEXT_WINDOW_LENGTH)
+        end = min(contig_length, region_end + CONTEXT_WINDOW_LENGTH)
+        end = end - CONTEXT_WINDOW_LENGTH + 1
+        if end <= start:
+            continue
+        if segments and start <= segments[-1][1]:
+            segments[-1] = (segments[-1][0], max(segments[-1][1], end))
+        else:
+            segments.append((start, end))
+    return segments
+
+
+def build_context_track(
+    ref_fa: str, out_directory: str, bed_file: str | None = None
+) -> str:
+    """
+    Precompute the track of a reference. The windows are counted
+    TRACK_CHUNK_SIZE at a time, and written into the memory-mapped array of
+    their contig.
+
+    Args:
+        ref_fa: fasta file with its .fai index
+        out_directory: output directory of the track
+        bed_file: only precompute the windows around these regions
+
+    Returns:
+        out_directory
+    """
+    os.makedirs(out_directory, exist_ok=True)
+    contigs = {}
+    with pysam.FastaFile(ref_fa) as reference:
+        contig_lengths = dict(zip(reference.references, reference.lengths))
+        regions = read_regions(bed_file, contig_lengths)
+        for contig_i, (contig, length) in enumerate(contig_lengths.items()):
+            segments = window_segments(regions.get(contig, []), length)
+            if not segments:
+                continue
+            # Window start, window end, and offset in the array of every segment
+            segment_table = np.zeros((len(segments), 3), dtype=np.int64)
+            segment_table[:, :2] = segments
+            segment_table[1:, 2] = np.cumsum(
+                segment_table[:-1, 1] - segment_table[:-1, 0]
+            )
+            track_file = f"contig_{contig_i}.npy"
+            segments_file = f"contig_{contig_i}.segments.npy"
+            np.save(os.path.join(out_directory, segments_file), segment_table)
+            track = np.lib.format.open_memmap(
+                os.path.join(out_directory, track_file),
+                mode="w+",
+                dtype=np.uint16,
+                shape=(int(np.sum(segment_table[:, 1] - segment_table[:, 0])),),
+            )
+            for segment_start, segment_end, offset in segment_table.tolist():
+                for chunk_start in range(segment_start, segment_end, TRACK_CHUNK_SIZE):
+                    chunk_end = min(chunk_start + TRACK_CHUNK_SIZE, segment_end)
+                    sequence = reference.fetch(
+                        contig, chunk_start, chunk_end + CONTEXT_WINDOW_LENGTH - 1
+                    )
+                    track_start = offset + chunk_start - segment_start
+                    track[track_start : track_start + chunk_end - chunk_start] = (
+                        distinct_substring_counts(
+                            sequence, CONTEXT_WINDOW_LENGTH, MAX_SUBSTRING_LENGTH
+                        )
+                    )
+            track.flush()
+            del track
+            contigs[contig] = {"file": track_file, "segments": segments_file}
+            logger.info(f"Precomputed {contig}.")
+
+    with open(os.path.join(out_directory, TRACK_INDEX), "w") as index_out:
+        json.dump(
+            {
+                "version": TRACK_FORMAT_VERSION,
+                "reference": os.path.basename(ref_fa),
+                "contig_lengths": contig_lengths,
+                "window_length": CONTEXT_WINDOW_LENGTH,
+                "max_substring_length": MAX_SUBSTRING_LENGTH,
+                "contigs": contigs,
+            },
+            index_out,
+            indent=2,
+        )
+    return out_directory
+
+
+def read_track_index(track_directory: str) -> dict:
+    with open(os.path.join(track_directory, TRACK_INDEX)) as index_in:
+        index = json.load(index_in)
+    if index["version"] != TRACK_FORMAT_VERSION:
+        raise ValueError(
+            f"{track_directory} is version {index['version']} of the sequence "
+            f"context track, not {TRACK_FORMAT_VERSION}."
+        )
+    return index
+
+
+def check_track_reference(track_directory: str, ref_fa: str) -> None:
+    """
+    Raise ValueError if the track was not built from a reference with the
+    same contigs and contig lengths as ref_fa, e.g., from another build of the
+    genome with the same contig names.
+    """
+    index = read_track_index(track_directory)
+    with pysam.FastaFile(ref_fa) as reference:
+        contig_lengths = dict(zip(reference.references, reference.lengths))
+    if index["contig_lengths"] != contig_lengths:
+        mismatches = [
+            contig
+            for contig in index["contig_lengths"].keys() | contig_lengths.keys()
+            if index["contig_lengths"].get(contig) != contig_lengths.get(contig)
+        ]
+        raise ValueError(
+            f"{track_directory} was built from {index['reference']}, whose "
+            f"contigs are not the same as those of {ref_fa}: "
+            + ", ".join(sorted(mismatches)[:10])
+        )
+
+
+class SequenceContextTrack:
+    """
+    Precomputed track of a reference, memory-mapped read-only.
+    """
+
+    def __init__(self, track_directory: str) -> None:
+        index = read_track_index(track_directory)
+        self.window_length = index["window_length"]
+        self.max_substring_length = index["max_substring_length"]
+        self.max_number_of_subseqs = sequencing_features.max_sub_vocabularies(
+            self.window_length, self.max_substring_length
+        )
+        # Window starts, window ends, and offsets of the segments, and the
+        # array of every contig
+        self.tracks = {}
+        for contig, contig_track in index["contigs"].items():
+            segment_table = np.load(
+                os.path.join(track_directory, contig_track["segments"])
+            )
+            segment_starts, segment_ends, offsets = segment_table.T.tolist()
+            track = np.load(
+                os.path.join(track_directory, contig_track["file"]), mmap_mode="r"
+            )
+            self.tracks[contig] = (segment_starts, segment_ends, offsets, track)
+
+    def num_distinct_substrings(self, contig: str, start: int) -> int:
+        """
+        Number of distinct substrings of the window starting at the 0-based
+        start, or 0 if it is not in the track.
+        """
+        if contig not in self.tracks:
+            return 0
+        segment_starts, segment_ends, offsets, track = self.tracks[contig]
+        i = bisect.bisect_right(segment_starts, start) - 1
+        if i < 0 or start >= segment_ends[i]:
+            return 0
+        return int(track[offsets[i] + start - segment_starts[i]])
+
+
+class TrackedLinguisticComplexity:
+    """
+    Same as SlidingLinguisticComplexity, but looks up every full-length window
+    in the SequenceContextTrack first.
+    """
+
+    def __init__(self, track: SequenceContextTrack) -> None:
+        self.track = track
+        self.sliding_lc = sequencing_features.SlidingLinguisticComplexity(
+            track.max_substring_length
+        )
+
+    def __call__(self, contig: str, start: int, sequence: str) -> float:
+        if len(sequence) == self.track.window_length:
+            number_of_subseqs = self.track.num_distinct_substrings(contig, start)
+            if number_of_subseqs:
+                return number_of_subseqs / self.track.max_number_of_subseqs
+        return self.sliding_lc(contig, start, sequence)
+
+
+if __name__ == "__main__":
+    args = run()
+    build_context_track(
+        args.genome_reference, args.output_directory, args.target_regions
+    )
@@ -1,12 +1,18 @@
+from collections import Counter
+
 import pysam
 
 import somaticseq.genomic_file_parsers.genomic_file_handlers as genome
 
 nan = float("nan")
 
+# A window that moves further than this many bases is counted anew, which is
+# quicker than updating the substrings of every base it moved by
+SLIDING_LC_MAX_STEP = 4
+
 
 def get_homopolymer_lengths(
-    ref_fa: pysam.FastaFile,
+    ref_fa: pysam.FastaFile | genome.BlockCachedFasta,
     my_coordinate: tuple[str, int, int],
     ref_base: str,
     first_alt: str,
@@ -104,6 +110,54 @@ def max_vocabularies(seq_length: int) -> int:
     return counts
 
 
+def count_distinct_substrings(
+    sequence: str, max_substring_length: int | None = None
+) -> int:
+    """
+    Number of distinct substrings of the sequence, only counting those up to
+    max_substring_length long (if not None). Counted from the suffix automaton
+    of the sequence, which is built in linear time, rather than from a set of
+    every substring.
+    """
+    # Each state of the automaton stands for the substrings longer than those
+    # of its suffix link, up to its own length.
+    lengths = [0]
+    links = [-1]
+    transitions: list[dict[str, int]] = [{}]
+    last = 0
+    for base in sequence:
+        current = len(lengths)
+        lengths.append(lengths[last] + 1)
+        links.append(0)
+        transitions.append({})
+        state = last
+        while state != -1 and base not in transitions[state]:
+            transitions[state][base] = current
+            state = links[state]
+        if state != -1:
+            next_state = transitions[state][base]
+            if lengths[state] + 1 == lengths[next_state]:
+                links[current] = next_state
+            else:
+                clone = len(lengths)
+                lengths.append(lengths[state] + 1)
+                links.append(links[next_state])
+                transitions.append(dict(transitions[next_state]))
+                while state != -1 and transitions[state].get(base) == next_state:
+                    transitions[state][base] = clone
+                    state = links[state]
+                links[next_state] = clone
+                links[current] = clone
+        last = current
+
+    if max_substring_length is None:
+        return sum(lengths[i] - lengths[links[i]] for i in range(1, len(lengths)))
+    return sum(
+        max(0, min(lengths[i], max_substring_length) - lengths[links[i]])
+        for i in range(1, len(lengths))
+    )
+
+
 def linguistic_sequence_complexity(sequence: str) -> float:
     # Calculate linguistic sequence complexity according to
     # https://doi.org/10.1093/bioinformatics/18.5.679
@@ -112,17 +166,8 @@ def linguistic_sequence_complexity(sequence: str) -> float:
     if "N" in sequence:
         return float("nan")
 
-    number_of_subseqs = 0
-    seq_length = len(sequence)
-    max_number_of_subseqs = max_vocabularies(seq_length)
-    for i in range(1, seq_length + 1):
-        set_of_seq_n = set()
-        for n, nth_base in enumerate(sequence):
-            if n + i <= len(sequence):
-                sub_seq = sequence[n : n + i]
-                set_of_seq_n.add(sub_seq)
-        num_uniq_subseqs = len(set_of_seq_n)
-        number_of_subseqs = number_of_subseqs + num_uniq_subseqs
+    number_of_subseqs = count_distinct_substrings(sequence)
+    max_number_of_subseqs = max_vocabularies(len(sequence))
     lc = number_of_subseqs / max_number_of_subseqs
     return lc
 
@@ -160,12 +205,85 @@ def ling_seq_complexity_with_max_vocab_length(
     if "N" in sequence:
         return float("nan")
 
-    number_of_subseqs = 0
     seq_length = len(sequence)
     max_number_of_subseqs = max_sub_vocabularies(seq_length, max_substring_length)
-    set_of_seq_n: set[str] = set()
-    for i in range(1, min(max_substring_length + 1, seq_length + 1)):
-        set_of_seq_n.update(sequence[n : n + i] for n in range(len(sequence) - i + 1))
-    number_of_subseqs = len(set_of_seq_n)
+    number_of_subseqs = count_distinct_substrings(sequence, max_substring_length)
     lc = number_of_subseqs / max_number_of_subseqs
     return lc
+
+
+class SlidingLinguisticComplexity:
+    """
+    ling_seq_complexity_with_max_vocab_length of a fixed-length window that
+    moves along sorted positions, e.g., the sequence context of each candidate
+    site. When the window moves by a few bases, the tally of its substrings is
+    updated with only those that leave and enter it, instead of counting the
+    whole window again.
+    """
+
+    def __init__(self, max_substring_length: int = 20) -> None:
+        self.max_substring_length = max_substring_length
+        self.contig: str | None = None
+        self.start: int | None = None
+        self.sequence = ""
+        self.lc = nan
+        # Occurrences of every substring of the current window, only tallied
+        # once the window slides
+        self.substring_counts: Counter | None = None
+
+    def __call__(self, contig: str | None, start: int, sequence: str) -> float:
+        """
+        Args:
+            contig: contig of the window
+            start: position of the window's first base
+            sequence: sequence of the window
+
+        Returns:
+            Same as ling_seq_complexity_with_max_vocab_length(sequence,
+            max_substring_length)
+        """
+        sequence = sequence.upper()
+        window_length = len(sequence)
+        step = (
+            start - self.start
+            if contig == self.contig and self.start is not None
+            else window_length
+        )
+        if (
+            window_length <= self.max_substring_length
+            or window_length != len(self.sequence)
+            or not 0 <= step <= SLIDING_LC_MAX_STEP
+            or sequence[: window_length - step] != self.sequence[step:]
+            or "N" in sequence
+        ):
+            self.contig, self.start, self.sequence = contig, start, sequence
+            self.substring_counts = None
+            self.lc = ling_seq_complexity_with_max_vocab_length(
+                sequence, self.max_substring_length
+            )
+            return self.lc
+        if step == 0:
+            return self.lc
+
+        if self.substring_counts is None:
+            self.substring_counts = Counter(
+                self.sequence[i : i + k]
+                for k in range(1, self.max_substring_length + 1)
+                for i in range(window_length - k + 1)
+            )
+        substring_counts = self.substring_counts
+        for i in range(step):
+            for k in range(1, min(self.max_substring_length, window_length - i) + 1):
+                substring = self.sequence[i : i + k]
+                substring_counts[substring] -= 1
+                if substring_counts[substring] == 0:
+                    del substring_counts[substring]
+        for end in range(window_length - step + 1, window_length + 1):
+            for k in range(1, min(self.max_substring_length, end) + 1):
+                substring_counts[sequence[end - k : end]] += 1
+
+        self.contig, self.start, self.sequence = contig, start, sequence
+        self.lc = len(substring_counts) / max_sub_vocabularies(
+            window_length, self.max_substring_length
+        )
+        return self.lc
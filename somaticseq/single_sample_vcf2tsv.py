@@ -8,17 +8,36 @@ import math
 import os
 import re
 import sys
-from copy import copy
+import tempfile
+from collections.abc import Iterable, Iterator
+from contextlib import ExitStack, closing
 
 import pysam
 
 import somaticseq.annotate_caller as annotate_caller
 import somaticseq.genomic_file_parsers.genomic_file_handlers as genome
+import somaticseq.pileup_scanner as pileup_scanner
 import somaticseq.sequencing_features as sequencing_features
-from somaticseq.bam_features import BamFeatures
-from somaticseq.genomic_file_parsers.read_info_extractor import (
-    genomic_coordinates,
-    rescale,
+from somaticseq.bam_features import (
+    BAM_TEST_COLUMNS,
+    BamFeatures,
+    fetch_reads_for_sites,
+)
+from somaticseq.candidate_sites import CandidateSites, merge_candidate_sites
+from somaticseq.defaults import (
+    BAM_BLOCK_MAX_GAP,
+    BAM_BLOCK_MAX_SITES,
+    PILEUP_SCAN_MIN_ALT_READS,
+    READ_CACHE_MAX_READS,
+)
+from somaticseq.feature_manifest import read_feature_manifests, skipped_features
+from somaticseq.genomic_file_parsers.read_info_extractor import ReadCache, rescale
+from somaticseq.ordered_pool import OrderedWorkerPool
+from somaticseq.prefetch import prefetch as prefetch_blocks
+from somaticseq.sequence_context_track import (
+    SequenceContextTrack,
+    TrackedLinguisticComplexity,
+    check_track_reference,
 )
 
 ch = logging.StreamHandler()
@@ -29,6 +48,22 @@ logger = logging.getLogger(os.path.basename(__file__))
 logger.setLevel(logging.DEBUG)
 logger.addHandler(ch)
 
+# Caller VCFs in the order they are annotated: the function to classify a
+# variant, and the output columns it returns (the classification first).
+CALLER_ANNOTATORS = {
+    "mutect": (annotate_caller.ssMuTect, ("if_MuTect", "M2_TLOD", "M2_ECNT")),
+    "varscan": (annotate_caller.ssVarScan, ("if_VarScan2", "VarScan2_Score")),
+    "vardict": (
+        annotate_caller.ssVarDict,
+        ("if_VarDict", "MSI", "MSILEN", "SHIFT3", "PMEAN", "PSTD", "QSTD"),
+    ),
+    "lofreq": (annotate_caller.ssLoFreq, ("if_LoFreq",)),
+    "scalpel": (annotate_caller.ssScalpel, ("if_Scalpel",)),
+    "strelka": (annotate_caller.ssStrelka, ("if_Strelka",)),
+}
+# Caller scores in phred scale, to be re-scaled to p_scale
+RESCALED_CALLER_COLUMNS = {"VarScan2_Score"}
+
 # Header for the output data, created here so I won't have to indent this line:
 out_header = "{CHROM}\t\
 {POS}\t\
@@ -95,6 +130,20 @@ out_header = "{CHROM}\t\
 extra_caller_header = ""
 label_header = "{TrueVariant_or_False}"
 
+# Output columns that are only computed if they are in the feature manifest,
+# i.e., consumed by the downstream classifier. Otherwise, they are nan.
+out_columns = out_header.replace("{", "").replace("}", "").split("\t")
+HOMOPOLYMER_COLUMNS = {"MaxHomopolymer_Length", "SiteHomopolymer_Length"}
+SEQUENCE_CONTEXT_COLUMNS = (
+    "Seq_Complexity_Span",
+    "Seq_Complexity_Adj",
+    *sorted(HOMOPOLYMER_COLUMNS),
+)
+BAM_COLUMNS = ("Consistent_Mates", "Inconsistent_Mates") + tuple(
+    column for column in out_columns if column.startswith(("T_", "tBAM_"))
+)
+OPTIONAL_COLUMNS = SEQUENCE_CONTEXT_COLUMNS + BAM_COLUMNS
+
 
 def run() -> dict:
     inputParameters = {}
@@ -147,7 +196,7 @@ def run() -> dict:
         "-dbsnp",
         "--dbsnp-vcf",
         type=str,
-        help="dbSNP VCF: do not use if input VCF is annotated",
+        help="dbSNP VCF, or its known_sites_index.py index: do not use if input VCF is annotated",
         required=False,
         default=None,
     )
@@ -155,7 +204,7 @@ def run() -> dict:
         "-cosmic",
         "--cosmic-vcf",
         type=str,
-        help="COSMIC VCF: do not use if input VCF is annotated",
+        help="COSMIC VCF, or its known_sites_index.py index: do not use if input VCF is annotated",
         required=False,
         default=None,
     )
@@ -263,6 +312,64 @@ def run() -> dict:
         required=False,
         default=None,
     )
+    parser.add_argument(
+        "-scan",
+        "--pileup-scan",
+        action="store_true",
+        help="For BED, positions, or whole genome input, only evaluate the positions with enough ALT reads in the BAM pileup",
+    )
+    parser.add_argument(
+        "-minalt",
+        "--min-alt-reads",
+        type=int,
+        help="Minimum number of ALT reads for a position to be evaluated with --pileup-scan",
+        default=PILEUP_SCAN_MIN_ALT_READS,
+    )
+    parser.add_argument(
+        "-context",
+        "--sequence-context-track",
+        type=str,
+        help="Look up sequence complexity from this sequence_context_track.py track of the reference",
+    )
+    parser.add_argument(
+        "-features",
+        "--feature-manifest",
+        type=str,
+        help="Only compute the optional features (BAM and sequence context) listed in this file, one per line, or used by this xgboost classifier. The others are nan.",
+    )
+    parser.add_argument(
+        "-readcache",
+        "--read-cache-size",
+        type=int,
+        help="Maximum number of parsed reads cached per BAM file for neighbouring sites",
+        default=READ_CACHE_MAX_READS,
+    )
+    parser.add_argument(
+        "-nt",
+        "--threads",
+        type=int,
+        help="Number of processes to extract the features of blocks of nearby sites in parallel. The output is in the same order regardless.",
+        default=1,
+    )
+    parser.add_argument(
+        "-prefetch",
+        "--prefetch",
+        action="store_true",
+        help="Read the candidate sites and their annotations, and fetch the reads of the next blocks of sites (without --threads), ahead of the feature extraction in background threads",
+    )
+    parser.add_argument(
+        "-maxreads",
+        "--max-reads-per-site",
+        type=int,
+        help="Compute the BAM features of a site from this many of its reads, sampled by strand, if it has more. Its depth is still the number of all the reads.",
+    )
+    parser.add_argument(
+        "-dsseed",
+        "--downsample-seed",
+        type=int,
+        help="Seed of the sampling of reads with --max-reads-per-site",
+        default=0,
+    )
     parser.add_argument(
         "-outfile",
         "--output-tsv-file",
@@ -298,25 +405,144 @@ def vcf2tsv(
     ref_fa=None,
     p_scale=None,
     outfile=None,
+    read_cache_size=READ_CACHE_MAX_READS,
+    context_track=None,
+    pileup_scan=False,
+    min_alt_reads=PILEUP_SCAN_MIN_ALT_READS,
+    feature_manifest=None,
+    threads=1,
+    prefetch=False,
+    max_reads=None,
+    downsample_seed=0,
 ):
     if arbitrary_vcfs is None:
         arbitrary_vcfs = []
 
-    # Convert contig_sequence to chrom_seq dict:
     fai_file = ref_fa + ".fai"
-    chrom_seq = genome.faiordict2contigorder(fai_file, "fai")
+
+    # Only evaluate the positions of the regions with ALT reads in the pileup
+    candidate_vcf = None
+    if pileup_scan and not is_vcf:
+        with tempfile.NamedTemporaryFile(
+            suffix=".candidates.vcf", delete=False
+        ) as candidate_file:
+            candidate_vcf = candidate_file.name
+        is_vcf = pileup_scanner.write_candidate_vcf(
+            bam_fn,
+            ref_fa,
+            pileup_scanner.read_regions(is_bed, is_pos, fai_file),
+            candidate_vcf,
+            min_alt_reads,
+            min_mq,
+            min_bq,
+        )
+        is_bed = is_pos = None
 
     # Determine input format:
     if is_vcf:
-        mysites = is_vcf
+        mysites, sites_format = is_vcf, "vcf"
     elif is_bed:
-        mysites = is_bed
+        mysites, sites_format = is_bed, "bed"
     elif is_pos:
-        mysites = is_pos
+        mysites, sites_format = is_pos, "pos"
     else:
-        mysites = fai_file
+        mysites, sites_format = fai_file, "fai"
         logger.info("No position supplied. Will evaluate the whole genome.")
 
+    candidate_sites = CandidateSites(
+        sites_file=mysites,
+        sites_format=sites_format,
+        outfile=outfile,
+        caller_vcfs=dict(
+            mutect=mutect,
+            varscan=varscan,
+            vardict=vardict,
+            lofreq=lofreq,
+            scalpel=scalpel,
+            strelka=strelka,
+        ),
+        truth=truth,
+        arbitrary_vcfs=arbitrary_vcfs,
+    )
+    extract_features(
+        [candidate_sites],
+        bam_fn=bam_fn,
+        ref_fa=ref_fa,
+        cosmic=cosmic,
+        dbsnp=dbsnp,
+        min_mq=min_mq,
+        min_bq=min_bq,
+        min_caller=min_caller,
+        p_scale=p_scale,
+        read_cache_size=read_cache_size,
+        context_track=context_track,
+        feature_manifest=feature_manifest,
+        threads=threads,
+        prefetch=prefetch,
+        max_reads=max_reads,
+        downsample_seed=downsample_seed,
+    )
+
+    if candidate_vcf:
+        os.remove(candidate_vcf)
+
+
+def extract_features(
+    all_candidate_sites: list[CandidateSites],
+    bam_fn: str,
+    ref_fa: str,
+    cosmic: str | None = None,
+    dbsnp: str | None = None,
+    min_mq: float = 1,
+    min_bq: float = 5,
+    min_caller: float = 0,
+    p_scale: str | None = None,
+    read_cache_size: int = READ_CACHE_MAX_READS,
+    context_track: str | None = None,
+    feature_manifest: str | list[str] | None = None,
+    threads: int = 1,
+    prefetch: bool = False,
+    max_reads: int | None = None,
+    downsample_seed: int = 0,
+) -> None:
+    """
+    Write the TSV file of every set of candidate sites (e.g., SNVs and INDELs)
+    in a single pass. The sets are merged in coordinate order, so nearby sites
+    of all the sets share the BAM sweeps, the cached reads and reference, and
+    the dbSNP and COSMIC lookups.
+
+    Args:
+        all_candidate_sites: the sets of candidate sites, each with its own
+            output TSV, caller VCFs, truth VCF, and arbitrary VCFs
+        bam_fn: tumor BAM file
+        ref_fa: reference fasta file with its .fai index
+        cosmic: COSMIC VCF, or its known_sites_index.py index
+        dbsnp: dbSNP VCF, or its known_sites_index.py index
+        min_mq: minimum mapping quality
+        min_bq: minimum base quality
+        min_caller: minimum number of callers for a site to be written
+        p_scale: "phred", "fraction", or None
+        read_cache_size: maximum number of parsed reads cached for the BAM file
+        context_track: sequence_context_track.py track of the reference
+        feature_manifest: features consumed by the downstream classifier (see
+            feature_manifest.py), or a list of them, e.g., of the SNV and the
+            INDEL classifiers. The other optional features are nan.
+        threads: number of worker processes extracting the sequence context
+            and BAM features of blocks of nearby sites. The output lines are
+            written in the same order regardless.
+        prefetch: read the candidate sites and their annotations in a
+            background thread, ahead of the feature extraction. With a single
+            process, the reads of the next blocks of sites are also fetched
+            ahead in another background thread.
+        max_reads: the BAM features of a site with more reads are computed from
+            max_reads of its reads (see bam_features.DepthReservoir), except
+            for its depth
+        downsample_seed: seed of the sampling of reads with max_reads
+    """
+    # Convert contig_sequence to chrom_seq dict:
+    fai_file = ref_fa + ".fai"
+    chrom_seq = genome.faiordict2contigorder(fai_file, "fai")
+
     # Re-scale output or not:
     if p_scale is None:
         logger.info("NO RE-SCALING")
@@ -328,563 +554,655 @@ def vcf2tsv(
         p_scale = None
         logger.info("NO RE-SCALING")
 
-    # Define NaN and Inf:
-    nan = float("nan")
-    float("inf")
+    # Optional features not consumed by the downstream classifier
+    skipped_columns = skipped_features(
+        OPTIONAL_COLUMNS,
+        read_feature_manifests(feature_manifest) if feature_manifest else None,
+    )
+    if skipped_columns:
+        logger.info(
+            "Features not computed: "
+            + ", ".join(column for column in out_columns if column in skipped_columns)
+        )
+
+    if context_track:
+        check_track_reference(context_track, ref_fa)
 
     ## Running
-    with genome.open_textfile(mysites) as my_sites, open(outfile, "w") as outhandle:
-        my_line = my_sites.readline().rstrip()
-        bam = pysam.AlignmentFile(bam_fn, reference_filename=ref_fa)
-        ref_fa = pysam.FastaFile(ref_fa)
-
-        if truth:
-            truth = genome.open_textfile(truth)
-            truth_line = genome.skip_vcf_header(truth)
-        if cosmic:
-            cosmic = genome.open_textfile(cosmic)
-            cosmic_line = genome.skip_vcf_header(cosmic)
-        if dbsnp:
-            dbsnp = genome.open_textfile(dbsnp)
-            dbsnp_line = genome.skip_vcf_header(dbsnp)
-        # 6 Incorporate callers: get thru the #'s
-        if mutect:
-            mutect = genome.open_textfile(mutect)
-            mutect_line = genome.skip_vcf_header(mutect)
-        if varscan:
-            varscan = genome.open_textfile(varscan)
-            varscan_line = genome.skip_vcf_header(varscan)
-        if vardict:
-            vardict = genome.open_textfile(vardict)
-            vardict_line = genome.skip_vcf_header(vardict)
-        if lofreq:
-            lofreq = genome.open_textfile(lofreq)
-            lofreq_line = genome.skip_vcf_header(lofreq)
-        if scalpel:
-            scalpel = genome.open_textfile(scalpel)
-            scalpel_line = genome.skip_vcf_header(scalpel)
-        if strelka:
-            strelka = genome.open_textfile(strelka)
-            strelka_line = genome.skip_vcf_header(strelka)
-
-        arbitrary_file_handle = {}
-        arbitrary_line = {}
-        for ith_arbi, arbitrary_vcf_i in enumerate(arbitrary_vcfs):
-            arbitrary_file_handle[ith_arbi] = genome.open_textfile(arbitrary_vcf_i)
-            arbitrary_line[ith_arbi] = genome.skip_vcf_header(
-                arbitrary_file_handle[ith_arbi]
+    with ExitStack() as output_files:
+        outhandles = [
+            output_files.enter_context(open(candidate_sites.outfile, "w"))
+            for candidate_sites in all_candidate_sites
+        ]
+        for candidate_sites, outhandle in zip(all_candidate_sites, outhandles):
+            # First line:
+            header_part_1 = out_header.replace("{", "").replace("}", "")
+
+            for arbi_caller_num in range(len(candidate_sites.arbitrary_vcfs)):
+                header_part_1 = header_part_1 + "\t" + f"if_Caller_{arbi_caller_num}"
+            header_last_part = label_header.replace("{", "").replace("}", "")
+            outhandle.write("\t".join((header_part_1, header_last_part)) + "\n")
+
+        # Blocks of nearby sites with all their non-BAM output columns
+        blocks = output_files.enter_context(
+            closing(
+                candidate_site_blocks(
+                    all_candidate_sites, chrom_seq, cosmic, dbsnp, min_caller, p_scale
+                )
             )
+        )
+        if prefetch:
+            # Reader stage: candidate sites and their annotations are read
+            # ahead of the feature extraction in a background thread
+            blocks = output_files.enter_context(closing(prefetch_blocks(blocks)))
 
-        # Get through all the headers:
-        while my_line.startswith("#") or my_line.startswith("track="):
-            my_line = my_sites.readline().rstrip()
+        extractor_args = (
+            bam_fn,
+            ref_fa,
+            min_mq,
+            min_bq,
+            p_scale,
+            read_cache_size,
+            context_track,
+            skipped_columns,
+            max_reads,
+            downsample_seed,
+        )
+        downsampled_sites = 0
+        if threads > 1:
+            # Blocks are processed by the worker processes, each with its own
+            # BAM and reference file handles
+            with OrderedWorkerPool(
+                BlockFeatureExtractor, extractor_args, threads
+            ) as block_pool:
+                for pending_sites in blocks:
+                    for block_output in block_pool.submit(pending_sites):
+                        downsampled_sites += write_lines(block_output, outhandles)
+                for block_output in block_pool.results():
+                    downsampled_sites += write_lines(block_output, outhandles)
+        else:
+            with BlockFeatureExtractor(*extractor_args) as extractor:
+                for block_output in extractor.extract_blocks(blocks, prefetch):
+                    downsampled_sites += write_lines(block_output, outhandles)
 
-        # First coordinate, for later purpose of making sure the input is sorted properly
-        coordinate_i = re.match(genome.PATTERN_CHR_POSITION, my_line)
-        coordinate_i = coordinate_i.group() if coordinate_i else ""
+    if downsampled_sites:
+        logger.warning(
+            f"{downsampled_sites} sites had more than {max_reads} reads. Their "
+            f"BAM features were computed from {max_reads} reads sampled from them."
+        )
 
-        # First line:
-        header_part_1 = out_header.replace("{", "").replace("}", "")
 
-        additional_arbi_caller_numbers = sorted(arbitrary_file_handle.keys())
-        for arbi_caller_num in additional_arbi_caller_numbers:
-            header_part_1 = header_part_1 + "\t" + f"if_Caller_{arbi_caller_num}"
-        header_last_part = label_header.replace("{", "").replace("}", "")
-        outhandle.write("\t".join((header_part_1, header_last_part)) + "\n")
-        while my_line:
-            # If VCF, get all the variants with the same coordinate into a list:
-            if is_vcf:
-                my_vcf = genome.VCFVariantRecord.from_vcf_line(my_line)
-                my_coordinates = [(my_vcf.chromosome, my_vcf.position)]
-                variants_at_my_coordinate = []
-                alt_bases = my_vcf.altbase.split(",")
-                for alt_i in alt_bases:
-                    vcf_i = copy(my_vcf)
-                    vcf_i.altbase = alt_i
-                    variants_at_my_coordinate.append(vcf_i)
-
-                # As long as the "coordinate" stays the same, it will keep reading until it's different.
-                while my_coordinates[0] == (my_vcf.chromosome, my_vcf.position):
-                    my_line = my_sites.readline().rstrip()
-                    my_vcf = genome.VCFVariantRecord.from_vcf_line(my_line)
-
-                    ########## This block is code is to ensure the input VCF file is properly sorted ##
-                    coordinate_j = re.match(genome.PATTERN_CHR_POSITION, my_line)
-                    coordinate_j = coordinate_j.group() if coordinate_j else ""
-                    if genome.whoisbehind(coordinate_i, coordinate_j, chrom_seq) == 1:
-                        raise Exception(
-                            f"{mysites} does not seem to be properly sorted."
-                        )
+def candidate_site_blocks(
+    all_candidate_sites: list[CandidateSites],
+    chrom_seq: dict[str, int],
+    cosmic: str | None = None,
+    dbsnp: str | None = None,
+    min_caller: float = 0,
+    p_scale: str | None = None,
+) -> Iterator[list[dict]]:
+    """
+    The candidate sites of all the sets in coordinate order, annotated with
+    the caller, truth, arbitrary, dbSNP, and COSMIC VCF files, in blocks of
+    nearby sites on the same contig. Only the sites passing min_caller are
+    included, with all their output columns except the sequence context and
+    BAM features (see extract_features for the arguments).
 
-                    coordinate_i = coordinate_j
-                    ###################################################################################
-                    if my_coordinates[0] == (my_vcf.chromosome, my_vcf.position):
-                        alt_bases = my_vcf.altbase.split(",")
-                        for alt_i in alt_bases:
-                            vcf_i = copy(my_vcf)
-                            vcf_i.altbase = alt_i
-                            variants_at_my_coordinate.append(vcf_i)
-            elif is_bed:
-                bed_item = my_line.split("\t")
-                my_coordinates = genomic_coordinates(
-                    bed_item[0], int(bed_item[1]) + 1, int(bed_item[2])
-                )
-            elif is_pos:
-                pos_item = my_line.split("\t")
-                my_coordinates = genomic_coordinates(
-                    pos_item[0], int(pos_item[1]), int(pos_item[1])
-                )
-            elif fai_file:
-                fai_item = my_line.split("\t")
-                my_coordinates = genomic_coordinates(fai_item[0], 1, int(fai_item[1]))
+    Yields:
+        list of sites, each a dict with the site's coordinate, ref_base,
+        first_alt, output columns, trailing_columns, and the index of its set
+    """
+    # Define NaN and Inf:
+    nan = float("nan")
 
-            ##### ##### ##### ##### ##### #####
-            for my_coordinate in my_coordinates:
-                ######## If VCF, can get ref base, variant base, as well as other identifying information ########
-                if is_vcf:
-                    ref_bases = []
-                    alt_bases = []
-                    indel_lengths = []
-                    all_my_identifiers = []
-                    for variant_i in variants_at_my_coordinate:
-                        ref_base = variant_i.refbase
-                        first_alt = variant_i.altbase.split(",")[0]
-                        indel_length = len(first_alt) - len(ref_base)
-                        ref_bases.append(ref_base)
-                        alt_bases.append(first_alt)
-                        indel_lengths.append(indel_length)
-
-                        # Extract these information if they exist in the VCF file, but they could be re-written if dbSNP/COSMIC are supplied.
-                        if_dbsnp = (
-                            1 if re.search(r"rs[0-9]+", variant_i.identifier) else 0
-                        )
-                        if_cosmic = (
-                            1
-                            if re.search(r"COS[MN][0-9]+", variant_i.identifier)
-                            else 0
-                        )
-                        if_common = (
-                            1 if variant_i.get_info_value("COMMON") == "1" else 0
-                        )
-                        num_cases = (
-                            variant_i.get_info_value("CNT")
-                            if variant_i.get_info_value("CNT")
-                            else nan
-                        )
-                        if variant_i.identifier == ".":
-                            my_identifier_i = set()
-                        else:
-                            my_identifier_i = variant_i.identifier.split(";")
-                            my_identifier_i = set(my_identifier_i)
+    # dbSNP and COSMIC are looked up once per coordinate for all the sets
+    known_sites = genome.VcfStreamMerger(chrom_seq)
+    for annotation_name, annotation_vcf in (
+        ("dbsnp", dbsnp),
+        ("cosmic", cosmic),
+    ):
+        if annotation_vcf:
+            known_sites.register(annotation_name, annotation_vcf)
+    known_coordinate, known_records = None, {}
 
-                        all_my_identifiers.append(my_identifier_i)
+    # Caller, truth, and arbitrary VCF files of each set are all read
+    # forward together, merged on their coordinates.
+    all_annotation_streams = []
+    for candidate_sites in all_candidate_sites:
+        annotation_streams = genome.VcfStreamMerger(chrom_seq)
+        for caller_name, caller_vcf in candidate_sites.caller_vcfs.items():
+            if caller_vcf:
+                annotation_streams.register(caller_name, caller_vcf)
+        if candidate_sites.truth:
+            annotation_streams.register("truth", candidate_sites.truth)
+        for ith_arbi, arbitrary_vcf_i in enumerate(candidate_sites.arbitrary_vcfs):
+            annotation_streams.register(("arbitrary", ith_arbi), arbitrary_vcf_i)
+        all_annotation_streams.append(annotation_streams)
 
-                ## If not, 1) get ref_base, first_alt from other VCF files.
-                #          2) Create placeholders for dbSNP and COSMIC that can be overwritten with dbSNP/COSMIC VCF files (if provided)
-                else:
-                    variants_at_my_coordinate = [
-                        None
-                    ]  # Just to have something to iterate
-                    ref_base = first_alt = indel_length = None
-
-                    # Could be re-written if dbSNP/COSMIC are supplied. If not, they will remain NaN.
-                    if_dbsnp = if_cosmic = if_common = num_cases = nan
-
-                #################################### Find the same coordinate in those VCF files ####################################
-                if mutect:
-                    (
-                        got_mutect,
-                        mutect_variants,
-                        mutect_line,
-                    ) = genome.find_vcf_at_coordinate(
-                        my_coordinate, mutect_line, mutect, chrom_seq
-                    )
-                if varscan:
-                    (
-                        got_varscan,
-                        varscan_variants,
-                        varscan_line,
-                    ) = genome.find_vcf_at_coordinate(
-                        my_coordinate, varscan_line, varscan, chrom_seq
-                    )
-                if vardict:
-                    (
-                        got_vardict,
-                        vardict_variants,
-                        vardict_line,
-                    ) = genome.find_vcf_at_coordinate(
-                        my_coordinate, vardict_line, vardict, chrom_seq
-                    )
-                if lofreq:
-                    (
-                        got_lofreq,
-                        lofreq_variants,
-                        lofreq_line,
-                    ) = genome.find_vcf_at_coordinate(
-                        my_coordinate, lofreq_line, lofreq, chrom_seq
-                    )
-                if scalpel:
-                    (
-                        got_scalpel,
-                        scalpel_variants,
-                        scalpel_line,
-                    ) = genome.find_vcf_at_coordinate(
-                        my_coordinate, scalpel_line, scalpel, chrom_seq
+    try:
+        # Sites passing min_caller, waiting for their BAM features
+        pending_sites: list[dict] = []
+        for ith_set, my_coordinate, variants_at_my_coordinate in merge_candidate_sites(
+            all_candidate_sites, chrom_seq
+        ):
+            candidate_sites = all_candidate_sites[ith_set]
+            annotation_streams = all_annotation_streams[ith_set]
+            is_vcf = candidate_sites.sites_format == "vcf"
+            truth = candidate_sites.truth
+            additional_arbi_caller_numbers = range(len(candidate_sites.arbitrary_vcfs))
+
+            # The block is complete if this site is too far away from it
+            if pending_sites and (
+                my_coordinate[0] != pending_sites[-1]["coordinate"][0]
+                or my_coordinate[1] - pending_sites[-1]["coordinate"][1]
+                > BAM_BLOCK_MAX_GAP
+                or len(pending_sites) >= BAM_BLOCK_MAX_SITES
+            ):
+                yield pending_sites
+                pending_sites = []
+
+            ######## If VCF, can get ref base, variant base, as well as other identifying information ########
+            if is_vcf:
+                ref_bases = []
+                alt_bases = []
+                indel_lengths = []
+                all_my_identifiers = []
+                for variant_i in variants_at_my_coordinate:
+                    ref_base = variant_i.refbase
+                    first_alt = variant_i.altbase.split(",")[0]
+                    indel_length = len(first_alt) - len(ref_base)
+                    ref_bases.append(ref_base)
+                    alt_bases.append(first_alt)
+                    indel_lengths.append(indel_length)
+
+                    # Extract these information if they exist in the VCF file, but they could be re-written if dbSNP/COSMIC are supplied.
+                    if_dbsnp = 1 if re.search(r"rs[0-9]+", variant_i.identifier) else 0
+                    if_cosmic = (
+                        1 if re.search(r"COS[MN][0-9]+", variant_i.identifier) else 0
                     )
-                if strelka:
-                    (
-                        got_strelka,
-                        strelka_variants,
-                        strelka_line,
-                    ) = genome.find_vcf_at_coordinate(
-                        my_coordinate, strelka_line, strelka, chrom_seq
+                    if_common = 1 if variant_i.get_info_value("COMMON") == "1" else 0
+                    num_cases = (
+                        variant_i.get_info_value("CNT")
+                        if variant_i.get_info_value("CNT")
+                        else nan
                     )
-                if truth:
-                    (
-                        got_truth,
-                        truth_variants,
-                        truth_line,
-                    ) = genome.find_vcf_at_coordinate(
-                        my_coordinate, truth_line, truth, chrom_seq
+                    if variant_i.identifier == ".":
+                        my_identifier_i = set()
+                    else:
+                        my_identifier_i = variant_i.identifier.split(";")
+                        my_identifier_i = set(my_identifier_i)
+
+                    all_my_identifiers.append(my_identifier_i)
+
+            ## If not, 1) get ref_base, first_alt from other VCF files.
+            #          2) Create placeholders for dbSNP and COSMIC that can be overwritten with dbSNP/COSMIC VCF files (if provided)
+            else:
+                variants_at_my_coordinate = [None]  # Just to have something to iterate
+                ref_base = first_alt = indel_length = None
+
+                # Could be re-written if dbSNP/COSMIC are supplied. If not, they will remain NaN.
+                if_dbsnp = if_cosmic = if_common = num_cases = nan
+
+            #################################### Find the same coordinate in those VCF files ####################################
+            site_records = annotation_streams.variants_at(my_coordinate)
+            if my_coordinate != known_coordinate:
+                known_records = known_sites.variants_at(my_coordinate)
+                known_coordinate = my_coordinate
+            truth_variants = site_records.get("truth", {})
+            dbsnp_variants = known_records.get("dbsnp", {})
+            cosmic_variants = known_records.get("cosmic", {})
+
+            # Now, use pysam to look into the tBAM file(s), variant by variant from the input:
+            for ith_call, my_call in enumerate(variants_at_my_coordinate):
+                if is_vcf:
+                    # The particular line in the input VCF file:
+                    variant_id = (
+                        (my_call.chromosome, my_call.position),
+                        my_call.refbase,
+                        my_call.altbase,
                     )
-                if dbsnp:
-                    (
-                        got_dbsnp,
-                        dbsnp_variants,
-                        dbsnp_line,
-                    ) = genome.find_vcf_at_coordinate(
-                        my_coordinate, dbsnp_line, dbsnp, chrom_seq
+                    ref_base = ref_bases[ith_call]
+                    first_alt = alt_bases[ith_call]
+                    indel_length = indel_lengths[ith_call]
+                    my_identifiers = all_my_identifiers[ith_call]
+                else:
+                    variant_id = (
+                        (my_coordinate[0], my_coordinate[1]),
+                        ref_base,
+                        first_alt,
                     )
-                if cosmic:
-                    (
-                        got_cosmic,
-                        cosmic_variants,
-                        cosmic_line,
-                    ) = genome.find_vcf_at_coordinate(
-                        my_coordinate, cosmic_line, cosmic, chrom_seq
+                # Reset num_caller to 0 for each variant in the same coordinate
+                num_callers = 0
+
+                #################### Collect Caller Vcf ####################:
+                caller_columns = {}
+                for caller_name, annotator in CALLER_ANNOTATORS.items():
+                    annotate, column_names = annotator
+                    if caller_name in annotation_streams:
+                        caller_values = annotate(
+                            variant_id, site_records.get(caller_name, {})
+                        )
+                        if not isinstance(caller_values, tuple):
+                            caller_values = (caller_values,)
+                        num_callers += caller_values[0]
+                    else:
+                        caller_values = (nan,) * len(column_names)
+                    caller_columns.update(zip(column_names, caller_values))
+                for column_name in RESCALED_CALLER_COLUMNS:
+                    caller_columns[column_name] = rescale(
+                        caller_columns[column_name], "phred", p_scale, 1001
                     )
 
-                got_arbitraries = {}
-                arbitrary_variants = {}
-                for ith_arbi in arbitrary_file_handle:
-                    (
-                        got_arbitraries[ith_arbi],
-                        arbitrary_variants[ith_arbi],
-                        arbitrary_line[ith_arbi],
-                    ) = genome.find_vcf_at_coordinate(
-                        my_coordinate,
-                        arbitrary_line[ith_arbi],
-                        arbitrary_file_handle[ith_arbi],
-                        chrom_seq,
+                arbitrary_classifications = {}
+                for ith_arbi_var in additional_arbi_caller_numbers:
+                    arbi_classification_i = annotate_caller.anyInputVcf(
+                        variant_id,
+                        site_records.get(("arbitrary", ith_arbi_var), {}),
                     )
+                    arbitrary_classifications[ith_arbi_var] = arbi_classification_i
+                    num_callers += arbi_classification_i
 
-                # Now, use pysam to look into the tBAM file(s), variant by variant from the input:
-                for ith_call, my_call in enumerate(variants_at_my_coordinate):
-                    if is_vcf:
-                        # The particular line in the input VCF file:
-                        variant_id = (
-                            (my_call.chromosome, my_call.position),
-                            my_call.refbase,
-                            my_call.altbase,
-                        )
-                        ref_base = ref_bases[ith_call]
-                        first_alt = alt_bases[ith_call]
-                        indel_length = indel_lengths[ith_call]
-                        my_identifiers = all_my_identifiers[ith_call]
+                # Potentially write the output only if it meets this threshold:
+                if num_callers >= min_caller:
+                    ########## Ground truth file ##########
+                    if truth:
+                        if variant_id in truth_variants.keys():
+                            judgement = 1
+                            my_identifiers.add("TruePositive")
+                        else:
+                            judgement = 0
+                            my_identifiers.add("FalsePositive")
                     else:
-                        variant_id = (
-                            (my_coordinate[0], my_coordinate[1]),
-                            ref_base,
-                            first_alt,
-                        )
-                    # Reset num_caller to 0 for each variant in the same coordinate
-                    num_callers = 0
+                        judgement = nan
 
-                    #################### Collect Caller Vcf ####################:
-                    if mutect:
-                        mutect_classification, tlod, ecnt = annotate_caller.ssMuTect(
-                            variant_id, mutect_variants
+                    ########## dbSNP ########## Will overwrite dbSNP info from input VCF file
+                    if dbsnp:
+                        if_dbsnp, if_common, rsID = annotate_caller.dbSNP(
+                            variant_id, dbsnp_variants
                         )
-                        num_callers += mutect_classification
-                    else:
-                        mutect_classification = tlod = ecnt = nan
-
-                    if varscan:
-                        (
-                            varscan_classification,
-                            score_varscan2,
-                        ) = annotate_caller.ssVarScan(variant_id, varscan_variants)
-                        num_callers += varscan_classification
-                    else:
-                        varscan_classification = score_varscan2 = nan
-
-                    if vardict:
-                        (
-                            vardict_classification,
-                            msi,
-                            msilen,
-                            shift3,
-                            t_pmean,
-                            t_pstd,
-                            t_qstd,
-                        ) = annotate_caller.ssVarDict(variant_id, vardict_variants)
-                        num_callers += vardict_classification
-                    else:
-                        vardict_classification = msi = msilen = shift3 = nan
+                        for ID_i in rsID:
+                            my_identifiers.add(ID_i)
 
-                    if lofreq:
-                        lofreq_classification = annotate_caller.ssLoFreq(
-                            variant_id, lofreq_variants
+                    ########## COSMIC ########## Will overwrite COSMIC info from input VCF file
+                    if cosmic:
+                        if_cosmic, num_cases, cosmicID = annotate_caller.COSMIC(
+                            variant_id, cosmic_variants
                         )
-                        num_callers += lofreq_classification
-                    else:
-                        lofreq_classification = nan
+                        for ID_i in cosmicID:
+                            my_identifiers.add(ID_i)
 
-                    if scalpel:
-                        scalpel_classification = annotate_caller.ssScalpel(
-                            variant_id, scalpel_variants
+                    # Fill the ID field of the TSV/VCF
+                    my_identifiers = ";".join(my_identifiers) if my_identifiers else "."
+                    additional_caller_columns = []
+                    for arbi_key_i in additional_arbi_caller_numbers:
+                        additional_caller_columns.append(
+                            str(arbitrary_classifications[arbi_key_i])
                         )
-                        num_callers += scalpel_classification
-                    else:
-                        scalpel_classification = nan
+                    additional_caller_columns = "\t".join(additional_caller_columns)
 
-                    if strelka:
-                        strelka_classification = annotate_caller.ssStrelka(
-                            variant_id, strelka_variants
+                    label_column = label_header.format(TrueVariant_or_False=judgement)
+
+                    if len(additional_arbi_caller_numbers) > 0:
+                        trailing_columns = "\t".join(
+                            (additional_caller_columns, label_column)
                         )
-                        num_callers += strelka_classification
                     else:
-                        strelka_classification = nan
+                        trailing_columns = label_column
 
-                    arbitrary_classifications = {}
-                    for ith_arbi_var in arbitrary_file_handle:
-                        arbi_classification_i = annotate_caller.anyInputVcf(
-                            variant_id, arbitrary_variants[ith_arbi_var]
-                        )
-                        arbitrary_classifications[ith_arbi_var] = arbi_classification_i
-                        num_callers += arbi_classification_i
-
-                    # Potentially write the output only if it meets this threshold:
-                    if num_callers >= min_caller:
-                        ########## Ground truth file ##########
-                        if truth:
-                            if variant_id in truth_variants.keys():
-                                judgement = 1
-                                my_identifiers.add("TruePositive")
-                            else:
-                                judgement = 0
-                                my_identifiers.add("FalsePositive")
-                        else:
-                            judgement = nan
-
-                        ########## dbSNP ########## Will overwrite dbSNP info from input VCF file
-                        if dbsnp:
-                            if_dbsnp, if_common, rsID = annotate_caller.dbSNP(
-                                variant_id, dbsnp_variants
-                            )
-                            for ID_i in rsID:
-                                my_identifiers.add(ID_i)
-
-                        ########## COSMIC ########## Will overwrite COSMIC info from input VCF file
-                        if cosmic:
-                            if_cosmic, num_cases, cosmicID = annotate_caller.COSMIC(
-                                variant_id, cosmic_variants
-                            )
-                            for ID_i in cosmicID:
-                                my_identifiers.add(ID_i)
-
-                        ########## ######### INFO EXTRACTION FROM BAM FILES ########## #########
-                        # Tumor tBAM file:
-                        tbam_feature = BamFeatures.from_alignment_file(
-                            bam_fh=bam,
-                            my_coordinate=my_coordinate,
-                            ref_base=ref_base,
-                            first_alt=first_alt,
-                            min_mq=min_mq,
-                            min_bq=min_bq,
-                        )
-                        # Homopolymer eval:
-                        (
-                            homopolymer_length,
-                            site_homopolymer_length,
-                        ) = sequencing_features.get_homopolymer_lengths(
-                            ref_fa, my_coordinate, ref_base, first_alt
-                        )
+                    # Sequence context and BAM features are extracted for a
+                    # block of nearby sites at a time by BlockFeatureExtractor
+                    pending_sites.append(
+                        {
+                            "coordinate": my_coordinate,
+                            "ref_base": ref_base,
+                            "first_alt": first_alt,
+                            "columns": {
+                                "CHROM": my_coordinate[0],
+                                "POS": my_coordinate[1],
+                                "ID": my_identifiers,
+                                "REF": ref_base,
+                                "ALT": first_alt,
+                                **caller_columns,
+                                "if_dbsnp": if_dbsnp,
+                                "COMMON": if_common,
+                                "if_COSMIC": if_cosmic,
+                                "COSMIC_CNT": num_cases,
+                                "InDel_Length": indel_length,
+                            },
+                            "trailing_columns": trailing_columns,
+                            "ith_set": ith_set,
+                        }
+                    )
 
-                        # Linguistic sequence complexity in a +/-80bp window, but substring calculation stops at 20-bp substring.
-                        seq_span_80bp = ref_fa.fetch(
-                            my_coordinate[0],
-                            max(0, my_coordinate[1] - 41),
-                            my_coordinate[1] + 40,
-                        )
-                        seq_left_80bp = ref_fa.fetch(
-                            my_coordinate[0],
-                            max(0, my_coordinate[1] - 81),
-                            my_coordinate[1],
-                        )
-                        seq_right_80bp = ref_fa.fetch(
-                            my_coordinate[0], my_coordinate[1], my_coordinate[1] + 81
-                        )
+        if pending_sites:
+            yield pending_sites
 
-                        if len(seq_span_80bp) > 20:
-                            LC_spanning = sequencing_features.ling_seq_complexity_with_max_vocab_length(
-                                seq_span_80bp, 20
-                            )
-                        else:
-                            LC_spanning = math.nan
+    finally:
+        ##########  Close all open files if they were opened  ##########
+        known_sites.close()
+        for annotation_streams in all_annotation_streams:
+            annotation_streams.close()
 
-                        if len(seq_left_80bp) > 20:
-                            left_LC = sequencing_features.ling_seq_complexity_with_max_vocab_length(
-                                seq_left_80bp, 20
-                            )
-                        else:
-                            left_LC = math.nan
 
-                        if len(seq_right_80bp) > 20:
-                            right_LC = sequencing_features.ling_seq_complexity_with_max_vocab_length(
-                                seq_right_80bp, 20
-                            )
-                        else:
-                            right_LC = math.nan
+class BlockFeatureExtractor:
+    """
+    The sequence context and BAM features of blocks of nearby candidate
+    sites, with its own BAM and reference file handles, read cache, and
+    sequence complexity trackers, so every worker process of extract_features
+    can have one.
+    """
 
-                        LC_adjacent = min(left_LC, right_LC)
-                        LC_spanning_phred = genome.p2phred(1 - LC_spanning, 40)
-                        LC_adjacent_phred = genome.p2phred(1 - LC_adjacent, 40)
+    def __init__(
+        self,
+        bam_fn: str,
+        ref_fa: str,
+        min_mq: float = 1,
+        min_bq: float = 5,
+        p_scale: str | None = None,
+        read_cache_size: int = READ_CACHE_MAX_READS,
+        context_track: str | None = None,
+        skipped_columns: set[str] = set(),
+        max_reads: int | None = None,
+        downsample_seed: int = 0,
+    ) -> None:
+        self.bam = pysam.AlignmentFile(bam_fn, reference_filename=ref_fa)
+        self.bam_cache = ReadCache(max_reads=read_cache_size)
+        self.ref_fa = genome.BlockCachedFasta(ref_fa)
+        self.min_mq = min_mq
+        self.min_bq = min_bq
+        self.p_scale = p_scale
+        self.skipped_columns = skipped_columns
+        self.max_reads = max_reads
+        self.downsample_seed = downsample_seed
 
-                        # Fill the ID field of the TSV/VCF
-                        my_identifiers = (
-                            ";".join(my_identifiers) if my_identifiers else "."
-                        )
-                        ###
-                        out_line_part_1 = out_header.format(
-                            CHROM=my_coordinate[0],
-                            POS=my_coordinate[1],
-                            ID=my_identifiers,
-                            REF=ref_base,
-                            ALT=first_alt,
-                            if_MuTect=mutect_classification,
-                            if_Strelka=strelka_classification,
-                            if_VarScan2=varscan_classification,
-                            if_VarDict=vardict_classification,
-                            if_LoFreq=lofreq_classification,
-                            if_Scalpel=scalpel_classification,
-                            VarScan2_Score=rescale(
-                                score_varscan2, "phred", p_scale, 1001
-                            ),
-                            if_dbsnp=if_dbsnp,
-                            COMMON=if_common,
-                            if_COSMIC=if_cosmic,
-                            COSMIC_CNT=num_cases,
-                            Consistent_Mates=tbam_feature.consistent_mates,
-                            Inconsistent_Mates=tbam_feature.inconsistent_mates,
-                            Seq_Complexity_Span=LC_spanning_phred,
-                            Seq_Complexity_Adj=LC_adjacent_phred,
-                            M2_TLOD=tlod,
-                            M2_ECNT=ecnt,
-                            MSI=msi,
-                            MSILEN=msilen,
-                            SHIFT3=shift3,
-                            MaxHomopolymer_Length=homopolymer_length,
-                            SiteHomopolymer_Length=site_homopolymer_length,
-                            T_DP=tbam_feature.dp,
-                            tBAM_REF_MQ="%g" % tbam_feature.ref_mq,
-                            tBAM_ALT_MQ="%g" % tbam_feature.alt_mq,
-                            tBAM_p_MannWhitneyU_MQ="%g"
-                            % tbam_feature.p_mannwhitneyu_mq,
-                            tBAM_REF_BQ="%g" % tbam_feature.ref_bq,
-                            tBAM_ALT_BQ="%g" % tbam_feature.alt_bq,
-                            tBAM_p_MannWhitneyU_BQ="%g"
-                            % tbam_feature.p_mannwhitneyu_bq,
-                            tBAM_REF_NM="%g" % tbam_feature.ref_edit_distance,
-                            tBAM_ALT_NM="%g" % tbam_feature.alt_edit_distance,
-                            tBAM_NM_Diff="%g" % tbam_feature.edit_distance_difference,
-                            tBAM_REF_Concordant=tbam_feature.ref_concordant_reads,
-                            tBAM_REF_Discordant=tbam_feature.ref_discordant_reads,
-                            tBAM_ALT_Concordant=tbam_feature.alt_concordant_reads,
-                            tBAM_ALT_Discordant=tbam_feature.alt_discordant_reads,
-                            tBAM_Concordance_FET=rescale(
-                                tbam_feature.concordance_fet,
-                                "fraction",
-                                p_scale,
-                                1001,
-                            ),
-                            T_REF_FOR=tbam_feature.ref_call_forward,
-                            T_REF_REV=tbam_feature.ref_call_reverse,
-                            T_ALT_FOR=tbam_feature.alt_call_forward,
-                            T_ALT_REV=tbam_feature.alt_call_reverse,
-                            tBAM_StrandBias_FET=rescale(
-                                tbam_feature.strandbias_fet,
-                                "fraction",
-                                p_scale,
-                                1001,
-                            ),
-                            tBAM_p_MannWhitneyU_EndPos="%g"
-                            % tbam_feature.p_mannwhitneyu_endpos,
-                            tBAM_REF_Clipped_Reads=tbam_feature.ref_soft_clipped_reads,
-                            tBAM_ALT_Clipped_Reads=tbam_feature.alt_soft_clipped_reads,
-                            tBAM_Clipping_FET=rescale(
-                                tbam_feature.clipping_fet, "fraction", p_scale, 1001
-                            ),
-                            tBAM_MQ0=tbam_feature.mq0_reads,
-                            tBAM_Other_Reads=tbam_feature.noise_read_count,
-                            tBAM_Poor_Reads=tbam_feature.poor_read_count,
-                            tBAM_REF_InDel_3bp=tbam_feature.ref_indel_3bp,
-                            tBAM_REF_InDel_2bp=tbam_feature.ref_indel_2bp,
-                            tBAM_REF_InDel_1bp=tbam_feature.ref_indel_1bp,
-                            tBAM_ALT_InDel_3bp=tbam_feature.alt_indel_3bp,
-                            tBAM_ALT_InDel_2bp=tbam_feature.alt_indel_2bp,
-                            tBAM_ALT_InDel_1bp=tbam_feature.alt_indel_1bp,
-                            InDel_Length=indel_length,
-                        )
+        # Sequence complexity of the windows around consecutive sites
+        if context_track:
+            context_track = SequenceContextTrack(context_track)
+            self.span_lc = TrackedLinguisticComplexity(context_track)
+            self.left_lc = TrackedLinguisticComplexity(context_track)
+            self.right_lc = TrackedLinguisticComplexity(context_track)
+        else:
+            self.span_lc = sequencing_features.SlidingLinguisticComplexity(20)
+            self.left_lc = sequencing_features.SlidingLinguisticComplexity(20)
+            self.right_lc = sequencing_features.SlidingLinguisticComplexity(20)
 
-                        additional_caller_columns = []
-                        for arbi_key_i in additional_arbi_caller_numbers:
-                            additional_caller_columns.append(
-                                str(arbitrary_classifications[arbi_key_i])
-                            )
-                        additional_caller_columns = "\t".join(additional_caller_columns)
+    def __enter__(self) -> "BlockFeatureExtractor":
+        return self
 
-                        label_column = label_header.format(
-                            TrueVariant_or_False=judgement
-                        )
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
-                        if len(additional_arbi_caller_numbers) > 0:
-                            out_line = "\t".join(
-                                (
-                                    out_line_part_1,
-                                    additional_caller_columns,
-                                    label_column,
-                                )
-                            )
-                        else:
-                            out_line = "\t".join((out_line_part_1, label_column))
+    def __call__(
+        self,
+        pending_sites: list[dict],
+        block_reads: list[pysam.AlignedSegment] | None = None,
+    ) -> tuple[list[tuple[int, str]], int]:
+        """
+        Args:
+            pending_sites: a block of sites from candidate_site_blocks
+            block_reads: reads of the block from fetch_reads, if already
+                fetched. Otherwise, they are fetched here.
 
-                        # Print it out to stdout:
-                        outhandle.write(out_line + "\n")
+        Returns:
+            the output lines of the sites, and the number of downsampled sites
+            (see block_out_lines)
+        """
+        for site in pending_sites:
+            site["columns"].update(self.sequence_context_columns(site))
+        return block_out_lines(
+            pending_sites,
+            self.bam,
+            self.min_mq,
+            self.min_bq,
+            self.p_scale,
+            self.bam_cache,
+            self.skipped_columns,
+            block_reads,
+            self.max_reads,
+            self.downsample_seed,
+        )
 
-            # Read into the next line:
-            if not is_vcf:
-                my_line = my_sites.readline().rstrip()
+    def fetch_reads(
+        self, pending_sites: list[dict]
+    ) -> list[pysam.AlignedSegment] | None:
+        """
+        Reads of a block of sites in the BAM file, or None if the BAM file is
+        not read at all (see block_out_lines).
+        """
+        if self.skipped_columns.issuperset(BAM_COLUMNS):
+            return None
+        contig, sites = block_sites(pending_sites)
+        return fetch_reads_for_sites(self.bam, contig, sites)
 
-        ##########  Close all open files if they were opened  ##########
-        opened_files = [
-            ref_fa,
-            bam,
-            truth,
-            cosmic,
-            dbsnp,
-            mutect,
-            varscan,
-            vardict,
-            lofreq,
-            scalpel,
-            strelka,
-        ]
-        [
-            opened_files.append(extra_opened_file)
-            for extra_opened_file in arbitrary_file_handle.values()
-        ]
-        [opened_file.close() for opened_file in opened_files if opened_file]
+    def extract_blocks(
+        self, blocks: Iterable[list[dict]], prefetch: bool = False
+    ) -> Iterator[tuple[list[tuple[int, str]], int]]:
+        """
+        Output of every block of sites (see __call__). With prefetch, the reads of the
+        next blocks are fetched in a background thread while the features of
+        the current block are computed.
+        """
+        if not prefetch:
+            for pending_sites in blocks:
+                yield self(pending_sites)
+            return
+
+        # BAM-fetch stage
+        fetched_blocks = prefetch_blocks(
+            (pending_sites, self.fetch_reads(pending_sites)) for pending_sites in blocks
+        )
+        with closing(fetched_blocks):
+            for pending_sites, block_reads in fetched_blocks:
+                yield self(pending_sites, block_reads)
+
+    def sequence_context_columns(self, site: dict) -> dict:
+        """
+        Homopolymer lengths and linguistic sequence complexity of a site.
+        Features not in the feature manifest are not computed.
+        """
+        nan = float("nan")
+        my_coordinate = site["coordinate"]
+        if HOMOPOLYMER_COLUMNS <= self.skipped_columns:
+            homopolymer_length = site_homopolymer_length = nan
+        else:
+            (
+                homopolymer_length,
+                site_homopolymer_length,
+            ) = sequencing_features.get_homopolymer_lengths(
+                self.ref_fa, my_coordinate, site["ref_base"], site["first_alt"]
+            )
+
+        # Linguistic sequence complexity in a +/-80bp window, but substring calculation stops at 20-bp substring.
+        LC_spanning = LC_adjacent = math.nan
+        if "Seq_Complexity_Span" not in self.skipped_columns:
+            seq_span_80bp = self.ref_fa.fetch(
+                my_coordinate[0],
+                max(0, my_coordinate[1] - 41),
+                my_coordinate[1] + 40,
+            )
+            if len(seq_span_80bp) > 20:
+                LC_spanning = self.span_lc(
+                    my_coordinate[0],
+                    max(0, my_coordinate[1] - 41),
+                    seq_span_80bp,
+                )
+
+        if "Seq_Complexity_Adj" not in self.skipped_columns:
+            seq_left_80bp = self.ref_fa.fetch(
+                my_coordinate[0],
+                max(0, my_coordinate[1] - 81),
+                my_coordinate[1],
+            )
+            seq_right_80bp = self.ref_fa.fetch(
+                my_coordinate[0],
+                my_coordinate[1],
+                my_coordinate[1] + 81,
+            )
+
+            if len(seq_left_80bp) > 20:
+                left_LC = self.left_lc(
+                    my_coordinate[0],
+                    max(0, my_coordinate[1] - 81),
+                    seq_left_80bp,
+                )
+            else:
+                left_LC = math.nan
+
+            if len(seq_right_80bp) > 20:
+                right_LC = self.right_lc(
+                    my_coordinate[0], my_coordinate[1], seq_right_80bp
+                )
+            else:
+                right_LC = math.nan
+
+            LC_adjacent = min(left_LC, right_LC)
+
+        return {
+            "Seq_Complexity_Span": genome.p2phred(1 - LC_spanning, 40),
+            "Seq_Complexity_Adj": genome.p2phred(1 - LC_adjacent, 40),
+            "MaxHomopolymer_Length": homopolymer_length,
+            "SiteHomopolymer_Length": site_homopolymer_length,
+        }
+
+    def close(self) -> None:
+        logger.info(f"BAM {self.bam_cache}")
+        self.ref_fa.close()
+        self.bam.close()
+
+
+def write_lines(
+    block_output: tuple[list[tuple[int, str]], int], outhandles: list
+) -> int:
+    """
+    Write the output lines of a block into the TSV file of their sets, and
+    return the number of downsampled sites of the block.
+    """
+    out_lines, downsampled_sites = block_output
+    for ith_set, out_line in out_lines:
+        outhandles[ith_set].write(out_line + "\n")
+    return downsampled_sites
+
+
+def block_sites(pending_sites: list[dict]) -> tuple[str, list[tuple[int, str, str]]]:
+    """Contig and (1-based position, ref_base, first_alt) of a block of sites"""
+    contig = pending_sites[0]["coordinate"][0]
+    sites = [
+        (site["coordinate"][1], site["ref_base"], site["first_alt"])
+        for site in pending_sites
+    ]
+    return contig, sites
+
+
+def block_out_lines(
+    pending_sites: list[dict],
+    bam: pysam.AlignmentFile,
+    min_mq: float,
+    min_bq: float,
+    p_scale: str | None,
+    bam_cache: ReadCache | None = None,
+    skipped_columns: set[str] = set(),
+    bam_reads: list[pysam.AlignedSegment] | None = None,
+    max_reads: int | None = None,
+    downsample_seed: int = 0,
+) -> tuple[list[tuple[int, str]], int]:
+    """
+    Extract the BAM features for a block of nearby candidate sites on the same
+    contig, sweeping the BAM file once for the whole block.
+
+    Args:
+        pending_sites: sites from candidate_site_blocks with all their non-BAM
+            output columns and the index of their set of candidate sites
+        bam: tumor BAM file
+        min_mq: minimum mapping quality
+        min_bq: minimum base quality
+        p_scale: "phred", "fraction", or None
+        bam_cache: ReadCache of the BAM file
+        skipped_columns: output columns that are not computed and written as
+            nan. The BAM file is not read at all if none of its columns are
+            computed.
+        bam_reads: reads of the block in the BAM file, if already fetched by
+            BlockFeatureExtractor.fetch_reads
+        max_reads: maximum number of reads per site, above which the reads are
+            downsampled
+        downsample_seed: seed of the downsampling
+
+    Returns:
+        (index of the set, output line) of every site, in the original order,
+        and the number of sites whose reads were downsampled
+    """
+    nan = float("nan")
+    contig, sites = block_sites(pending_sites)
+    if skipped_columns.issuperset(BAM_COLUMNS):
+        tbam_features = [BamFeatures() for _ in sites]
+    else:
+        tbam_features = BamFeatures.from_alignment_file_for_sites(
+            bam_fh=bam,
+            contig=contig,
+            sites=sites,
+            min_mq=min_mq,
+            min_bq=min_bq,
+            read_cache=bam_cache,
+            skipped_tests=[
+                test
+                for test, column in BAM_TEST_COLUMNS.items()
+                if "tBAM_" + column in skipped_columns
+            ],
+            reads=bam_reads,
+            max_reads=max_reads,
+            downsample_seed=downsample_seed,
+        )
+    out_lines = []
+    downsampled_sites = 0
+    for site, tbam_feature in zip(pending_sites, tbam_features):
+        downsampled_sites += tbam_feature.downsampled
+        columns = dict(
+            **site["columns"],
+            Consistent_Mates=tbam_feature.consistent_mates,
+            Inconsistent_Mates=tbam_feature.inconsistent_mates,
+            T_DP=tbam_feature.dp,
+            tBAM_REF_MQ="%g" % tbam_feature.ref_mq,
+            tBAM_ALT_MQ="%g" % tbam_feature.alt_mq,
+            tBAM_p_MannWhitneyU_MQ="%g" % tbam_feature.p_mannwhitneyu_mq,
+            tBAM_REF_BQ="%g" % tbam_feature.ref_bq,
+            tBAM_ALT_BQ="%g" % tbam_feature.alt_bq,
+            tBAM_p_MannWhitneyU_BQ="%g" % tbam_feature.p_mannwhitneyu_bq,
+            tBAM_REF_NM="%g" % tbam_feature.ref_edit_distance,
+            tBAM_ALT_NM="%g" % tbam_feature.alt_edit_distance,
+            tBAM_NM_Diff="%g" % tbam_feature.edit_distance_difference,
+            tBAM_REF_Concordant=tbam_feature.ref_concordant_reads,
+            tBAM_REF_Discordant=tbam_feature.ref_discordant_reads,
+            tBAM_ALT_Concordant=tbam_feature.alt_concordant_reads,
+            tBAM_ALT_Discordant=tbam_feature.alt_discordant_reads,
+            tBAM_Concordance_FET=rescale(
+                tbam_feature.concordance_fet, "fraction", p_scale, 1001
+            ),
+            T_REF_FOR=tbam_feature.ref_call_forward,
+            T_REF_REV=tbam_feature.ref_call_reverse,
+            T_ALT_FOR=tbam_feature.alt_call_forward,
+            T_ALT_REV=tbam_feature.alt_call_reverse,
+            tBAM_StrandBias_FET=rescale(
+                tbam_feature.strandbias_fet, "fraction", p_scale, 1001
+            ),
+            tBAM_p_MannWhitneyU_EndPos="%g" % tbam_feature.p_mannwhitneyu_endpos,
+            tBAM_REF_Clipped_Reads=tbam_feature.ref_soft_clipped_reads,
+            tBAM_ALT_Clipped_Reads=tbam_feature.alt_soft_clipped_reads,
+            tBAM_Clipping_FET=rescale(
+                tbam_feature.clipping_fet, "fraction", p_scale, 1001
+            ),
+            tBAM_MQ0=tbam_feature.mq0_reads,
+            tBAM_Other_Reads=tbam_feature.noise_read_count,
+            tBAM_Poor_Reads=tbam_feature.poor_read_count,
+            tBAM_REF_InDel_3bp=tbam_feature.ref_indel_3bp,
+            tBAM_REF_InDel_2bp=tbam_feature.ref_indel_2bp,
+            tBAM_REF_InDel_1bp=tbam_feature.ref_indel_1bp,
+            tBAM_ALT_InDel_3bp=tbam_feature.alt_indel_3bp,
+            tBAM_ALT_InDel_2bp=tbam_feature.alt_indel_2bp,
+            tBAM_ALT_InDel_1bp=tbam_feature.alt_indel_1bp,
+        )
+        columns.update(dict.fromkeys(skipped_columns, nan))
+        out_line_part_1 = out_header.format(**columns)
+        out_line = "\t".join((out_line_part_1, site["trailing_columns"]))
+        out_lines.append((site["ith_set"], out_line))
+    return out_lines, downsampled_sites
 
 
 if __name__ == "__main__":
@@ -912,4 +1230,13 @@ if __name__ == "__main__":
         ref_fa=runParameters["genome_reference"],
         p_scale=runParameters["p_scale"],
         outfile=runParameters["output_tsv_file"],
+        read_cache_size=runParameters["read_cache_size"],
+        context_track=runParameters["sequence_context_track"],
+        pileup_scan=runParameters["pileup_scan"],
+        min_alt_reads=runParameters["min_alt_reads"],
+        feature_manifest=runParameters["feature_manifest"],
+        threads=runParameters["threads"],
+        prefetch=runParameters["prefetch"],
+        max_reads=runParameters["max_reads_per_site"],
+        downsample_seed=runParameters["downsample_seed"],
     )
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import os
+import time
+from collections.abc import Callable
 from functools import partial
 from multiprocessing import Pool
 from shutil import rmtree
@@ -28,13 +30,63 @@ from somaticseq.defaults import (
     SNV_VCF_SUFFIX,
     TUMOR_NAME,
 )
+from somaticseq.vcf_modifier.vcfIntersector import partition_vcf
+
+# Seconds each work unit took, in the output directory
+WORK_UNIT_RUNTIMES = "work_unit_runtimes.tsv"
+
+# Caller VCF arguments of run_somaticseq, and the parameters of
+# run_paired_mode_by_region and run_single_mode_by_region they are passed to
+PAIRED_CALLER_VCF_ARGS = {
+    "mutect_vcf": "mutect",
+    "indelocator_vcf": "indelocator",
+    "mutect2_vcf": "mutect2",
+    "varscan_snv": "varscan_snv",
+    "varscan_indel": "varscan_indel",
+    "jsm_vcf": "jsm",
+    "somaticsniper_vcf": "sniper",
+    "vardict_vcf": "vardict",
+    "muse_vcf": "muse",
+    "lofreq_snv": "lofreq_snv",
+    "lofreq_indel": "lofreq_indel",
+    "scalpel_vcf": "scalpel",
+    "strelka_snv": "strelka_snv",
+    "strelka_indel": "strelka_indel",
+    "tnscope_vcf": "tnscope",
+    "platypus_vcf": "platypus",
+    "arbitrary_snvs": "arb_snvs",
+    "arbitrary_indels": "arb_indels",
+}
+SINGLE_CALLER_VCF_ARGS = {
+    "mutect_vcf": "mutect",
+    "mutect2_vcf": "mutect2",
+    "varscan_vcf": "varscan",
+    "vardict_vcf": "vardict",
+    "lofreq_vcf": "lofreq",
+    "scalpel_vcf": "scalpel",
+    "strelka_vcf": "strelka",
+    "arbitrary_snvs": "arb_snvs",
+    "arbitrary_indels": "arb_indels",
+}
+
+
+def work_unit_outdir(inclusion: str, outdir: str) -> str:
+    """Output directory of the work unit of an inclusion bed file"""
+    basename = inclusion.split(os.sep)[-1].split(".")[0]
+    return os.path.join(outdir, basename)
 
 
 def split_regions(
-    nthreads: int, outfiles: str, bed: str | None = None, fai: str | None = None
+    nthreads: int,
+    outfiles: str,
+    bed: str | None = None,
+    fai: str | None = None,
+    bam_files: list[str] | None = None,
+    vcf_files: list[str] | None = None,
 ) -> list[str]:
     """
-    Split into equal-sized regions in bed files.
+    Split into equal-sized regions in bed files, or with bam_files and/or
+    vcf_files, into regions of equal estimated work.
 
     Args:
         nthreads: number of bed files to split into
@@ -44,6 +96,8 @@ def split_regions(
         bed: input bed file to split from. fai file will be ignored if bed is
             provided.
         fai: input fai file to split from if bed file not provided.
+        bam_files: indexed bam files whose coverage is split evenly
+        vcf_files: vcf files whose candidate variants are split evenly
 
     Returns:
         A list of bed files where the regions are equal-sized.
@@ -55,6 +109,8 @@ def split_regions(
     if not bed:
         assert fai
         bed = split_bed.fai2bed(fai, outfiles)
+    if bam_files or vcf_files:
+        return split_bed.split_by_work(bed, outfiles, nthreads, bam_files, vcf_files)
     output_bedfiles = split_bed.split(bed, outfiles, nthreads)
     return output_bedfiles
 
@@ -110,6 +166,9 @@ def run_paired_mode_by_region(
     iterations: int = 200,
     features_excluded: list[str] = [],
     hyperparameters: list[str] | None = None,
+    max_reads: int | None = None,
+    downsample_seed: int = 0,
+    skip_unused_features: bool = False,
 ) -> str:
     """
     Args:
@@ -169,12 +228,17 @@ def run_paired_mode_by_region(
         train_seed: seed for training
         tree_depth: tree depth for model building
         iterations: number of trees to build for classifier
+        max_reads: number of reads sampled to compute the BAM features of a
+            site with more reads than this
+        downsample_seed: seed of the sampling of reads
+        skip_unused_features: with both xgboost classifiers, only compute the
+            optional features they consume (see
+            run_somaticseq.classifier_feature_manifest)
 
     Returns:
         output directory
     """
-    basename = inclusion.split(os.sep)[-1].split(".")[0]
-    outdir_i = os.path.join(outdir, basename)
+    outdir_i = work_unit_outdir(inclusion, outdir)
     os.makedirs(outdir_i, exist_ok=True)
     run_somaticseq.run_paired_mode(
         outdir=outdir_i,
@@ -227,6 +291,9 @@ def run_paired_mode_by_region(
         iterations=iterations,
         features_excluded=features_excluded,
         hyperparameters=hyperparameters,
+        max_reads=max_reads,
+        downsample_seed=downsample_seed,
+        skip_unused_features=skip_unused_features,
     )
     return outdir_i
 
@@ -271,12 +338,14 @@ def run_single_mode_by_region(
     iterations: int = 200,
     features_excluded: list[str] = [],
     hyperparameters: list[str] | None = None,
+    max_reads: int | None = None,
+    downsample_seed: int = 0,
+    skip_unused_features: bool = False,
 ) -> str:
     """
     Tumor-only version of run_paired_mode_by_region.
     """
-    basename = inclusion.split(os.sep)[-1].split(".")[0]
-    outdir_i = os.path.join(outdir, basename)
+    outdir_i = work_unit_outdir(inclusion, outdir)
     os.makedirs(outdir_i, exist_ok=True)
     run_somaticseq.run_single_mode(
         outdir=outdir_i,
@@ -318,10 +387,109 @@ def run_single_mode_by_region(
         iterations=iterations,
         features_excluded=features_excluded,
         hyperparameters=hyperparameters,
+        max_reads=max_reads,
+        downsample_seed=downsample_seed,
+        skip_unused_features=skip_unused_features,
     )
     return outdir_i
 
 
+def partition_caller_vcfs(
+    caller_vcfs: dict[str, str | list[str]],
+    inclusions: list[str],
+    outdir: str,
+    threads: int = 1,
+) -> list[dict[str, str | list[str]]]:
+    """
+    Read each caller vcf file once, and write its variants in the regions of
+    each work unit into the output directory of the work unit, so the work
+    units do not each intersect the whole caller vcf files with their regions.
+
+    Args:
+        caller_vcfs: vcf files (or lists of them for the arbitrary callers),
+            keyed by their parameters of run_paired_mode_by_region or
+            run_single_mode_by_region
+        inclusions: inclusion bed file of each work unit
+        outdir: output directory, where the work units have their own
+            sub-directories
+        threads: number of vcf files partitioned at once
+
+    Returns:
+        for each work unit, the caller_vcfs of its regions
+    """
+    unit_outdirs = [work_unit_outdir(inclusion, outdir) for inclusion in inclusions]
+    for outdir_i in unit_outdirs:
+        os.makedirs(outdir_i, exist_ok=True)
+
+    unit_caller_vcfs: list[dict[str, str | list[str]]] = [{} for _ in inclusions]
+    partitions = []
+    for param, vcf_files in caller_vcfs.items():
+        if isinstance(vcf_files, str):
+            sliced_name = f"partitioned.{param}.vcf"
+            outfiles = [os.path.join(dir_i, sliced_name) for dir_i in unit_outdirs]
+            partitions.append((vcf_files, inclusions, outfiles))
+            for unit_i, outfile in zip(unit_caller_vcfs, outfiles):
+                unit_i[param] = outfile
+            continue
+        for unit_i in unit_caller_vcfs:
+            unit_i[param] = []
+        for ith_vcf, vcf_file in enumerate(vcf_files):
+            sliced_name = f"partitioned.{param}.{ith_vcf}.vcf"
+            outfiles = [os.path.join(dir_i, sliced_name) for dir_i in unit_outdirs]
+            partitions.append((vcf_file, inclusions, outfiles))
+            for unit_i, outfile in zip(unit_caller_vcfs, outfiles):
+                unit_i[param].append(outfile)
+
+    with Pool(processes=max(1, min(threads, len(partitions)))) as pool:
+        pool.starmap(partition_vcf, partitions)
+
+    return unit_caller_vcfs
+
+
+def run_work_unit(
+    run_by_region: Callable[..., str], work_unit: tuple[str, dict]
+) -> tuple[str, str, float]:
+    """
+    Run a work unit, i.e., run_by_region on the regions of an inclusion bed
+    file (with the caller vcf files of its regions, if partitioned), and time
+    it.
+
+    Returns:
+        inclusion bed file, output directory of the work unit, and seconds it
+        took
+    """
+    inclusion, caller_vcfs = work_unit
+    start_time = time.perf_counter()
+    outdir_i = run_by_region(inclusion, **caller_vcfs)
+    return inclusion, outdir_i, time.perf_counter() - start_time
+
+
+def write_work_unit_runtimes(runtimes: list[tuple[str, float]], outfile: str) -> None:
+    """
+    Write where each work unit (i.e., an inclusion bed file) starts and ends,
+    its base pairs, and the seconds it took into a tsv file, so the slow
+    regions can be found after the bed files are removed.
+    """
+    with open(outfile, "w") as out:
+        out.write("work_unit\tfirst_region\tlast_region\tbase_pairs\tseconds\n")
+        for inclusion, seconds in runtimes:
+            with open(inclusion) as bed:
+                regions = [
+                    (items[0], int(items[1]), int(items[2]))
+                    for items in (line_i.rstrip().split("\t") for line_i in bed)
+                    if len(items) >= 3
+                ]
+            first_region, last_region = ".", "."
+            if regions:
+                first_region = "{}:{}-{}".format(*regions[0])
+                last_region = "{}:{}-{}".format(*regions[-1])
+            base_pairs = sum(end - start for _, start, end in regions)
+            out.write(
+                f"{os.path.basename(inclusion)}\t{first_region}\t{last_region}\t"
+                f"{base_pairs}\t{seconds:.3f}\n"
+            )
+
+
 def merge_tsvs_in_subdirs(
     list_of_dirs: list[str], filename: str, outdir: str = os.curdir
 ) -> None:
@@ -339,14 +507,32 @@ def merge_vcfs_in_subdirs(
 if __name__ == "__main__":
     args = run_somaticseq.run()
     os.makedirs(args.output_directory, exist_ok=True)
+    if args.which == "paired":
+        caller_vcf_args = PAIRED_CALLER_VCF_ARGS
+    else:
+        caller_vcf_args = SINGLE_CALLER_VCF_ARGS
+    caller_vcfs = {
+        param: getattr(args, arg_i)
+        for arg_i, param in caller_vcf_args.items()
+        if getattr(args, arg_i)
+    }
+    bam_files, vcf_files = None, None
+    if args.split_by_coverage:
+        if args.which == "paired":
+            bam_files = [args.tumor_bam_file, args.normal_bam_file]
+        else:
+            bam_files = [args.bam_file]
+        vcf_files = []
+        for vcf_i in caller_vcfs.values():
+            vcf_files += [vcf_i] if isinstance(vcf_i, str) else vcf_i
     bed_splitted = split_regions(
-        args.threads,
+        args.threads * args.work_units_per_thread,
         os.path.join(args.output_directory, "th.input.bed"),
         args.inclusion_region,
         args.genome_reference + ".fai",
+        bam_files,
+        vcf_files,
     )
-    pool = Pool(processes=args.threads)
-
     if args.which == "paired":
         run_paired_by_region_i = partial(
             run_paired_mode_by_region,
@@ -396,9 +582,11 @@ if __name__ == "__main__":
             features_excluded=args.features_excluded,
             hyperparameters=args.extra_hyperparameters,
             keep_intermediates=args.keep_intermediates,
+            max_reads=args.max_reads_per_site,
+            downsample_seed=args.downsample_seed,
+            skip_unused_features=args.skip_unused_features,
         )
-        subdirs = pool.map(run_paired_by_region_i, bed_splitted)
-        pool.close()
+        run_by_region_i = run_paired_by_region_i
 
     elif args.which == "single":
         run_single_by_region_i = partial(
@@ -438,10 +626,37 @@ if __name__ == "__main__":
             features_excluded=args.features_excluded,
             hyperparameters=args.extra_hyperparameters,
             keep_intermediates=args.keep_intermediates,
+            max_reads=args.max_reads_per_site,
+            downsample_seed=args.downsample_seed,
+            skip_unused_features=args.skip_unused_features,
         )
-        subdirs = pool.map(run_single_by_region_i, bed_splitted)
-        pool.close()
+        run_by_region_i = run_single_by_region_i
 
+    # Every caller vcf file is read once for all the work units
+    if len(bed_splitted) > 1 and caller_vcfs:
+        unit_caller_vcfs = partition_caller_vcfs(
+            caller_vcfs, bed_splitted, args.output_directory, args.threads
+        )
+    else:
+        unit_caller_vcfs = [{} for _ in bed_splitted]
+
+    # Work units are dispatched to the next idle process as they finish, and
+    # their results are merged in the order of the units afterwards
+    subdir_of_unit = {}
+    seconds_of_unit = {}
+    with Pool(processes=args.threads) as pool:
+        for bed_i, subdir_i, seconds_i in pool.imap_unordered(
+            partial(run_work_unit, run_by_region_i),
+            zip(bed_splitted, unit_caller_vcfs),
+        ):
+            run_somaticseq.logger.info(f"{bed_i} done in {seconds_i:.1f} seconds")
+            subdir_of_unit[bed_i] = subdir_i
+            seconds_of_unit[bed_i] = seconds_i
+    subdirs = [subdir_of_unit[bed_i] for bed_i in bed_splitted]
+    write_work_unit_runtimes(
+        [(bed_i, seconds_of_unit[bed_i]) for bed_i in bed_splitted],
+        os.path.join(args.output_directory, WORK_UNIT_RUNTIMES),
+    )
     run_somaticseq.logger.info("Sub-directories created: {}".format(", ".join(subdirs)))
 
     # Merge sub-results
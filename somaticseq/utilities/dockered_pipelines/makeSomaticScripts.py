@@ -286,6 +286,12 @@ def run() -> tuple[argparse.Namespace, dict]:
         help="Split the input regions into this many threads",
         default=1,
     )
+    parser_paired.add_argument(
+        "-splitcov",
+        "--split-by-coverage",
+        action="store_true",
+        help="Split the input regions by the coverage of the BAM files, estimated from their indices, instead of into equal sizes",
+    )
     parser_paired.add_argument(
         "-run",
         "--run-workflow",
@@ -501,6 +507,12 @@ def run() -> tuple[argparse.Namespace, dict]:
         help="Split the input regions into this many threads",
         default=1,
     )
+    parser_single.add_argument(
+        "-splitcov",
+        "--split-by-coverage",
+        action="store_true",
+        help="Split the input regions by the coverage of the BAM files, estimated from their indices, instead of into equal sizes",
+    )
     parser_single.add_argument(
         "-run",
         "--run-workflow",
@@ -543,11 +555,19 @@ def make_workflow(args, wf_arg_dict):
             )
             bed_file = wf_arg_dict["output_directory"] + os.sep + "genome.bed"
 
-        split_bed.split(
-            bed_file,
-            wf_arg_dict["output_directory"] + os.sep + "bed",
-            wf_arg_dict["threads"],
-        )
+        if wf_arg_dict["split_by_coverage"]:
+            split_bed.split_by_work(
+                bed_file,
+                wf_arg_dict["output_directory"] + os.sep + "bed",
+                wf_arg_dict["threads"],
+                bam_files=[wf_arg_dict["tumor_bam"], wf_arg_dict["normal_bam"]],
+            )
+        else:
+            split_bed.split(
+                bed_file,
+                wf_arg_dict["output_directory"] + os.sep + "bed",
+                wf_arg_dict["threads"],
+            )
         os.makedirs(
             os.path.join(wf_arg_dict["output_directory"], "logs"), exist_ok=True
         )
@@ -741,11 +761,19 @@ def make_workflow(args, wf_arg_dict):
             )
             bed_file = wf_arg_dict["output_directory"] + os.sep + "genome.bed"
 
-        split_bed.split(
-            bed_file,
-            wf_arg_dict["output_directory"] + os.sep + "bed",
-            wf_arg_dict["threads"],
-        )
+        if wf_arg_dict["split_by_coverage"]:
+            split_bed.split_by_work(
+                bed_file,
+                wf_arg_dict["output_directory"] + os.sep + "bed",
+                wf_arg_dict["threads"],
+                bam_files=[wf_arg_dict["bam"]],
+            )
+        else:
+            split_bed.split(
+                bed_file,
+                wf_arg_dict["output_directory"] + os.sep + "bed",
+                wf_arg_dict["threads"],
+            )
         os.makedirs(wf_arg_dict["output_directory"] + os.sep + "logs", exist_ok=True)
         # Parallelizables
         to_create_merging_script = True
@@ -50,23 +50,9 @@ def LC(sequence):
     sequence = sequence.upper()
 
     if "N" not in sequence:
-        number_of_subseqs = 0
-        seq_length = len(sequence)
-        max_number_of_subseqs = max_vocabularies(seq_length)
-
-        for i in range(1, seq_length + 1):
-            # max_vocab_1 = 4**i
-            # max_vocab_2 = seq_length - i + 1
-            set_of_seq_n = set()
-
-            for n, nth_base in enumerate(sequence):
-                if n + i <= len(sequence):
-                    sub_seq = sequence[n : n + i]
-                    set_of_seq_n.add(sub_seq)
-
-            num_uniq_subseqs = len(set_of_seq_n)
-            number_of_subseqs = number_of_subseqs + num_uniq_subseqs
-
+        # Distinct substrings of every length, counted in linear time
+        number_of_subseqs = seq_features.count_distinct_substrings(sequence)
+        max_number_of_subseqs = max_vocabularies(len(sequence))
         lc = number_of_subseqs / max_number_of_subseqs
 
     else:
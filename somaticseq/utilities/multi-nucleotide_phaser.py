@@ -10,6 +10,7 @@ import pysam
 import somaticseq.genomic_file_parsers.genomic_file_handlers as genome
 from somaticseq.genomic_file_parsers.read_info_extractor import (
     AlignmentType,
+    ReadCache,
     alignment_in_read_for_coordinate,
 )
 
@@ -48,7 +49,7 @@ threshold = args.phasing_threshold
 
 with genome.open_textfile(infile) as infile, pysam.AlignmentFile(bam) as bam, open(
     outfile, "w"
-) as outfile, pysam.FastaFile(ref_fa) as ref_fa:
+) as outfile, genome.BlockCachedFasta(ref_fa) as ref_fa:
     my_line = infile.readline().rstrip()
 
     while my_line.startswith("##"):
@@ -66,6 +67,9 @@ with genome.open_textfile(infile) as infile, pysam.AlignmentFile(bam) as bam, op
     outfile.write(my_line + "\n")
     my_line = infile.readline().rstrip()
 
+    # Reads spanning neighbouring groups of variants are only parsed once
+    read_cache = ReadCache()
+
     # Get into the bulk of the VCF file
     while my_line:
         my_vcf = genome.VCFVariantRecord.from_vcf_line(my_line)
@@ -126,15 +130,19 @@ with genome.open_textfile(infile) as infile, pysam.AlignmentFile(bam) as bam, op
                 mnp_tally["".join(string_i)] = 0
 
             # Grab the reads from the first coordinate to the last coordinate
+            read_cache.evict_before(
+                bam.get_tid(my_coordinates[0][0]), my_coordinates[0][1] - 1
+            )
             reads = bam.fetch(
                 my_coordinates[0][0], my_coordinates[0][1] - 1, my_coordinates[-1][1]
             )
             for read_i in reads:
                 if not (read_i.is_unmapped or read_i.is_duplicate):
+                    parsed_read = read_cache.parse(read_i)
                     mnp_call = ""
                     for coordinate_i in my_coordinates:
                         sequencing_call = alignment_in_read_for_coordinate(
-                            read_i, coordinate_i[1] - 1
+                            read_i, coordinate_i[1] - 1, parsed_read=parsed_read
                         )
                         # The position is matched:
                         if (
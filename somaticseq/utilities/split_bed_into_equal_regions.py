@@ -5,15 +5,27 @@ import math
 import os
 import re
 import sys
+from collections import Counter
 
+import numpy as np
 
-def run() -> tuple[str, str, int]:
+import somaticseq.genomic_file_parsers.bam_index as bam_index
+import somaticseq.genomic_file_parsers.genomic_file_handlers as genome
+
+# With --bam-files or --vcf-files, this share of the work of the regions is
+# still spread by base pairs, so regions without reads or candidates are spread
+# out too
+BASE_PAIR_SHARE = 0.05
+
+
+def run() -> argparse.Namespace:
     # argparse Stuff
     parser = argparse.ArgumentParser(
         description="""Given an input bed file, this program will output a number of bed files, each will have same number of total base pairs.
         This routine is used to parallelize SomaticSeq tasks.
         One limitation, however, is that some regions of the genome have much higher coverage than others.
         This is the reason some regions run much slower than others.
+        With --bam-files and/or --vcf-files, each bed file will instead have the same estimated work, by the coverage of the BAM files and the number of candidate variants in the VCF files.
         """,
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
@@ -36,8 +48,24 @@ def run() -> tuple[str, str, int]:
         required=False,
         default=sys.stdout,
     )
+    parser.add_argument(
+        "-bams",
+        "--bam-files",
+        type=str,
+        nargs="*",
+        help="Indexed BAM files whose coverage, estimated from their indices, is split evenly",
+        default=[],
+    )
+    parser.add_argument(
+        "-vcfs",
+        "--vcf-files",
+        type=str,
+        nargs="*",
+        help="VCF files whose candidate variants are split evenly",
+        default=[],
+    )
     args = parser.parse_args()
-    return args.input_file, args.output_files, args.num_of_files
+    return args
 
 
 def fai2bed(fai: str, bedout: str) -> str:
@@ -176,6 +204,186 @@ def split(infile: str, outfiles: str, num: int) -> list[str]:
     return outfiles_written
 
 
+def read_bed_regions(infile: str) -> list[tuple[str, int, int]]:
+    """(contig, start, end) of the regions of a BED file"""
+    regions = []
+    with open(infile) as bedin:
+        for line_i in bedin:
+            if re.match(r"track|browser|#", line_i) or not line_i.strip():
+                continue
+            items = line_i.rstrip().split("\t")
+            regions.append((items[0], int(items[1]), int(items[2])))
+    return regions
+
+
+def candidates_by_window(
+    vcf_files: list[str], window_size: int = bam_index.WINDOW_SIZE
+) -> dict[tuple[str, int], int]:
+    """Number of the VCF records in each (contig, window index)"""
+    num_candidates: Counter = Counter()
+    for vcf_file in vcf_files:
+        with genome.open_textfile(vcf_file) as vcf_h:
+            for line_i in vcf_h:
+                if line_i.startswith("#"):
+                    continue
+                contig, position = line_i.split("\t", 2)[:2]
+                num_candidates[contig, (int(position) - 1) // window_size] += 1
+    return num_candidates
+
+
+def estimate_work(
+    regions: list[tuple[str, int, int]],
+    bam_files: list[str] | None = None,
+    vcf_files: list[str] | None = None,
+    window_size: int = bam_index.WINDOW_SIZE,
+) -> list[tuple[str, int, int, float]]:
+    """
+    Break the regions at the boundaries of the windows, and estimate the work
+    of each piece from the reads in the BAM files (estimated from their
+    indices) and the candidate variants in the VCF files. A piece gets its
+    share of the reads and the candidates of its window by base pairs.
+
+    Args:
+        regions: (contig, start, end) of the regions
+        bam_files: indexed BAM files, e.g., tumor and normal
+        vcf_files: VCF files of the candidate variants, e.g., of the callers
+        window_size: size of the windows
+
+    Returns:
+        (contig, start, end, work) of the pieces in the order of the regions,
+        where the work of all of them adds up to 1
+    """
+    pieces = []
+    for contig, start, end in regions:
+        while start < end:
+            piece_end = min((start // window_size + 1) * window_size, end)
+            pieces.append((contig, start, piece_end))
+            start = piece_end
+
+    window_reads: dict[str, np.ndarray] = {}
+    for bam_file in bam_files or []:
+        for contig, reads in bam_index.reads_by_window(bam_file, window_size).items():
+            window_reads[contig] = reads + window_reads.get(contig, 0)
+    window_candidates = candidates_by_window(vcf_files or [], window_size)
+
+    def piece_reads(contig: str, start: int, end: int) -> float:
+        window_i = start // window_size
+        if contig not in window_reads or window_i >= len(window_reads[contig]):
+            return 0.0
+        return float(window_reads[contig][window_i]) * (end - start) / window_size
+
+    def piece_candidates(contig: str, start: int, end: int) -> float:
+        window_i = start // window_size
+        return (
+            window_candidates.get((contig, window_i), 0) * (end - start) / window_size
+        )
+
+    # Each source of the work is normalized to add up to its share
+    sources = [[float(end - start) for _, start, end in pieces]]
+    if bam_files:
+        sources.append([piece_reads(*piece_i) for piece_i in pieces])
+    if vcf_files:
+        sources.append([piece_candidates(*piece_i) for piece_i in pieces])
+    totals = [sum(source_i) for source_i in sources]
+    num_weighted_sources = sum(total_i > 0 for total_i in totals[1:])
+    shares = [BASE_PAIR_SHARE if num_weighted_sources else 1.0] + [
+        (1 - BASE_PAIR_SHARE) / num_weighted_sources if total_i > 0 else 0.0
+        for total_i in totals[1:]
+    ]
+    work = np.zeros(len(pieces), dtype=np.float64)
+    for source_i, total_i, share_i in zip(sources, totals, shares):
+        if total_i > 0:
+            work += share_i * np.array(source_i) / total_i
+
+    return [
+        (contig, start, end, float(work_i))
+        for (contig, start, end), work_i in zip(pieces, work)
+    ]
+
+
+def split_by_work(
+    infile: str,
+    outfiles: str,
+    num: int,
+    bam_files: list[str] | None = None,
+    vcf_files: list[str] | None = None,
+    window_size: int = bam_index.WINDOW_SIZE,
+) -> list[str]:
+    """Split a bed file into n bed files of equal estimated work, i.e., by the
+    coverage of the BAM files and the density of the candidate variants in the
+    VCF files (see estimate_work), rather than by base pairs.
+
+    Args:
+        infile: input bed file
+        outfiles: output bed files to which "n." will be appended to its
+            basename (see split)
+        num: number of output bed files
+        bam_files: indexed BAM files
+        vcf_files: VCF files of candidate variants
+        window_size: resolution of the estimates of the work
+
+    Returns:
+        List of output bed files written
+    """
+    out_basename = os.path.basename(outfiles)
+    out_directory = os.path.dirname(outfiles)
+    os.makedirs(out_directory, exist_ok=True)
+    if not out_directory:
+        out_directory = os.curdir
+
+    pieces = estimate_work(read_bed_regions(infile), bam_files, vcf_files, window_size)
+    shards: list[list[tuple[str, int, int]]] = [[] for _ in range(num)]
+    ith_shard = 0
+    work_done = 0.0
+    for contig, start, end, work_i in pieces:
+        # Cut the piece where the cumulative work crosses into the next shard,
+        # assuming the work is even within the piece
+        while ith_shard < num - 1 and work_done + work_i > (ith_shard + 1) / num:
+            fraction = ((ith_shard + 1) / num - work_done) / work_i if work_i else 0
+            breakpoint_i = start + round(fraction * (end - start))
+            if breakpoint_i >= end:
+                break
+            if breakpoint_i > start:
+                shards[ith_shard].append((contig, start, breakpoint_i))
+                work_cut = work_i * (breakpoint_i - start) / (end - start)
+                work_done += work_cut
+                work_i -= work_cut
+                start = breakpoint_i
+            ith_shard += 1
+        shards[ith_shard].append((contig, start, end))
+        work_done += work_i
+
+    outfiles_written = []
+    for ith_split, shard_i in enumerate(shards, start=1):
+        ith_basename = os.path.join(out_directory, f"{ith_split}.{out_basename}")
+        outfiles_written.append(ith_basename)
+        with open(ith_basename, "w") as ith_out:
+            # Pieces of the same region are put back together
+            merged_regions: list[list] = []
+            for contig, start, end in shard_i:
+                if (
+                    merged_regions
+                    and merged_regions[-1][0] == contig
+                    and merged_regions[-1][2] == start
+                ):
+                    merged_regions[-1][2] = end
+                else:
+                    merged_regions.append([contig, start, end])
+            for contig, start, end in merged_regions:
+                ith_out.write(f"{contig}\t{start}\t{end}\n")
+
+    return outfiles_written
+
+
 if __name__ == "__main__":
-    infile, outfiles, num = run()
-    split(infile, outfiles, num)
+    args = run()
+    if args.bam_files or args.vcf_files:
+        split_by_work(
+            args.input_file,
+            args.output_files,
+            args.num_of_files,
+            args.bam_files,
+            args.vcf_files,
+        )
+    else:
+        split(args.input_file, args.output_files, args.num_of_files)
@@ -73,10 +73,13 @@ def vaf_from_bam(
     ref_base,
     first_alt,
     min_mq=1,
+    read_cache=None,
 ):
     """
     bam is the opened file handle of bam file
     my_coordiate is a list or tuple of 0-based (contig, position)
+    read_cache is an optional read_info_extractor.ReadCache of the bam file, so
+    reads shared by nearby variants are only parsed once
     Returns: number of variant calls, reference calls, other calls, and total calls
     """
 
@@ -95,7 +98,11 @@ def vaf_from_bam(
         ):
             dp += 1
             sequencing_call = read_info_extractor.alignment_in_read_for_coordinate(
-                read_i, my_coordinate[1] - 1
+                read_i,
+                my_coordinate[1] - 1,
+                parsed_read=(
+                    read_cache.parse(read_i) if read_cache is not None else None
+                ),
             )
             # Reference calls:
             if (
@@ -144,6 +151,7 @@ def vcfs2variants(vcf_files, bam_files, sample_names):
         with genome.open_textfile(vcf_file_i) as vcf, pysam.AlignmentFile(
             bam_file_i
         ) as bam:
+            read_cache = read_info_extractor.ReadCache()
             line_i = vcf.readline().rstrip()
             while line_i.startswith("#"):
                 line_i = vcf.readline().rstrip()
@@ -166,7 +174,7 @@ def vcfs2variants(vcf_files, bam_files, sample_names):
                     altbase,
                 )
                 vdp, rdp, odp, totaldp = vaf_from_bam(
-                    bam, (contig_i, pos_i), refbase, altbase, 1
+                    bam, (contig_i, pos_i), refbase, altbase, 1, read_cache
                 )
                 try:
                     vaf_i = vdp / totaldp
@@ -197,8 +205,10 @@ def fills_missing_vafs(variantDict, bam_files, sample_names):
     assert len(sample_names) == len(bam_files)
 
     bamDict = {}
+    read_caches = {}
     for bam_i, sample_i in zip(bam_files, sample_names):
         bamDict[sample_i] = pysam.AlignmentFile(bam_i)
+        read_caches[sample_i] = read_info_extractor.ReadCache()
 
     for variant_i in variantDict:
         for sample_i in sample_names:
@@ -209,6 +219,7 @@ def fills_missing_vafs(variantDict, bam_files, sample_names):
                     variant_i[2],
                     variant_i[3],
                     1,
+                    read_caches[sample_i],
                 )
                 try:
                     vaf_i = vdp / totaldp
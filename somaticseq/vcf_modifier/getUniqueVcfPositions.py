@@ -4,8 +4,15 @@
 
 import argparse
 import gzip
+import heapq
+import logging
+import os
 import re
 
+import somaticseq.genomic_file_parsers.genomic_file_handlers as genome
+
+logger = logging.getLogger(os.path.basename(__file__))
+
 
 def open_textfile(file_name):
     # See if the input file is a .gz file:
@@ -32,57 +39,146 @@ def run():
     parser.add_argument(
         "-out", "--output-vcf", type=str, help="Output VCF file", required=True
     )
+    parser.add_argument(
+        "-ref",
+        "--genome-reference",
+        type=str,
+        help="Genome reference, whose .fai gives the order of the contigs",
+    )
 
     args = parser.parse_args()
 
     infiles = args.input_vcfs
     outfile = args.output_vcf
 
-    return infiles, outfile
+    return infiles, outfile, args.genome_reference
+
+
+class UnsortedVcfError(Exception):
+    def __init__(self, vcf_file):
+        super().__init__(f"{vcf_file} is not sorted.")
+        self.vcf_file = vcf_file
+
+
+def _variants_at_positions(file_i, contig_order):
+    """
+    Sort keys of the variants of a VCF file, i.e., (contig order, contig,
+    position, REF, ALT), one per ALT allele, in order. The variants of the same
+    position are sorted among themselves, but the positions must already be
+    sorted in contig_order.
+    """
+    previous_key = None
+    variants_at_position = []
+    with open_textfile(file_i) as vcf:
+        for line_i in vcf:
+            if line_i.startswith("#"):
+                continue
+            line_i = line_i.rstrip()
+            if not line_i:
+                break
+
+            item = line_i.split("\t")
+            chromosome = item[0]
+            position = int(item[1])
+            position_key = (
+                contig_order.get(chromosome, len(contig_order)),
+                chromosome,
+                position,
+            )
+            if position_key != previous_key:
+                if previous_key is not None and position_key < previous_key:
+                    raise UnsortedVcfError(file_i)
+                yield from sorted(variants_at_position)
+                variants_at_position = []
+                previous_key = position_key
 
+            refbase = item[3]
+            for altbase_i in re.split(r"[,/]", item[4]):
+                variants_at_position.append((*position_key, refbase, altbase_i))
 
-def combine(infiles, outfile):
-    variant_positions = set()
+    yield from sorted(variants_at_position)
 
+
+def _all_variants(infiles, contig_order):
+    variant_positions = set()
     for file_i in infiles:
         with open_textfile(file_i) as vcf:
-            line_i = vcf.readline().rstrip()
-
-            while line_i.startswith("#"):
-                line_i = vcf.readline().rstrip()
-
-            while line_i:
+            for line_i in vcf:
+                if line_i.startswith("#"):
+                    continue
+                line_i = line_i.rstrip()
+                if not line_i:
+                    break
                 item = line_i.split("\t")
-
-                chromosome = item[0]
-                position = int(item[1])
-                refbase = item[3]
-                altbases = re.split(r"[,/]", item[4])
-
-                for altbase_i in altbases:
-                    variant_positions.add((chromosome, position, refbase, altbase_i))
-
-                line_i = vcf.readline().rstrip()
-
+                for altbase_i in re.split(r"[,/]", item[4]):
+                    variant_positions.add(
+                        (
+                            contig_order.get(item[0], len(contig_order)),
+                            item[0],
+                            int(item[1]),
+                            item[3],
+                            altbase_i,
+                        )
+                    )
+    return sorted(variant_positions)
+
+
+def _write_variants(variants, outfile):
     with open(outfile, "w") as vcf_out:
         vcf_out.write("##fileformat=VCFv4.1\n")
         vcf_out.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
 
-        for variant_position_i in sorted(variant_positions):
+        previous_variant = None
+        for variant_i in variants:
+            if variant_i == previous_variant:
+                continue
+            previous_variant = variant_i
+            _, chromosome, position, refbase, altbase = variant_i
             vcf_out.write(
-                "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(
-                    variant_position_i[0],
-                    variant_position_i[1],
-                    ".",
-                    variant_position_i[2],
-                    variant_position_i[3],
-                    ".",
-                    "PASS",
-                    ".",
-                )
+                f"{chromosome}\t{position}\t.\t{refbase}\t{altbase}\t.\tPASS\t.\n"
+            )
+
+
+def combine(infiles, outfile, ref=None):
+    """
+    Write every unique variant (i.e., contig, position, REF, and ALT) of the
+    input VCF files into a sorted VCF file. The input VCF files, which are
+    normally sorted already, are merged as they are read, so only one line of
+    each of them is held at a time. If any of them turns out not to be sorted,
+    the merge starts over, with the variants of that file sorted in memory.
+
+    Args:
+        infiles: input VCF files
+        outfile: output VCF file
+        ref: genome reference, whose .fai gives the order of the contigs. Without
+            it, the contigs are sorted by their names.
+    """
+    contig_order = {}
+    if ref:
+        contig_order = genome.faiordict2contigorder(ref + ".fai", "fai")
+
+    unsorted_files = set()
+    while True:
+        try:
+            _write_variants(
+                heapq.merge(
+                    *[
+                        (
+                            iter(_all_variants([file_i], contig_order))
+                            if file_i in unsorted_files
+                            else _variants_at_positions(file_i, contig_order)
+                        )
+                        for file_i in infiles
+                    ]
+                ),
+                outfile,
             )
+            return
+        except UnsortedVcfError as error:
+            logger.warning(f"{error} Its variants are sorted in memory instead.")
+            unsorted_files.add(error.vcf_file)
 
 
 if __name__ == "__main__":
-    infiles, outfile = run()
-    combine(infiles, outfile)
+    infiles, outfile, ref = run()
+    combine(infiles, outfile, ref)
@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 
-import os
+import bisect
 import re
-import subprocess
-import uuid
+from collections import OrderedDict
 
 import somaticseq.genomic_file_parsers.genomic_file_handlers as genome
+from somaticseq.genomic_file_parsers.intervals import (
+    IntervalSet,
+    filter_vcf_lines,
+    read_bed_intervals,
+    sort_vcf_lines,
+    vcf_line_span,
+)
+
+# Output files that partition_vcf keeps open at a time. The work units are in
+# coordinate order, so the output file of a unit is mostly done with by the
+# time it is closed.
+PARTITION_MAX_OPEN_FILES = 64
 
 
 def remove_vcf_illegal_lines(invcf, outvcf):
@@ -55,14 +66,22 @@ def remove_vcf_illegal_lines(invcf, outvcf):
         return hasIllegalLine
 
 
+def _write_filtered_vcf(infile, outfile, inclusion_region=None, exclusion_region=None):
+    inclusion = IntervalSet.from_bed(inclusion_region) if inclusion_region else None
+    exclusion = IntervalSet.from_bed(exclusion_region) if exclusion_region else None
+    with genome.open_textfile(infile) as vcf, open(outfile, "w") as out:
+        if inclusion is None and exclusion is None:
+            out.writelines(vcf)
+        else:
+            out.writelines(filter_vcf_lines(vcf, inclusion, exclusion))
+    return outfile
+
+
 def bed_include(infile, inclusion_region, outfile):
     assert infile != outfile
 
     if inclusion_region:
-        cmd_line = "bedtools intersect -header -a {} -b {} | uniq > {}".format(
-            infile, inclusion_region, outfile
-        )
-        subprocess.check_call(cmd_line, shell=True)
+        _write_filtered_vcf(infile, outfile, inclusion_region=inclusion_region)
 
     else:
         outfile = None
@@ -74,10 +93,7 @@ def bed_exclude(infile, exclusion_region, outfile):
     assert infile != outfile
 
     if exclusion_region:
-        cmd_line = "bedtools intersect -header -a {} -b {} -v | uniq > {}".format(
-            infile, exclusion_region, outfile
-        )
-        subprocess.check_call(cmd_line, shell=True)
+        _write_filtered_vcf(infile, outfile, exclusion_region=exclusion_region)
 
     else:
         outfile = None
@@ -86,51 +102,106 @@ def bed_exclude(infile, exclusion_region, outfile):
 
 
 def bed_intersector(infile, outfile, inclusion_region=None, exclusion_region=None):
+    """
+    Write the VCF lines of infile that are in the inclusion region (if any) and
+    not in the exclusion region (if any) into outfile, in a single pass.
+    """
     assert infile != outfile
-    from shutil import copyfile
-
-    # Get the input file name minus the extention, and also get the extension
-    infile_noext = re.sub(r"\.\w+$", "", infile)
-    file_ext = re.search(r"\.\w+$", infile).group()
-
-    temp_files = []
-
-    if inclusion_region:
-        included_temp_file = infile_noext + uuid.uuid4().hex + file_ext
+    return _write_filtered_vcf(infile, outfile, inclusion_region, exclusion_region)
 
-        cmd_line = "bedtools intersect -header -a {} -b {} | uniq > {}".format(
-            infile, inclusion_region, included_temp_file
-        )
-        subprocess.check_call(cmd_line, shell=True)
 
-        infile = included_temp_file
-        temp_files.append(included_temp_file)
-
-    if exclusion_region:
-        cmd_line = "bedtools intersect -header -a {} -b {} -v | uniq > {}".format(
-            infile, exclusion_region, outfile
-        )
-        subprocess.check_call(cmd_line, shell=True)
-
-    if inclusion_region and not exclusion_region:
-        copyfile(included_temp_file, outfile)
-
-    elif not (inclusion_region or exclusion_region):
-        if infile.endswith(".gz"):
-            cmd_line = f"gunzip -c {infile} > {outfile}"
-            subprocess.check_call(cmd_line, shell=True)
-
-        else:
-            copyfile(infile, outfile)
-
-    for file_i in temp_files:
-        os.remove(file_i)
-
-    return outfile
+def partition_vcf(
+    infile: str, inclusion_regions: list[str], outfiles: list[str]
+) -> list[str]:
+    """
+    Write the lines of a VCF file that overlap each of the bed files into its
+    own VCF file, in a single pass over the VCF file. A line overlapping more
+    than one bed file is written into all of them. Every output VCF file has
+    the whole header. Up to PARTITION_MAX_OPEN_FILES output files are open at
+    a time, and the least recently written one is closed (and appended to
+    later, if need be) to open another.
+
+    Args:
+        infile: input VCF file (may be gzipped)
+        inclusion_regions: bed files, e.g., of the work units of a parallel run
+        outfiles: output VCF file of each bed file
+
+    Returns:
+        outfiles
+    """
+    assert len(inclusion_regions) == len(outfiles)
+
+    # For each contig, the intervals sorted by start, and the largest end of the
+    # intervals up to each one
+    intervals: dict[str, list[tuple[int, int, int]]] = {}
+    for ith_bed, bed_file in enumerate(inclusion_regions):
+        for contig, start, end in read_bed_intervals(bed_file):
+            intervals.setdefault(contig, []).append((start, end, ith_bed))
+    starts, max_ends = {}, {}
+    for contig, contig_intervals in intervals.items():
+        contig_intervals.sort()
+        starts[contig] = [start for start, _, _ in contig_intervals]
+        max_ends[contig] = []
+        max_end = 0
+        for _, end, _ in contig_intervals:
+            max_end = max(max_end, end)
+            max_ends[contig].append(max_end)
+
+    header_lines: list[str] = []
+    # Output files opened before, and those open now, least recently used first
+    started = [False for _ in outfiles]
+    outs: OrderedDict = OrderedDict()
+
+    def output_handle(ith_bed: int):
+        if ith_bed in outs:
+            outs.move_to_end(ith_bed)
+            return outs[ith_bed]
+        if len(outs) >= PARTITION_MAX_OPEN_FILES:
+            outs.popitem(last=False)[1].close()
+        out = open(outfiles[ith_bed], "a" if started[ith_bed] else "w")
+        if not started[ith_bed]:
+            out.writelines(header_lines)
+            started[ith_bed] = True
+        outs[ith_bed] = out
+        return out
+
+    try:
+        with genome.open_textfile(infile) as vcf:
+            for line_i in vcf:
+                if line_i.startswith("#"):
+                    header_lines.append(line_i)
+                    continue
+                if not line_i.strip():
+                    continue
+
+                contig, start, end = vcf_line_span(line_i)
+                if contig not in intervals:
+                    continue
+                overlapped = set()
+                j = bisect.bisect_left(starts[contig], end) - 1
+                while j >= 0 and max_ends[contig][j] > start:
+                    interval_start, interval_end, ith_bed = intervals[contig][j]
+                    if interval_end > start and interval_start < end:
+                        overlapped.add(ith_bed)
+                    j -= 1
+                for ith_bed in sorted(overlapped):
+                    output_handle(ith_bed).write(line_i)
+    finally:
+        for out in outs.values():
+            out.close()
+
+    # Output files without any variant lines
+    for outfile, outfile_started in zip(outfiles, started):
+        if not outfile_started:
+            with open(outfile, "w") as out:
+                out.writelines(header_lines)
+
+    return outfiles
 
 
 # Use somaticseq/somaticseq/utilities/vcfsorter.pl fa.dict unsorted.vcf > sorted.vcf
 def vcfsorter(ref, vcfin, vcfout):
-    fai = ref + ".fai"
-    cmd_line = f"bedtools sort -faidx {fai} -header -i {vcfin} > {vcfout}"
-    subprocess.check_call(cmd_line, shell=True)
+    """Sort a VCF file in the order of the contigs in the .fai of ref"""
+    contig_order = genome.faiordict2contigorder(ref + ".fai", "fai")
+    with genome.open_textfile(vcfin) as vcf, open(vcfout, "w") as out:
+        out.writelines(sort_vcf_lines(vcf, contig_order))
@@ -0,0 +1,88 @@
+import pytest
+
+from somaticseq.feature_manifest import (
+    read_feature_manifest,
+    read_feature_manifests,
+    skipped_features,
+)
+
+OPTIONAL_FEATURES = ["SOR", "MQ0", "Seq_Complexity_Span", "tBAM_Sby_Score"]
+
+
+@pytest.fixture
+def manifest_file(tmp_path):
+    manifest = tmp_path / "features.txt"
+    manifest.write_text(
+        "# Features of the SNV classifier\n"
+        "\n"
+        "SOR\n"
+        "  MQ0  \n"
+        "# Seq_Complexity_Span\n"
+        "if_dbsnp\n"
+    )
+    return str(manifest)
+
+
+def test_read_feature_manifest_of_text_file(manifest_file):
+    """Blank lines and lines starting with # are ignored"""
+    assert read_feature_manifest(manifest_file) == {"SOR", "MQ0", "if_dbsnp"}
+
+
+def test_read_feature_manifests_is_union(tmp_path, manifest_file):
+    other_manifest = tmp_path / "indel_features.txt"
+    other_manifest.write_text("tBAM_Sby_Score\nSOR\n")
+    assert read_feature_manifests(manifest_file) == {"SOR", "MQ0", "if_dbsnp"}
+    assert read_feature_manifests([manifest_file, str(other_manifest)]) == {
+        "SOR",
+        "MQ0",
+        "if_dbsnp",
+        "tBAM_Sby_Score",
+    }
+
+
+def test_read_feature_manifest_of_xgboost_classifier(tmp_path):
+    np = pytest.importorskip("numpy")
+    xgb = pytest.importorskip("xgboost")
+    features = ["SOR", "MQ0", "if_dbsnp"]
+    data = xgb.DMatrix(
+        np.arange(30, dtype=float).reshape(10, 3),
+        label=[0, 1] * 5,
+        feature_names=features,
+    )
+    classifier = str(tmp_path / "classifier.json")
+    xgb.train({"max_depth": 2}, data, num_boost_round=2).save_model(classifier)
+    assert read_feature_manifest(classifier) == set(features)
+
+
+def test_skipped_features():
+    assert skipped_features(OPTIONAL_FEATURES) == set()
+    assert skipped_features(OPTIONAL_FEATURES, None) == set()
+    assert skipped_features(OPTIONAL_FEATURES, {"SOR", "if_dbsnp"}) == {
+        "MQ0",
+        "Seq_Complexity_Span",
+        "tBAM_Sby_Score",
+    }
+    assert skipped_features(OPTIONAL_FEATURES, set()) == set(OPTIONAL_FEATURES)
+
+
+def test_classifier_feature_manifest():
+    pytest.importorskip("pandas")
+    from somaticseq.run_somaticseq import classifier_feature_manifest
+
+    assert classifier_feature_manifest("snv.json", "indel.json") is None
+    assert classifier_feature_manifest(
+        "snv.json", "indel.json", "xgboost", skip_unused_features=True
+    ) == ["snv.json", "indel.json"]
+    # Consensus mode of INDELs, or ada classifiers: all features
+    assert (
+        classifier_feature_manifest(
+            "snv.json", None, "xgboost", skip_unused_features=True
+        )
+        is None
+    )
+    assert (
+        classifier_feature_manifest(
+            "snv.RData", "indel.RData", "ada", skip_unused_features=True
+        )
+        is None
+    )
@@ -0,0 +1,122 @@
+import logging
+
+import pysam
+import pytest
+
+from somaticseq.vcf_modifier import getUniqueVcfPositions
+
+VCF_HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+CALLER_VARIANTS = {
+    "caller_1": [
+        ("chr2", 100, "A", "G"),
+        ("chr2", 150, "C", "T,G"),
+        ("chr10", 5, "G", "A"),
+        ("chr1", 20, "T", "C"),
+        ("chr1", 30, "TA", "T"),
+    ],
+    "caller_2": [
+        ("chr2", 100, "A", "G"),
+        ("chr2", 100, "A", "C"),
+        ("chr2", 150, "C", "G"),
+        ("chr10", 5, "G", "A/C"),
+        ("chr1", 30, "TA", "T"),
+        ("chrUn", 1, "A", "T"),
+    ],
+    "caller_3": [],
+}
+
+
+def _write_vcf(vcf_file, variants) -> str:
+    with open(vcf_file, "w") as vcf:
+        vcf.write(VCF_HEADER)
+        for contig, position, ref, alt in variants:
+            vcf.write(f"{contig}\t{position}\t.\t{ref}\t{alt}\t.\tPASS\t.\n")
+    return str(vcf_file)
+
+
+def _read_variants(vcf_file) -> list[tuple[str, int, str, str]]:
+    with open(vcf_file) as vcf:
+        lines = vcf.readlines()
+    assert lines[:2] == VCF_HEADER.splitlines(keepends=True)
+    return [
+        (item[0], int(item[1]), item[3], item[4])
+        for item in (line_i.split("\t") for line_i in lines[2:])
+    ]
+
+
+@pytest.fixture
+def reference(tmp_path):
+    ref_fa = tmp_path / "ref.fa"
+    ref_fa.write_text(
+        "".join(f">{contig}\nACGT\n" for contig in ("chr2", "chr10", "chr1"))
+    )
+    pysam.faidx(str(ref_fa))
+    return str(ref_fa)
+
+
+def _unique_variants(variant_lists, contig_order) -> list[tuple[str, int, str, str]]:
+    """Every ALT allele of the variants once, sorted as combine sorts them"""
+    variants = {
+        (contig, position, ref, alt_i)
+        for variants in variant_lists
+        for contig, position, ref, alt in variants
+        for alt_i in alt.replace("/", ",").split(",")
+    }
+    return sorted(
+        variants,
+        key=lambda variant: (
+            contig_order.get(variant[0], len(contig_order)),
+            *variant,
+        ),
+    )
+
+
+def test_combine_in_contig_order_of_reference(tmp_path, reference):
+    infiles = [
+        _write_vcf(tmp_path / f"{caller}.vcf", variants)
+        for caller, variants in CALLER_VARIANTS.items()
+    ]
+    outfile = tmp_path / "combined.vcf"
+    getUniqueVcfPositions.combine(infiles, str(outfile), reference)
+    combined = _read_variants(outfile)
+    assert combined == _unique_variants(
+        CALLER_VARIANTS.values(), {"chr2": 0, "chr10": 1, "chr1": 2}
+    )
+    assert combined[:4] == [
+        ("chr2", 100, "A", "C"),
+        ("chr2", 100, "A", "G"),
+        ("chr2", 150, "C", "G"),
+        ("chr2", 150, "C", "T"),
+    ]
+    assert combined[-1] == ("chrUn", 1, "A", "T")
+
+
+def test_combine_without_reference_sorts_contigs_by_name(tmp_path):
+    variants_by_name = {
+        caller: sorted(variants) for caller, variants in CALLER_VARIANTS.items()
+    }
+    infiles = [
+        _write_vcf(tmp_path / f"{caller}.vcf", variants)
+        for caller, variants in variants_by_name.items()
+    ]
+    outfile = tmp_path / "combined.vcf"
+    getUniqueVcfPositions.combine(infiles, str(outfile))
+    assert _read_variants(outfile) == _unique_variants(variants_by_name.values(), {})
+
+
+def test_combine_unsorted_vcf(tmp_path, reference, caplog):
+    unsorted_variants = dict(CALLER_VARIANTS)
+    unsorted_variants["caller_2"] = CALLER_VARIANTS["caller_2"][::-1]
+    infiles = [
+        _write_vcf(tmp_path / f"{caller}.vcf", variants)
+        for caller, variants in unsorted_variants.items()
+    ]
+    outfile = tmp_path / "combined.vcf"
+    with caplog.at_level(logging.WARNING):
+        getUniqueVcfPositions.combine(infiles, str(outfile), reference)
+    assert _read_variants(outfile) == _unique_variants(
+        CALLER_VARIANTS.values(), {"chr2": 0, "chr10": 1, "chr1": 2}
+    )
+    assert f"{infiles[1]} is not sorted." in caplog.text
+    assert f"{infiles[0]} is not sorted." not in caplog.text
@@ -0,0 +1,168 @@
+import os
+
+import pytest
+
+from somaticseq.genomic_file_parsers.intervals import (
+    IntervalSet,
+    filter_vcf_lines,
+    read_bed_intervals,
+    sort_vcf_lines,
+    vcf_line_span,
+)
+from somaticseq.utilities.bedFileHandler import BedFile
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data", "intervals")
+BED_FILE = os.path.join(DATA_DIR, "regions.bed")
+VCF_FILE = os.path.join(DATA_DIR, "variants.vcf")
+
+
+def _read_vcf() -> tuple[list[str], list[str]]:
+    with open(VCF_FILE) as vcf:
+        lines = vcf.readlines()
+    header = [line_i for line_i in lines if line_i.startswith("#")]
+    variants = [line_i for line_i in lines if not line_i.startswith("#")]
+    return header, variants
+
+
+def _ids(vcf_lines) -> list[str]:
+    return [line_i.split("\t")[2] for line_i in vcf_lines if not line_i.startswith("#")]
+
+
+def test_read_bed_intervals():
+    assert list(read_bed_intervals(BED_FILE)) == [
+        ("1", 100, 200),
+        ("1", 200, 300),
+        ("1", 500, 600),
+        ("2", 0, 50),
+    ]
+
+
+@pytest.mark.parametrize(
+    "vcf_line, span",
+    [
+        ("1\t150\t.\tC\tT\t.\t.\t.\n", ("1", 149, 150)),
+        ("1\t96\t.\tACGTAC\tA\t.\t.\t.\n", ("1", 95, 101)),
+        ("1\t96\t.\tA\tACGT\t.\t.\t.\n", ("1", 95, 96)),
+        ("1\t400\t.\tN\t<DEL>\t.\t.\tSVTYPE=DEL;END=520\n", ("1", 399, 520)),
+        ("1\t400\t.\tN\t<DEL>\t.\t.\tEND=520;SVTYPE=DEL\n", ("1", 399, 520)),
+        ("1\t450\t.\tN\t<DUP>\t.\t.\tSVTYPE=DUP\n", ("1", 449, 450)),
+        ("1\t450\t.\tN\t<DUP>\t.\t.\tSV_END=600\n", ("1", 449, 450)),
+    ],
+)
+def test_vcf_line_span(vcf_line, span):
+    assert vcf_line_span(vcf_line) == span
+
+
+def test_interval_set_merges_overlapping_and_abutting_intervals():
+    intervals = IntervalSet(
+        [("1", 200, 300), ("1", 100, 200), ("1", 150, 160), ("1", 500, 600)]
+    )
+    assert list(intervals.starts["1"]) == [100, 500]
+    assert list(intervals.ends["1"]) == [300, 600]
+
+
+@pytest.mark.parametrize(
+    "contig, start, end, overlaps",
+    [
+        ("1", 99, 100, False),
+        ("1", 99, 101, True),
+        ("1", 250, 251, True),
+        ("1", 299, 300, True),
+        ("1", 300, 500, False),
+        ("1", 300, 501, True),
+        ("1", 0, 1000, True),
+        ("2", 49, 50, True),
+        ("2", 50, 51, False),
+        ("3", 0, 1000, False),
+    ],
+)
+def test_interval_set_overlaps(contig, start, end, overlaps):
+    assert IntervalSet.from_bed(BED_FILE).overlaps(contig, start, end) is overlaps
+
+
+@pytest.mark.parametrize(
+    "position, in_region",
+    [(100, False), (101, True), (200, True), (201, True), (300, True), (301, False)],
+)
+def test_bed_file_in_region_is_1_based(position, in_region):
+    bed = BedFile(BED_FILE)
+    assert bed.inRegion("1", position) is in_region
+    assert bed.intervals.contains("1", position) is in_region
+    assert bed.inRegion("3", position) is False
+
+
+def test_filter_vcf_lines_inclusion():
+    header, variants = _read_vcf()
+    filtered = list(filter_vcf_lines(header + variants, IntervalSet.from_bed(BED_FILE)))
+    assert filtered[: len(header)] == header
+    assert _ids(filtered) == [
+        "del_into_region",
+        "last_base",
+        "sv_into_region",
+        "other_contig",
+        "inside",
+    ]
+
+
+def test_filter_vcf_lines_exclusion():
+    """
+    Like bedtools intersect -v | uniq, a line that is the same as the one
+    before it is dropped, but not one that is the same as an earlier line.
+    """
+    header, variants = _read_vcf()
+    filtered = list(
+        filter_vcf_lines(header + variants, exclusion=IntervalSet.from_bed(BED_FILE))
+    )
+    assert filtered[: len(header)] == header
+    assert _ids(filtered) == [
+        "del_before_region",
+        "after_region",
+        "sv_before_region",
+        "sv_no_end",
+        "after_region",
+        "contig_not_in_bed",
+    ]
+
+
+def test_filter_vcf_lines_inclusion_and_exclusion():
+    header, variants = _read_vcf()
+    exclusion = IntervalSet([("1", 140, 160), ("2", 0, 100)])
+    filtered = filter_vcf_lines(
+        header + variants, IntervalSet.from_bed(BED_FILE), exclusion
+    )
+    assert _ids(filtered) == ["del_into_region", "last_base", "sv_into_region"]
+
+
+def test_filter_vcf_lines_without_intervals_only_drops_repeated_lines():
+    header, variants = _read_vcf()
+    filtered = list(filter_vcf_lines(header + variants))
+    assert filtered == header + variants[:4] + variants[5:]
+
+
+def test_sort_vcf_lines():
+    """
+    Contigs in the order of the .fai, then those not in it in the order they
+    came in, and lines of the same coordinate in the order they came in.
+    """
+    header, variants = _read_vcf()
+    sorted_lines = list(sort_vcf_lines(header + variants, {"2": 0}))
+    assert sorted_lines[: len(header)] == header
+    assert _ids(sorted_lines) == [
+        "other_contig",
+        "del_before_region",
+        "del_into_region",
+        "inside",
+        "last_base",
+        "after_region",
+        "after_region",
+        "after_region",
+        "sv_into_region",
+        "sv_before_region",
+        "sv_no_end",
+        "contig_not_in_bed",
+    ]
+    assert _ids(sort_vcf_lines(variants, {"3": 0, "2": 1, "1": 2}))[:3] == [
+        "contig_not_in_bed",
+        "other_contig",
+        "del_before_region",
+    ]
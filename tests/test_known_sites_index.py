@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from somaticseq.genomic_file_parsers import known_sites_index
+
+VCF_HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+@pytest.fixture
+def known_sites_vcf(tmp_path):
+    """Unsorted VCF file, with several records at some coordinates"""
+    rng = random.Random(0)
+    lines = [
+        f"{rng.choice(['1', '2', 'X'])}\t{rng.randint(1, 300)}\trs{i}\tA\t"
+        f"{rng.choice(['C', 'G', 'T', 'C,G'])}\t.\tPASS\t"
+        f"COMMON={rng.randint(0, 1)};CAF=0.5;SNP\n"
+        for i in range(1000)
+    ]
+    vcf_file = tmp_path / "known_sites.vcf"
+    vcf_file.write_text(VCF_HEADER + "".join(lines))
+    return str(vcf_file), lines
+
+
+@pytest.mark.parametrize(
+    "records_per_chunk, merge_block_size", [(2**20, 2**12), (64, 5)]
+)
+def test_index_of_unsorted_vcf(
+    tmp_path, monkeypatch, known_sites_vcf, records_per_chunk, merge_block_size
+):
+    monkeypatch.setattr(known_sites_index, "RECORDS_PER_CHUNK", records_per_chunk)
+    monkeypatch.setattr(known_sites_index, "MERGE_BLOCK_SIZE", merge_block_size)
+    vcf_file, lines = known_sites_vcf
+    index_file = str(tmp_path / "known_sites.idx")
+    known_sites_index.build_known_sites_index(vcf_file, index_file)
+    assert known_sites_index.is_known_sites_index(index_file)
+    assert not known_sites_index.is_known_sites_index(vcf_file)
+
+    index = known_sites_index.KnownSitesIndex(index_file)
+    assert len(index) == len(lines)
+    assert (index.keys[1:] >= index.keys[:-1]).all()
+
+    records_by_site = {}
+    for line_i in lines:
+        contig, position, variant_id, ref, alt = line_i.split("\t")[:5]
+        records_by_site.setdefault((contig, int(position)), []).append(
+            (variant_id, ref, alt)
+        )
+    for site, records in records_by_site.items():
+        found, variants = index.variants_at(site)
+        assert found
+        expected = {}
+        # The later record of the same variant takes its place, as in the VCF
+        for variant_id, ref, alt in records:
+            for alt_i in alt.split(","):
+                expected[(site, ref, alt_i)] = variant_id
+        assert {
+            variant: vcf_i.identifier for variant, vcf_i in variants.items()
+        } == expected
+        assert all(
+            vcf_i.info == "COMMON=" + vcf_i.get_info_value("COMMON") + ";SNP"
+            for vcf_i in variants.values()
+        )
+    assert index.variants_at(("1", 301)) == (False, {})
+    assert index.variants_at(("Y", 1)) == (False, {})
+    index.close()
+
+
+def test_index_is_the_same_for_any_chunk_size(tmp_path, monkeypatch, known_sites_vcf):
+    vcf_file, _ = known_sites_vcf
+    index_files = []
+    for records_per_chunk in (2**20, 100, 1):
+        monkeypatch.setattr(known_sites_index, "RECORDS_PER_CHUNK", records_per_chunk)
+        index_file = tmp_path / f"known_sites.{records_per_chunk}.idx"
+        known_sites_index.build_known_sites_index(vcf_file, str(index_file))
+        index_files.append(index_file.read_bytes())
+    assert index_files[0] == index_files[1] == index_files[2]
@@ -0,0 +1,80 @@
+import os
+
+import pysam
+
+from somaticseq import pileup_scanner
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "example")
+REF_FA = os.path.join(EXAMPLE_DIR, "tiny.fa")
+
+
+def _write_bam(
+    bam_file: str, reads: list[tuple[int, str, list[tuple[int, int]], int]]
+) -> None:
+    """(0-based start, sequence, CIGAR, flag) of every read"""
+    with pysam.FastaFile(REF_FA) as ref_fh:
+        header = {
+            "HD": {"VN": "1.6", "SO": "coordinate"},
+            "SQ": [
+                {"SN": contig, "LN": length}
+                for contig, length in zip(ref_fh.references, ref_fh.lengths)
+            ],
+        }
+    with pysam.AlignmentFile(bam_file, "wb", header=header) as bam:
+        for i, (start, seq, cigar, flag) in enumerate(sorted(reads)):
+            read = pysam.AlignedSegment()
+            read.query_name = f"read{i}"
+            read.query_sequence = seq
+            read.flag = flag
+            read.reference_id = 0
+            read.reference_start = start
+            read.mapping_quality = 60
+            read.cigartuples = cigar
+            read.query_qualities = pysam.qualitystring_to_array("I" * len(seq))
+            bam.write(read)
+    pysam.index(bam_file)
+
+
+def _scan(bam_file: str, start: int, end: int, min_alt_reads: int = 1) -> list:
+    with pysam.AlignmentFile(bam_file) as bam, pysam.FastaFile(REF_FA) as ref_fa:
+        return list(
+            pileup_scanner.pileup_candidates(
+                bam, ref_fa, "1", start, end, min_alt_reads, min_mq=1, min_bq=5
+            )
+        )
+
+
+def _alt_base(ref_base: str) -> str:
+    return "C" if ref_base.upper() == "A" else "A"
+
+
+def test_spliced_reads_are_not_alt_alleles(tmp_path):
+    with pysam.FastaFile(REF_FA) as ref_fh:
+        ref = ref_fh.fetch("1", 1000, 1090).upper()
+    # 20M50N20M, with a SNV in the second exon of one of them
+    seq = ref[:20] + ref[70:]
+    snv_seq = seq[:30] + _alt_base(seq[30]) + seq[31:]
+    cigar = [(0, 20), (3, 50), (0, 20)]
+    bam_file = str(tmp_path / "spliced.bam")
+    _write_bam(
+        bam_file,
+        [(1000, seq, cigar, 0), (1000, seq, cigar, 16), (1000, snv_seq, cigar, 0)],
+    )
+    assert _scan(bam_file, 1000, 1090) == [(1081, ref[80], _alt_base(ref[80]), 1)]
+
+
+def test_filtered_reads_are_not_counted(tmp_path):
+    with pysam.FastaFile(REF_FA) as ref_fh:
+        ref = ref_fh.fetch("1", 2000, 2100).upper()
+    alt = _alt_base(ref[50])
+    snv_seq = ref[:50] + alt + ref[51:]
+    bam_file = str(tmp_path / "flags.bam")
+    # Unfiltered, duplicate, secondary, QC-fail, and supplementary reads
+    _write_bam(
+        bam_file,
+        [
+            (2000, snv_seq, [(0, 100)], flag)
+            for flag in (0, 0, 0x400, 0x100, 0x200, 0x800)
+        ],
+    )
+    assert _scan(bam_file, 2040, 2060) == [(2051, ref[50], alt, 2)]
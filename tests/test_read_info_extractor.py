@@ -0,0 +1,188 @@
+import pysam
+import pytest
+
+from somaticseq.genomic_file_parsers.read_info_extractor import (
+    AlignmentType,
+    CigarIndex,
+    ParsedRead,
+    SequencingCall,
+    alignment_in_read_for_coordinate,
+    inf,
+    nan,
+)
+
+REFERENCE_START = 100
+
+CIGARS = [
+    "20M",
+    "5S15M",
+    "15M5S",
+    "3H5S10M2S4H",
+    "10=1X9=",
+    "8M2I10M",
+    "8M2D10M",
+    "1M1D18M",
+    "18M1I1M",
+    "5M1I1D5M",
+    "5M1D1I5M",
+    "3M1I1M1D2M2I1M3D3M",
+    "6M200N14M",
+    "4M1D2M100N5M1I3M",
+    "2S4M1I2S",
+    "1M",
+    "1M19I",
+    "10I10M",
+    "10M10I",
+]
+# pysam gives padding query positions beyond the query sequence, so the
+# aligned pairs walk raises an IndexError on such reads
+PADDED_CIGARS = ["5M2P5M", "2P8M"]
+
+
+def _make_read(cigarstring: str) -> pysam.AlignedSegment:
+    header = pysam.AlignmentHeader.from_dict(
+        {"HD": {"VN": "1.6"}, "SQ": [{"SN": "chr1", "LN": 10_000}]}
+    )
+    read = pysam.AlignedSegment(header)
+    read.query_name = "read"
+    read.reference_id = 0
+    read.reference_start = REFERENCE_START
+    read.cigarstring = cigarstring
+    query_length = read.infer_query_length()
+    read.query_sequence = ("ACGT" * query_length)[:query_length]
+    read.query_qualities = pysam.qualitystring_to_array("I" * query_length)
+    return read
+
+
+def _alignment_from_aligned_pairs(
+    read: pysam.AlignedSegment, coordinate: int, win_size: int = 3
+) -> SequencingCall:
+    """
+    The per-read walk over read.get_aligned_pairs() that CigarIndex replaced
+    """
+    aligned_coordinates = read.get_reference_positions()
+    start, stop = aligned_coordinates[0], aligned_coordinates[-1]
+    if not (start <= coordinate <= stop):
+        return SequencingCall(None, None, None, None, None)
+
+    aligned_pairs = read.get_aligned_pairs()
+    for i, aligned_pair in enumerate(aligned_pairs):
+        if aligned_pair[1] == coordinate:
+            ith_base = aligned_pair[0]
+            ith_aligned_pair = i
+            break
+
+    if ith_base is None:
+        return SequencingCall(AlignmentType.unknown, ith_base, None, None, None)
+
+    base_at_coordinate = read.query_sequence[ith_base]
+    if ith_aligned_pair == len(aligned_pairs) - 1:
+        return SequencingCall(
+            AlignmentType.match, ith_base, base_at_coordinate, nan, None
+        )
+
+    indel_length = 0
+    if (
+        aligned_pairs[ith_aligned_pair + 1][0] == ith_base + 1
+        and aligned_pairs[ith_aligned_pair + 1][1] == coordinate + 1
+    ):
+        vtype = AlignmentType.match
+    elif (
+        aligned_pairs[ith_aligned_pair + 1][0] is None
+        and aligned_pairs[ith_aligned_pair + 1][1] == coordinate + 1
+    ):
+        vtype = AlignmentType.deletion
+        for align_j in aligned_pairs[ith_aligned_pair + 1 : :]:
+            if align_j[0] is None:
+                indel_length -= 1
+            else:
+                break
+    elif (
+        aligned_pairs[ith_aligned_pair + 1][0] == ith_base + 1
+        and aligned_pairs[ith_aligned_pair + 1][1] is None
+    ):
+        vtype = AlignmentType.insertion
+        for align_j in aligned_pairs[ith_aligned_pair + 1 : :]:
+            if align_j[1] is None:
+                indel_length += 1
+            else:
+                break
+
+    right_indel_flanks = inf
+    left_indel_flanks = inf
+    left_side_start = ith_aligned_pair - 1
+    right_side_start = ith_aligned_pair + abs(indel_length) + 1
+    for step_right_i in range(min(win_size, len(aligned_pairs) - right_side_start - 1)):
+        j = right_side_start + step_right_i
+        if aligned_pairs[j + 1][1] is None or aligned_pairs[j + 1][0] is None:
+            right_indel_flanks = step_right_i + 1
+            break
+    for step_left_i in range(min(win_size, left_side_start)):
+        j = left_side_start - step_left_i
+        if aligned_pairs[j][1] is None or aligned_pairs[j][0] is None:
+            left_indel_flanks = step_left_i + 1
+            break
+
+    return SequencingCall(
+        vtype,
+        ith_base,
+        base_at_coordinate,
+        indel_length,
+        min(left_indel_flanks, right_indel_flanks),
+    )
+
+
+@pytest.mark.parametrize("cigarstring", CIGARS + PADDED_CIGARS)
+def test_cigar_index_matches_aligned_pairs(cigarstring):
+    read = _make_read(cigarstring)
+    aligned_pairs = read.get_aligned_pairs()
+    cigar_index = CigarIndex.from_read(read)
+    assert cigar_index.num_pairs == len(aligned_pairs)
+    for pair_i, aligned_pair in enumerate(aligned_pairs):
+        assert cigar_index.aligned_pair(pair_i) == aligned_pair
+        assert cigar_index.is_indel_pair(pair_i) == (None in aligned_pair)
+
+    reference_positions = read.get_reference_positions()
+    assert cigar_index.first_aligned_coordinate == reference_positions[0]
+    assert cigar_index.last_aligned_coordinate == reference_positions[-1]
+    for coordinate in range(REFERENCE_START - 2, read.reference_end + 2):
+        pair_indices = [
+            pair_i
+            for pair_i, (_, coordinate_i) in enumerate(aligned_pairs)
+            if coordinate_i == coordinate
+        ]
+        assert cigar_index.pair_index_of_coordinate(coordinate) == (
+            pair_indices[0] if pair_indices else None
+        )
+
+
+@pytest.mark.parametrize("win_size", [1, 3, 5])
+@pytest.mark.parametrize("cigarstring", CIGARS)
+def test_alignment_in_read_matches_aligned_pairs_walk(cigarstring, win_size):
+    """
+    Every coordinate around the read resolves to the same SequencingCall,
+    with or without a ParsedRead, as with the walk over its aligned pairs
+    """
+    read = _make_read(cigarstring)
+    parsed_read = ParsedRead(read)
+    for coordinate in range(REFERENCE_START - 2, read.reference_end + 2):
+        expected = str(_alignment_from_aligned_pairs(read, coordinate, win_size))
+        assert str(alignment_in_read_for_coordinate(read, coordinate, win_size)) == (
+            expected
+        )
+        assert (
+            str(
+                alignment_in_read_for_coordinate(
+                    read, coordinate, win_size, parsed_read
+                )
+            )
+            == expected
+        )
+
+
+def test_alignment_in_read_without_aligned_bases():
+    """The aligned pairs walk raised an IndexError on such reads"""
+    read = _make_read("5S")
+    assert alignment_in_read_for_coordinate(read, REFERENCE_START) == SequencingCall(
+        None, None, None, None, None
+    )
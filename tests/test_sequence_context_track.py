@@ -0,0 +1,104 @@
+import os
+import random
+
+import pysam
+import pytest
+
+from somaticseq import sequence_context_track
+from somaticseq.sequencing_features import count_distinct_substrings
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "example")
+REF_FA = os.path.join(EXAMPLE_DIR, "tiny.fa")
+WINDOW_LENGTH = sequence_context_track.CONTEXT_WINDOW_LENGTH
+MAX_SUBSTRING_LENGTH = sequence_context_track.MAX_SUBSTRING_LENGTH
+
+
+def _random_sequence(length: int, seed: int, other_bases: str = "") -> str:
+    rng = random.Random(seed)
+    return "".join(
+        (
+            rng.choice(other_bases)
+            if other_bases and rng.random() < 0.01
+            else rng.choice("ACGT")
+        )
+        for _ in range(length)
+    )
+
+
+@pytest.mark.parametrize(
+    "sequence",
+    [
+        _random_sequence(2000, 0),
+        _random_sequence(2000, 1, other_bases="acgtNR"),
+        "A" * 150 + "AC" * 100 + "ACGTTGCA" * 30,
+    ],
+)
+def test_distinct_substring_counts(sequence):
+    counts = sequence_context_track.distinct_substring_counts(
+        sequence, WINDOW_LENGTH, MAX_SUBSTRING_LENGTH
+    )
+    assert len(counts) == len(sequence) - WINDOW_LENGTH + 1
+    for i, count in enumerate(counts):
+        window = sequence[i : i + WINDOW_LENGTH].upper()
+        if set(window) - set("ACGT"):
+            assert count == 0
+        else:
+            assert count == count_distinct_substrings(window, MAX_SUBSTRING_LENGTH)
+
+
+def test_window_segments():
+    assert sequence_context_track.window_segments(
+        [(5000, 6000), (1000, 5000), (100000, 100010), (299990, 300000)], 300000
+    ) == [(919, 6001), (99919, 100011), (299909, 299920)]
+
+
+@pytest.mark.parametrize("with_bed", [False, True])
+def test_track_matches_windows_of_reference(tmp_path, with_bed):
+    bed_file = None
+    regions = [(1000, 1500), (1400, 2000), (299950, 300000)]
+    if with_bed:
+        bed_file = str(tmp_path / "regions.bed")
+        with open(bed_file, "w") as bed:
+            for start, end in regions:
+                bed.write(f"1\t{start}\t{end}\n")
+    track_directory = sequence_context_track.build_context_track(
+        REF_FA, str(tmp_path / "track"), bed_file
+    )
+    sequence_context_track.check_track_reference(track_directory, REF_FA)
+    track = sequence_context_track.SequenceContextTrack(track_directory)
+    with pysam.FastaFile(REF_FA) as ref_fh:
+        ref = ref_fh.fetch("1").upper()
+
+    for start in [*range(850, 2150), *range(299800, len(ref))]:
+        in_track = start <= len(ref) - WINDOW_LENGTH and (
+            not with_bed
+            or any(
+                region_start - WINDOW_LENGTH <= start <= region_end
+                for region_start, region_end in regions
+            )
+        )
+        count = track.num_distinct_substrings("1", start)
+        if in_track:
+            assert count == count_distinct_substrings(
+                ref[start : start + WINDOW_LENGTH], MAX_SUBSTRING_LENGTH
+            )
+        else:
+            assert count == 0
+    assert track.num_distinct_substrings("2", 1000) == 0
+
+
+def test_track_of_another_reference(tmp_path):
+    with pysam.FastaFile(REF_FA) as ref_fh:
+        ref = ref_fh.fetch("1")
+    other_fa = str(tmp_path / "other.fa")
+    with open(other_fa, "w") as fasta:
+        fasta.write(">1\n" + ref[:-1000] + "\n")
+    pysam.faidx(other_fa)
+    bed_file = str(tmp_path / "regions.bed")
+    with open(bed_file, "w") as bed:
+        bed.write("1\t1000\t2000\n")
+    track_directory = sequence_context_track.build_context_track(
+        REF_FA, str(tmp_path / "track"), bed_file
+    )
+    with pytest.raises(ValueError):
+        sequence_context_track.check_track_reference(track_directory, other_fa)
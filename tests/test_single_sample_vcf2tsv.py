@@ -0,0 +1,140 @@
+import gzip
+import os
+import random
+
+import pysam
+import pytest
+
+from somaticseq import single_sample_vcf2tsv
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "example")
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+REF_FA = os.path.join(EXAMPLE_DIR, "tiny.fa")
+CONSENSUS_VCFS = {
+    "snv": os.path.join(EXAMPLE_DIR, "paired_example", "Consensus.sSNV.vcf.gz"),
+    "indel": os.path.join(EXAMPLE_DIR, "paired_example", "Consensus.sINDEL.vcf.gz"),
+}
+READ_LENGTH = 100
+
+
+def _read_variants(vcf_file: str) -> dict[int, tuple[str, str]]:
+    """0-based position: (REF, first ALT) of every line of a VCF file"""
+    variants = {}
+    with gzip.open(vcf_file, "rt") as vcf:
+        for line_i in vcf:
+            if line_i.startswith("#"):
+                continue
+            _, position, _, ref, alt = line_i.split("\t")[:5]
+            variants[int(position) - 1] = (ref, alt.split(",")[0])
+    return variants
+
+
+def _write_bam(bam_file: str, vaf: float = 0.4, depth: int = 20) -> None:
+    """
+    Simulate single-end reads over the example reference, with the example
+    consensus variants in a fraction (vaf) of the reads covering them.
+    """
+    rng = random.Random(1)
+    with pysam.FastaFile(REF_FA) as ref_fh:
+        contig = ref_fh.references[0]
+        ref = ref_fh.fetch(contig)
+    variants = {}
+    for vcf_file in CONSENSUS_VCFS.values():
+        variants.update(_read_variants(vcf_file))
+
+    reads = []
+    for _ in range(len(ref) * depth // READ_LENGTH):
+        start = rng.randrange(0, len(ref) - READ_LENGTH)
+        end = start + READ_LENGTH
+        seq = list(ref[start:end])
+        cigar = [(0, READ_LENGTH)]
+        for variant_start, (ref_allele, alt_allele) in variants.items():
+            if start + 10 <= variant_start < start + 80 and rng.random() < vaf:
+                anchor = variant_start - start + 1
+                if len(ref_allele) == len(alt_allele):
+                    seq[variant_start - start] = alt_allele
+                elif len(ref_allele) > len(alt_allele):
+                    deleted = len(ref_allele) - len(alt_allele)
+                    seq = list(ref[start : variant_start + 1]) + list(
+                        ref[variant_start + 1 + deleted : end + deleted]
+                    )
+                    cigar = [(0, anchor), (2, deleted), (0, READ_LENGTH - anchor)]
+                else:
+                    inserted = alt_allele[1:]
+                    seq = (
+                        list(ref[start : variant_start + 1])
+                        + list(inserted)
+                        + list(ref[variant_start + 1 : end - len(inserted)])
+                    )
+                    cigar = [
+                        (0, anchor),
+                        (1, len(inserted)),
+                        (0, READ_LENGTH - anchor - len(inserted)),
+                    ]
+                break
+        reads.append((start, "".join(seq), cigar))
+    reads.sort()
+
+    header = {
+        "HD": {"VN": "1.6", "SO": "coordinate"},
+        "SQ": [{"SN": contig, "LN": len(ref)}],
+    }
+    with pysam.AlignmentFile(bam_file, "wb", header=header) as bam:
+        for i, (start, seq, cigar) in enumerate(reads):
+            read = pysam.AlignedSegment()
+            read.query_name = f"read{i}"
+            read.query_sequence = seq
+            read.flag = rng.choice([0, 16])
+            read.reference_id = 0
+            read.reference_start = start
+            read.mapping_quality = rng.choice([60, 60, 60, 20, 0])
+            read.cigartuples = cigar
+            read.query_qualities = pysam.qualitystring_to_array(
+                "".join(rng.choice("5?I") for _ in seq)
+            )
+            read.set_tag("NM", rng.randint(0, 3))
+            bam.write(read)
+    pysam.index(bam_file)
+
+
+def _read_tsv(tsv_file: str) -> list[list[str]]:
+    """
+    Rows of a vcf2tsv output, with the IDs (e.g., of dbSNP and the truth) of
+    each row sorted, as they are written in the order of a set.
+    """
+    with open(tsv_file) as tsv:
+        rows = [line_i.rstrip("\n").split("\t") for line_i in tsv]
+    id_column = rows[0].index("ID")
+    for row in rows[1:]:
+        row[id_column] = ";".join(sorted(row[id_column].split(";")))
+    return rows
+
+
+@pytest.fixture(scope="module")
+def tumor_bam(tmp_path_factory):
+    bam_file = str(tmp_path_factory.mktemp("bam") / "tumor.bam")
+    _write_bam(bam_file)
+    return bam_file
+
+
+@pytest.mark.parametrize("variant_type", ["snv", "indel"])
+def test_vcf2tsv_without_manifest_matches_reference_output(
+    tumor_bam, tmp_path, variant_type
+):
+    """
+    Without a feature manifest, every feature is computed, as it was before
+    the optional features could be skipped, i.e., the output is the same as
+    the reference output of that version.
+    """
+    outfile = str(tmp_path / f"{variant_type}.tsv")
+    single_sample_vcf2tsv.vcf2tsv(
+        is_vcf=CONSENSUS_VCFS[variant_type],
+        bam_fn=tumor_bam,
+        truth=os.path.join(EXAMPLE_DIR, "Varsim.somatic.truth.vcf"),
+        dbsnp=os.path.join(EXAMPLE_DIR, "tiny_dbsnp.vcf"),
+        vardict=os.path.join(EXAMPLE_DIR, "tumor_only_example", "VarDict.vcf.gz"),
+        ref_fa=REF_FA,
+        outfile=outfile,
+    )
+    expected_file = os.path.join(DATA_DIR, f"single_sample_vcf2tsv.{variant_type}.tsv")
+    assert _read_tsv(outfile) == _read_tsv(expected_file)
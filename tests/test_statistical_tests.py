@@ -0,0 +1,105 @@
+import math
+import random
+from collections.abc import Sequence
+
+import pytest
+
+from somaticseq.statistical_tests import fisher_exact_pvalue, mannwhitneyu_pvalue
+
+stats = pytest.importorskip("scipy.stats")
+
+ALTERNATIVES = ["two-sided", "less", "greater"]
+
+
+def _random_tables(seed: int, count: int, max_count: int) -> list[tuple]:
+    rng = random.Random(seed)
+    return [
+        (
+            (rng.randint(0, max_count), rng.randint(0, max_count)),
+            (rng.randint(0, max_count), rng.randint(0, max_count)),
+        )
+        for _ in range(count)
+    ]
+
+
+def _random_samples(
+    seed: int, count: int, values: Sequence[int], max_size: int
+) -> list[tuple]:
+    """Pairs of samples of values, so with many ties, like MQ and BQ"""
+    rng = random.Random(seed)
+    return [
+        (
+            [rng.choice(values) for _ in range(rng.randint(1, max_size))],
+            [rng.choice(values) for _ in range(rng.randint(1, max_size))],
+        )
+        for _ in range(count)
+    ]
+
+
+FISHER_TABLES = [
+    ((0, 0), (0, 0)),
+    ((0, 5), (0, 7)),
+    ((3, 0), (4, 0)),
+    ((10, 0), (0, 10)),
+    ((1, 1), (1, 1)),
+    ((20, 3), (18, 2)),
+    ((500, 2), (480, 25)),
+    # Tables of more than FISHER_INTEGER_MAX_TOTAL reads
+    ((900, 12), (850, 40)),
+    ((3000, 1), (2900, 0)),
+    ((1200, 600), (1100, 700)),
+    *_random_tables(0, 30, 30),
+    *_random_tables(1, 10, 800),
+]
+
+MWU_SAMPLES = [
+    # Exact distribution: no ties and either sample has no more than 8 values
+    ([1], [2]),
+    ([3, 1, 4], [15, 9, 2, 6]),
+    ([60, 55, 42], list(range(10, 40))),
+    ([0.5, 2.5, 7.5, 1.5, 3.5, 8.5, 9.5, 4.5], [5, 6, 10, 11, 12, 13, 14, 15, 16]),
+    # Normal approximation: ties or large samples
+    ([60, 60, 60], [60, 60]),
+    ([60, 60, 20], [60, 60, 60, 60, 0]),
+    ([37, 37, 30, 12], [37, 40, 40, 37, 30, 30]),
+    (list(range(20)), list(range(5, 30))),
+]
+MWU_SAMPLES += _random_samples(2, 10, [0, 20, 60], 40)
+MWU_SAMPLES += _random_samples(3, 10, range(2, 42), 100)
+
+
+@pytest.mark.parametrize("alternative", ALTERNATIVES)
+@pytest.mark.parametrize("table", FISHER_TABLES)
+def test_fisher_exact_pvalue_matches_scipy(table, alternative):
+    expected = stats.fisher_exact(table, alternative=alternative)[1]
+    assert fisher_exact_pvalue(table, alternative) == pytest.approx(
+        expected, rel=1e-9, abs=1e-300
+    )
+
+
+def test_fisher_exact_pvalue_errors():
+    with pytest.raises(ValueError):
+        fisher_exact_pvalue(((-1, 2), (3, 4)))
+    with pytest.raises(ValueError):
+        fisher_exact_pvalue(((1, 2), (3, 4)), "both")
+
+
+@pytest.mark.parametrize("use_continuity", [True, False])
+@pytest.mark.parametrize("alternative", ALTERNATIVES)
+@pytest.mark.parametrize("x, y", MWU_SAMPLES)
+def test_mannwhitneyu_pvalue_matches_scipy(x, y, alternative, use_continuity):
+    expected = stats.mannwhitneyu(
+        x, y, use_continuity=use_continuity, alternative=alternative
+    ).pvalue
+    pvalue = mannwhitneyu_pvalue(
+        x, y, use_continuity=use_continuity, alternative=alternative
+    )
+    if math.isnan(expected):
+        assert math.isnan(pvalue)
+    else:
+        assert pvalue == pytest.approx(expected, rel=1e-9, abs=1e-300)
+
+
+def test_mannwhitneyu_pvalue_of_empty_sample():
+    assert math.isnan(mannwhitneyu_pvalue([], [1, 2, 3]))
+    assert math.isnan(mannwhitneyu_pvalue([1, 2, 3], []))
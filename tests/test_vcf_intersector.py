@@ -0,0 +1,52 @@
+from somaticseq.vcf_modifier import vcfIntersector
+
+VCF_HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def _vcf_line(contig: str, position: int, ref: str = "A", alt: str = "G") -> str:
+    return f"{contig}\t{position}\t.\t{ref}\t{alt}\t.\tPASS\t.\n"
+
+
+def test_partition_vcf(tmp_path, monkeypatch):
+    # Fewer open files than work units, so some are closed and appended to
+    monkeypatch.setattr(vcfIntersector, "PARTITION_MAX_OPEN_FILES", 2)
+    unit_regions = [
+        [("1", 0, 100)],
+        [("1", 50, 200), ("2", 0, 10)],
+        [("1", 300, 400)],
+        [("2", 5, 50)],
+        [("3", 0, 100)],
+    ]
+    vcf_lines = [
+        _vcf_line("1", 10),
+        _vcf_line("1", 60),
+        _vcf_line("1", 99, ref="AT", alt="A"),
+        _vcf_line("1", 250),
+        _vcf_line("2", 8),
+        _vcf_line("1", 350),
+        _vcf_line("2", 40),
+    ]
+    infile = tmp_path / "in.vcf"
+    infile.write_text(VCF_HEADER + "".join(vcf_lines))
+    bed_files, outfiles = [], []
+    for i, regions in enumerate(unit_regions):
+        bed_file = tmp_path / f"unit_{i}.bed"
+        bed_file.write_text(
+            "".join(f"{contig}\t{start}\t{end}\n" for contig, start, end in regions)
+        )
+        bed_files.append(str(bed_file))
+        outfiles.append(str(tmp_path / f"unit_{i}.vcf"))
+
+    assert vcfIntersector.partition_vcf(str(infile), bed_files, outfiles) == outfiles
+    expected = [
+        [0, 1, 2],
+        [1, 2, 4],
+        [5],
+        [4, 6],
+        [],
+    ]
+    for outfile, line_indices in zip(outfiles, expected):
+        with open(outfile) as out:
+            assert out.read() == VCF_HEADER + "".join(
+                vcf_lines[i] for i in line_indices
+            )